@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+import argparse
+import base64
+import http.server
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid as uuidlib
+
+from mcstats.util import merge_dict
+
+# Benchmark of the awards updater on a synthetic world
+#
+# A world with the given number of players is generated and update.py is run on
+# it end to end. Profile requests go to a local stub of Mojang's session server.
+# The phase timings and peak RSS are taken from the metrics the updater writes
+# to its database.
+
+# the phases reported by the updater
+phases = ['init', 'load', 'profiles', 'compute', 'rank', 'write']
+
+# the data version of the generated stats files (1.20.1)
+data_version = 3465
+
+# keys of the generated stats, by stats group
+# these are fixed so that results remain comparable when stats are added
+blocks = [
+    'stone', 'granite', 'diorite', 'andesite', 'deepslate', 'dirt', 'grass_block', 'netherrack', 'end_stone',
+    'coal_ore', 'iron_ore', 'gold_ore', 'diamond_ore', 'emerald_ore', 'lapis_ore', 'redstone_ore',
+    'nether_quartz_ore', 'ancient_debris', 'oak_log', 'birch_log', 'spruce_log', 'jungle_log', 'oak_leaves',
+    'glass', 'ice', 'packed_ice', 'sand', 'red_sand', 'gravel', 'clay', 'obsidian', 'oak_planks', 'torch',
+    'rail', 'white_wool', 'oak_stairs', 'cobblestone', 'cobblestone_wall', 'oak_sign', 'oak_sapling', 'kelp',
+    'cobweb', 'spawner', 'snow', 'snow_block', 'amethyst_cluster', 'bamboo', 'sugar_cane', 'cactus', 'wheat',
+    'carrots', 'potatoes', 'beetroots', 'melon', 'pumpkin', 'nether_wart', 'sweet_berry_bush', 'brown_mushroom',
+    'red_mushroom', 'sculk', 'sculk_sensor', 'tall_grass', 'dead_bush', 'honey_block', 'beehive',
+]
+items = [
+    'diamond_pickaxe', 'iron_pickaxe', 'stone_pickaxe', 'netherite_pickaxe', 'iron_axe', 'diamond_axe',
+    'stone_hoe', 'wooden_shovel', 'iron_shovel', 'diamond_sword', 'iron_sword', 'netherite_sword', 'bow',
+    'crossbow', 'trident', 'shield', 'fishing_rod', 'shears', 'flint_and_steel', 'iron_helmet',
+    'iron_chestplate', 'diamond_chestplate', 'elytra', 'bread', 'cookie', 'cake', 'cod', 'salmon', 'beef',
+    'cooked_beef', 'porkchop', 'mushroom_stew', 'carrot', 'golden_carrot', 'apple', 'golden_apple', 'melon_slice',
+    'pumpkin_pie', 'honey_bottle', 'milk_bucket', 'water_bucket', 'lava_bucket', 'bucket', 'paper', 'book',
+    'bookshelf', 'compass', 'clock', 'map', 'tnt', 'egg', 'snowball', 'ender_pearl', 'ender_eye', 'potion',
+    'firework_rocket', 'totem_of_undying', 'oak_boat', 'minecart', 'saddle', 'name_tag', 'lead', 'bone_meal',
+    'wheat_seeds', 'glass_bottle', 'dried_kelp', 'rabbit_stew', 'suspicious_stew', 'chorus_fruit',
+]
+mobs = [
+    'zombie', 'skeleton', 'creeper', 'spider', 'cave_spider', 'enderman', 'blaze', 'husk', 'stray', 'drowned',
+    'witch', 'slime', 'magma_cube', 'ghast', 'wither_skeleton', 'piglin', 'zombified_piglin', 'phantom',
+    'guardian', 'elder_guardian', 'shulker', 'endermite', 'silverfish', 'pillager', 'vindicator', 'evoker',
+    'ravager', 'ender_dragon', 'wither', 'warden', 'cow', 'pig', 'sheep', 'chicken', 'rabbit', 'horse',
+    'villager', 'iron_golem', 'squid', 'bat', 'bee', 'fox', 'goat', 'axolotl', 'turtle', 'panda', 'player',
+]
+custom = [
+    'play_time', 'total_world_time', 'time_since_death', 'time_since_rest', 'sneak_time', 'walk_one_cm',
+    'sprint_one_cm', 'crouch_one_cm', 'swim_one_cm', 'walk_on_water_one_cm', 'walk_under_water_one_cm',
+    'fall_one_cm', 'climb_one_cm', 'fly_one_cm', 'aviate_one_cm', 'boat_one_cm', 'minecart_one_cm',
+    'horse_one_cm', 'pig_one_cm', 'strider_one_cm', 'jump', 'deaths', 'mob_kills', 'player_kills',
+    'animals_bred', 'fish_caught', 'damage_dealt', 'damage_taken', 'damage_blocked_by_shield', 'damage_absorbed',
+    'damage_resisted', 'sleep_in_bed', 'open_chest', 'open_enderchest', 'open_shulker_box', 'open_barrel',
+    'trade_with_villager', 'talked_to_villager', 'enchant_item', 'drop', 'leave_game', 'bell_ring',
+    'play_record', 'play_noteblock', 'tune_noteblock', 'pot_flower', 'interact_with_anvil',
+    'interact_with_crafting_table', 'interact_with_furnace', 'interact_with_brewingstand', 'eat_cake_slice',
+    'fill_cauldron', 'use_cauldron', 'clean_armor', 'raid_trigger', 'raid_win', 'target_hit', 'inspect_hopper',
+]
+biomes = [
+    'plains', 'desert', 'forest', 'birch_forest', 'dark_forest', 'taiga', 'snowy_taiga', 'jungle', 'savanna',
+    'badlands', 'ocean', 'deep_ocean', 'warm_ocean', 'frozen_ocean', 'river', 'beach', 'swamp',
+    'mangrove_swamp', 'mushroom_fields', 'meadow', 'grove', 'snowy_slopes', 'jagged_peaks', 'stony_peaks',
+    'lush_caves', 'dripstone_caves', 'deep_dark', 'cherry_grove',
+]
+
+# stats groups and their keys and maximum values
+groups = [
+    ('minecraft:custom',    custom,         1000000),
+    ('minecraft:mined',     blocks,         20000),
+    ('minecraft:used',      items + blocks, 5000),
+    ('minecraft:crafted',   items + blocks, 1000),
+    ('minecraft:picked_up', items + blocks, 5000),
+    ('minecraft:dropped',   items + blocks, 1000),
+    ('minecraft:broken',    items,          50),
+    ('minecraft:killed',    mobs,           2000),
+    ('minecraft:killed_by', mobs,           20),
+]
+
+# generate a synthetic server with a world for the given number of players
+# density is the average fraction of the keys of each stats group that players have
+# returns the path of the server
+def generate_server(root, num_players, density = 0.5, seed = 1, now = None):
+    rng = random.Random(seed)
+    if now is None:
+        now = int(time.time())
+
+    server = os.path.join(root, 'server')
+    statsDir = os.path.join(server, 'world', 'stats')
+    advancementsDir = os.path.join(server, 'world', 'advancements')
+    os.makedirs(statsDir, exist_ok=True)
+    os.makedirs(advancementsDir, exist_ok=True)
+
+    with open(os.path.join(server, 'server.properties'), 'w') as f:
+        f.write('motd=Benchmark Server\n')
+
+    usercache = []
+    for i in range(num_players):
+        uuid = str(uuidlib.UUID(int=rng.getrandbits(128), version=4))
+
+        # stats
+        stats = dict()
+        for group, keys, maximum in groups:
+            k = min(len(keys), max(0, int(rng.gauss(density, 0.15) * len(keys))))
+            stats[group] = {'minecraft:' + key: rng.randint(1, maximum) for key in rng.sample(keys, k)}
+
+        # some players never played long enough to be ranked
+        stats['minecraft:custom']['minecraft:play_time'] = int(rng.expovariate(1 / 2000000))
+
+        statsFile = os.path.join(statsDir, uuid + '.json')
+        with open(statsFile, 'w') as f:
+            json.dump({'stats': stats, 'DataVersion': data_version}, f)
+
+        last = now - int(rng.expovariate(1 / (14 * 86400)))
+        os.utime(statsFile, (last, last))
+
+        # advancements
+        if rng.random() < 0.9:
+            visited = rng.sample(biomes, rng.randint(1, len(biomes)))
+            advancements = {
+                'minecraft:adventure/adventuring_time': {
+                    'criteria': {'minecraft:' + b: '2023-01-01 00:00:00 +0000' for b in visited},
+                    'done': len(visited) == len(biomes),
+                },
+                'minecraft:story/root': {
+                    'criteria': {'crafting_table': '2023-01-01 00:00:00 +0000'},
+                    'done': True,
+                },
+                'DataVersion': data_version,
+            }
+
+            with open(os.path.join(advancementsDir, uuid + '.json'), 'w') as f:
+                json.dump(advancements, f)
+
+        usercache.append({'uuid': uuid, 'name': 'Player' + str(i), 'expiresOn': '2099-01-01 00:00:00 +0000'})
+
+    with open(os.path.join(server, 'usercache.json'), 'w') as f:
+        json.dump(usercache, f)
+
+    for filename in ['banned-players.json', 'ops.json']:
+        with open(os.path.join(server, filename), 'w') as f:
+            json.dump([], f)
+
+    return server
+
+# write the updater configuration for a generated server
+# the overrides are merged into the configuration
+# returns the path of the configuration file
+def write_config(root, server, profile_api_url, overrides = None):
+    config = {
+        'database': os.path.join(root, 'data'),
+        'server': {
+            'sources': [{'path': server, 'worldName': 'world'}],
+        },
+        'players': {
+            'profileFetchConcurrency': 4,
+            'profileFetchRate': 0,
+            'profileApiUrl': profile_api_url,
+        },
+    }
+    if overrides:
+        merge_dict(config, overrides)
+
+    configFile = os.path.join(root, 'config.json')
+    with open(configFile, 'w') as f:
+        json.dump(config, f, indent=4)
+
+    return configFile
+
+# Handler of the session server stub, answers every request with a profile
+class StubProfileHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        compact_uuid = self.path.rsplit('/', 1)[-1]
+        textures = {'textures': {'SKIN': {'url': 'http://textures.minecraft.net/texture/' + compact_uuid}}}
+        body = json.dumps({
+            'id': compact_uuid,
+            'name': 'Player_' + compact_uuid[:8],
+            'properties': [{'name': 'textures', 'value': base64.b64encode(json.dumps(textures).encode()).decode()}],
+        }).encode()
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+# Stub of Mojang's session server running in a background thread
+class StubSessionServer:
+    def __init__(self):
+        self.httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StubProfileHandler)
+        self.httpd.daemon_threads = True
+        self.url = 'http://127.0.0.1:' + str(self.httpd.server_address[1]) + '/session/minecraft/profile/'
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+# run the updater once
+# returns the metrics of the update along with the wall time of the whole process ('process')
+def run_update(config_file, database, update_args = ()):
+    awardsDir = os.path.dirname(os.path.abspath(__file__))
+
+    t = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, os.path.join(awardsDir, 'update.py'), config_file] + list(update_args),
+        cwd=awardsDir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    wall = time.perf_counter() - t
+
+    if result.returncode != 0:
+        raise RuntimeError('update failed:\n' + result.stdout.decode(errors='replace'))
+
+    with open(os.path.join(database, 'metrics.json')) as f:
+        metrics = json.load(f)
+
+    metrics['process'] = round(wall, 6)
+    return metrics
+
+# generate a server and run the updater on it the given number of times
+# the first run fetches all profiles from the stub and writes the database from scratch
+# returns the metrics of each run
+def run_benchmark(root, num_players, density = 0.5, seed = 1, runs = 1, update_args = ()):
+    server = generate_server(root, num_players, density, seed)
+
+    results = []
+    with StubSessionServer() as stub:
+        configFile = write_config(root, server, stub.url)
+        for i in range(runs):
+            results.append(run_update(configFile, os.path.join(root, 'data'), update_args))
+
+    return results
+
+# print the results of a benchmark as a table
+# wall and CPU times are given for each run
+def print_results(results):
+    print('{:<16}'.format('') + ''.join('{:>20}'.format('run ' + str(i + 1)) for i in range(len(results))))
+    print('{:<16}'.format('phase') + '{:>10}{:>10}'.format('wall', 'cpu') * len(results))
+    for phase in phases + ['total']:
+        row = '{:<16}'.format(phase)
+        for metrics in results:
+            if phase == 'total':
+                t = metrics['total']
+            else:
+                t = metrics['phases'][phase]
+
+            row += '{:>9.3f}s{:>9.3f}s'.format(t['wall'], t['cpu'])
+
+        print(row)
+
+    print('{:<16}'.format('process') + ''.join('{:>9.3f}s{:>10}'.format(m['process'], '') for m in results))
+    print('{:<16}'.format('peak RSS') + ''.join('{:>18.1f}MB'.format(m['peakRss'] / 1048576) for m in results))
+
+    for name in sorted(results[0]['counters']):
+        print('{:<16}'.format(name) + ''.join('{:>20}'.format(m['counters'].get(name, 0)) for m in results))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the awards updater on a synthetic world; '
+        + 'unknown arguments are passed to update.py')
+    parser.add_argument('--players', type=int, default=1000,
+                        help='number of players to generate (default 1000)')
+    parser.add_argument('--density', type=float, default=0.5,
+                        help='average fraction of possible stats every player has (default 0.5)')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='random seed of the generator (default 1)')
+    parser.add_argument('--runs', type=int, default=2,
+                        help='number of consecutive updates (default 2)')
+    parser.add_argument('--dir', type=str, default=None,
+                        help='directory to generate the world in, kept after the benchmark (default: temporary)')
+    args, updateArgs = parser.parse_known_args()
+
+    root = args.dir if args.dir else tempfile.mkdtemp(prefix='awards-benchmark-')
+    try:
+        print('generating ' + str(args.players) + ' players in ' + root + ' ...')
+        results = run_benchmark(root, args.players, args.density, args.seed, args.runs, updateArgs)
+        print_results(results)
+    finally:
+        if not args.dir:
+            shutil.rmtree(root)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,18 @@
+import pytest
+
+import benchmark
+from mcstats import engine
+
+# makeconfig.py is a legacy command-line script that parses its arguments on
+# import, so it cannot be collected by --doctest-modules
+collect_ignore = ['makeconfig.py']
+
+# create the configuration for a generated server, with profiles fetched from a stub session server
+# the fixture is a function of the root directory, the server path and overrides of the configuration
+@pytest.fixture
+def make_config():
+    with benchmark.StubSessionServer() as stub:
+        def make(root, serverPath, **overrides):
+            return engine.load_config(benchmark.write_config(root, serverPath, stub.url, overrides))
+
+        yield make
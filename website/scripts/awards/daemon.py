@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+import argparse
+import datetime
+import signal
+import sys
+import time
+from typing import Optional
+from typing import Set
+
+from mcstats import engine
+from mcstats import live
+from mcstats import watch
+from mcstats.util import handle_error
+
+# print a status line
+def log(msg):
+    print(datetime.datetime.now().strftime("%H:%M:%S"), '', msg, flush=True)
+
+# stop gracefully when terminated
+def terminate(signum, frame):
+    sys.exit(0)
+
+# run the daemon
+def main():
+    # Parse command-line arguments
+    parser = argparse.ArgumentParser(description='Keep MinecraftStats up to date while the server is running')
+    parser.add_argument('config', type=str, help='the configuration to use')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only re-read player data files that changed since the previous full update')
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help='number of processes used to read player data files in full updates (default 1)')
+    parser.add_argument('--write-threads', type=int, default=4,
+                        help='number of threads used to write the database files (default 4)')
+    parser.add_argument('--sqlite', action='store_true',
+                        help='keep the players and their stats in an SQLite database (awards.sqlite) instead of players.json')
+    parser.add_argument('--no-player-files', action='store_true',
+                        help='do not write the player data, player cache and player list files, which are then served by ' +
+                             'serve.py from the SQLite database (requires --sqlite)')
+    parser.add_argument('--debounce', type=float, default=30,
+                        help='seconds to collect changes before writing the database (default 30)')
+    parser.add_argument('--poll-interval', type=float, default=10,
+                        help='seconds between scans of the player data directories if inotify is not available (default 10)')
+    parser.add_argument('--full-interval', type=float, default=86400,
+                        help='seconds between full updates, 0 to disable (default 86400)')
+
+    args = parser.parse_args()
+
+    signal.signal(signal.SIGTERM, terminate)
+
+    try:
+        config = engine.load_config(args.config)
+
+        updater = engine.Engine(
+            config,
+            jobs=args.jobs,
+            incrementalUpdate=args.incremental,
+            writeThreads=args.write_threads,
+            sqliteStore=args.sqlite,
+            writePlayerFiles=not args.no_player_files)
+
+        # watch before the first update so that no changes are missed
+        watcher = watch.create_watcher(updater.statsDirs + updater.advancementDirs, args.poll_interval)
+        try:
+            liveUpdater = live.LiveUpdater(updater)
+            liveUpdater.rebuild()
+            lastRebuild = time.monotonic()
+            log('full update finished, watching for changes')
+
+            pending: Optional[Set[str]] = set()
+            nextFlush = time.monotonic() + args.debounce
+            while True:
+                changed = watcher.wait(max(0, nextFlush - time.monotonic()))
+                if changed is None:
+                    pending = None # events were lost
+                elif pending is not None:
+                    pending |= changed
+
+                if time.monotonic() < nextFlush:
+                    continue
+
+                if args.full_interval > 0 and time.monotonic() - lastRebuild >= args.full_interval:
+                    pending = None
+
+                if pending is None:
+                    liveUpdater.rebuild()
+                    lastRebuild = time.monotonic()
+                    log('full update finished')
+                else:
+                    updateMetrics = liveUpdater.update(pending)
+                    if updateMetrics:
+                        log('updated ' + str(len(pending)) + ' players, ' +
+                            str(updateMetrics['counters'].get('filesWritten', 0)) + ' files written')
+
+                pending = set()
+                nextFlush = time.monotonic() + args.debounce
+        finally:
+            watcher.close()
+            updater.close()
+    except engine.UpdateError as e:
+        handle_error('ERROR: ' + str(e), True)
+    except KeyboardInterrupt:
+        log('stopped')
+
+if __name__ == '__main__':
+    main()
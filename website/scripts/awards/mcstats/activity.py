@@ -0,0 +1,107 @@
+import os
+import sqlite3
+
+from mcstats import jsonio
+
+# encode the signature of a player's data files for the index
+def encode_signature(signature):
+    return jsonio.dumps(signature).decode()
+
+# Index of player activity
+#
+# For every player, the index holds the signature of the data files along with
+# the last online time, total play time and data version found in them. It is
+# an SQLite table in the awards database that is updated row by row, so only
+# players whose data changed are written.
+#
+# As long as the signature of a player's files matches, whether the player is
+# eligible for the stats at all can be decided without opening any of them.
+class ActivityIndex:
+    def __init__(self, filename):
+        self.filename = filename
+        self.entries = dict() # UUID -> (files, last, playtime, version)
+        self.changed = dict()
+        self.removed = set()
+
+    def connect(self):
+        db = sqlite3.connect(self.filename)
+        db.execute('PRAGMA synchronous = NORMAL')
+
+        # the index used to hold profile update times, it is rebuilt without them
+        if 'profileUpdate' in [row[1] for row in db.execute('PRAGMA table_info(activity)')]:
+            db.execute('DROP TABLE activity')
+
+        db.execute('''CREATE TABLE IF NOT EXISTS activity (
+            uuid TEXT PRIMARY KEY,
+            files TEXT NOT NULL,
+            last INTEGER NOT NULL,
+            playtime INTEGER NOT NULL,
+            version INTEGER NOT NULL
+        ) WITHOUT ROWID''')
+        return db
+
+    # load the index from the database
+    def load(self):
+        self.entries = dict()
+        self.changed = dict()
+        self.removed = set()
+
+        if not os.path.isfile(self.filename):
+            return
+
+        try:
+            db = self.connect()
+            try:
+                for row in db.execute('SELECT uuid, files, last, playtime, version FROM activity'):
+                    self.entries[row[0]] = row[1:]
+            finally:
+                db.close()
+        except sqlite3.Error as e:
+            print('discarding unreadable activity index ' + self.filename + ': ' + str(e))
+
+    # get the last online time, play time and data version of a player if the data files did not change
+    def get(self, uuid, signature):
+        entry = self.entries.get(uuid)
+        if entry and entry[0] == encode_signature(signature):
+            return entry[1:]
+        else:
+            return None
+
+    # get the encoded signature of a player's data files, None if unknown
+    def getSignature(self, uuid):
+        entry = self.entries.get(uuid)
+        return entry[0] if entry else None
+
+    def set(self, uuid, entry):
+        if self.entries.get(uuid) != entry:
+            self.entries[uuid] = entry
+            self.changed[uuid] = entry
+            self.removed.discard(uuid)
+
+    # store the data extracted from a player's data files
+    def put(self, uuid, signature, last, playtimeTicks, version):
+        self.set(uuid, (encode_signature(signature), last, playtimeTicks, version))
+
+    # remove all players except the given ones
+    def retain(self, uuids):
+        for uuid in [uuid for uuid in self.entries if not uuid in uuids]:
+            del self.entries[uuid]
+            self.changed.pop(uuid, None)
+            self.removed.add(uuid)
+
+    # write the changed rows to the database
+    def save(self):
+        if not (self.changed or self.removed):
+            return
+
+        db = self.connect()
+        try:
+            with db:
+                db.executemany('DELETE FROM activity WHERE uuid = ?', [(uuid,) for uuid in self.removed])
+                db.executemany('INSERT OR REPLACE INTO activity VALUES (?, ?, ?, ?, ?)',
+                    [(uuid,) + tuple(entry) for uuid, entry in self.changed.items()])
+        finally:
+            db.close()
+
+        self.changed = dict()
+        self.removed = set()
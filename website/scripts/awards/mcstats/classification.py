@@ -0,0 +1,86 @@
+import json
+import os
+
+from mcstats import jsonio
+from mcstats import output
+
+cacheVersion = 1
+
+# Cache of the key classifications of the reader plan's group matchers
+#
+# Matching a key against the patterns of all StatSumMatchReaders of a group is
+# done once per distinct key in every update. The set of item and block keys is
+# small and rarely changes, so the results are persisted and only keys that
+# were never seen before need to be matched.
+#
+# Slots are specific to a compiled plan, so the classification of a key is
+# stored as the indices of the matching readers within the group. A group's
+# classifications are only reused if its readers and their patterns are
+# unchanged.
+class ClassificationCache:
+    def __init__(self, filename):
+        self.filename = filename
+        self.changed = False
+
+    # signature of a group matcher - the patterns of its readers in order
+    @staticmethod
+    def matcherSignature(matcher):
+        return [list(reader.patterns) for slot, reader in matcher.readers]
+
+    # load the cached classifications into the plan's group matchers
+    # returns the number of keys loaded
+    def load(self, readerPlan):
+        if not os.path.isfile(self.filename):
+            return 0
+
+        try:
+            cache = jsonio.load(self.filename)
+            if cache.get('version') != cacheVersion:
+                return 0
+
+            groups = cache['groups']
+        except Exception as e:
+            print('discarding unreadable classification cache ' + self.filename + ': ' + str(e))
+            return 0
+
+        n = 0
+        for group in readerPlan.matcherGroups():
+            entry = groups.get(json.dumps(group.path))
+            matcher = group.matcher
+            if entry is None or entry.get('readers') != self.matcherSignature(matcher):
+                self.changed = True
+                continue
+
+            slots = [slot for slot, reader in matcher.readers]
+            targets = matcher.targets
+            for key, readerTargets in entry['keys'].items():
+                if not key in targets:
+                    targets[key] = tuple((slots[i], count) for i, count in readerTargets)
+                    n += 1
+
+        return n
+
+    # note that keys were classified since the cache was loaded
+    def update(self, numClassified):
+        if numClassified > 0:
+            self.changed = True
+
+    # write the classifications of the plan's group matchers if they changed
+    def save(self, readerPlan):
+        if not self.changed:
+            return
+
+        groups = dict()
+        for group in readerPlan.matcherGroups():
+            matcher = group.matcher
+            readerIndex = {slot: i for i, (slot, reader) in enumerate(matcher.readers)}
+            groups[json.dumps(group.path)] = {
+                'readers': self.matcherSignature(matcher),
+                'keys':    {key: [[readerIndex[slot], count] for slot, count in targets] for key, targets in matcher.targets.items()},
+            }
+
+        output.write_atomic(self.filename, jsonio.dumps({
+            'version': cacheVersion,
+            'groups':  groups,
+        }))
+        self.changed = False
@@ -0,0 +1,129 @@
+try:
+    import numpy
+except ImportError:
+    numpy = None # type: ignore[assignment]
+
+# test whether the columnar engine can be used
+def available():
+    return numpy is not None
+
+# Dense matrix of the stat values of all players
+#
+# Rows are players, columns are stats. Instead of keeping a dict of values per
+# player and a list of ranking entries per stat, all values are stored in a
+# single matrix and the rankings of all stats are computed at once.
+class StatMatrix:
+    def __init__(self, stats, uuids):
+        self.stats = stats
+        self.statIndex = {mcstat.name: j for j, mcstat in enumerate(stats)}
+        self.uuids = list(uuids)
+        self.uuidIndex = {uuid: i for i, uuid in enumerate(self.uuids)}
+
+        n = len(self.uuids)
+        m = len(self.stats)
+        self.values = numpy.zeros((n, m), dtype=numpy.int64)
+        self.versions = numpy.zeros(n, dtype=numpy.int64)
+        self.valid = numpy.zeros(n, dtype=bool)
+        self.active = numpy.zeros(n, dtype=bool)
+
+        self.minVersions = numpy.array([mcstat.minVersion for mcstat in stats], dtype=numpy.float64)
+        self.maxVersions = numpy.array([mcstat.maxVersion for mcstat in stats], dtype=numpy.float64)
+        self.relevant = numpy.array([mcstat.playerStatRelevant for mcstat in stats], dtype=bool)
+        self.names = [mcstat.name for mcstat in stats]
+
+        # position of each player in the order of UUIDs, used to break ties
+        self.uuidOrder = numpy.argsort(numpy.argsort(numpy.array(self.uuids, dtype=str)))
+
+        self.ranked = numpy.zeros(m, dtype=bool)
+        self.order = None
+        self.counts = None
+        self.ranks = None
+        self.output = None
+
+    # store the stat values of a player
+    def setPlayer(self, uuid, version, active, values):
+        i = self.uuidIndex[uuid]
+        self.valid[i] = True
+        self.active[i] = active
+        self.versions[i] = version
+
+        row = self.values[i]
+        for name, value in values.items():
+            j = self.statIndex.get(name)
+            if j is not None:
+                row[j] = value
+
+    # get the mask of stats available for each player
+    def present(self):
+        versions = self.versions[:, None]
+        return self.valid[:, None] & (self.minVersions <= versions) & (versions <= self.maxVersions)
+
+    # compute the rankings for the given stats
+    # like MinecraftStat, only active players with a value greater than zero enter a ranking
+    def rank(self, stats):
+        n = len(self.uuids)
+        m = len(self.stats)
+
+        self.ranked[:] = False
+        for mcstat in stats:
+            self.ranked[self.statIndex[mcstat.name]] = True
+
+        present = self.present()
+        self.output = present & self.relevant
+
+        entered = present & self.active[:, None] & (self.values > 0) & self.ranked
+        keys = numpy.where(entered, self.values, -1)
+        tiebreak = numpy.broadcast_to(self.uuidOrder[:, None], (n, m))
+
+        # sort by value, then by UUID, descending
+        self.order = numpy.lexsort((tiebreak, keys), axis=0)[::-1]
+        self.counts = entered.sum(axis=0)
+
+        positions = numpy.arange(n)[:, None]
+        self.ranks = numpy.zeros((n, m), dtype=numpy.int64)
+        self.ranks[self.order, numpy.arange(m)] = numpy.where(positions < self.counts, positions + 1, 0)
+
+    # get the ranking of a stat as a list of (uuid, value) pairs
+    def ranking(self, name):
+        j = self.statIndex[name]
+        rows = self.order[:self.counts[j], j]
+        return list(zip([self.uuids[i] for i in rows.tolist()], self.values[rows, j].tolist()))
+
+    # compute the crown scores of all players
+    # returns a matrix with a row of [crown score, gold, silver, bronze] for each player
+    def crownScores(self, gold, silver, bronze):
+        n = len(self.uuids)
+        medals = numpy.zeros((n, 3), dtype=numpy.int64)
+        for place in range(3):
+            columns = numpy.nonzero(self.ranked & (self.counts > place))[0]
+            medals[:, place] = numpy.bincount(self.order[place, columns], minlength=n)
+
+        score = medals @ numpy.array([gold, silver, bronze], dtype=numpy.int64)
+        return numpy.column_stack((score, medals))
+
+    # compute the hall of fame as a list of (uuid, [crown score, gold, silver, bronze]) pairs
+    # only active players with a crown score greater than zero are listed
+    def hallOfFame(self, gold, silver, bronze):
+        scores = self.crownScores(gold, silver, bronze)
+        candidates = numpy.nonzero(self.valid & self.active & (scores[:, 0] > 0))[0]
+
+        s = scores[candidates]
+        order = numpy.lexsort((self.uuidOrder[candidates], s[:, 3], s[:, 2], s[:, 1], s[:, 0]))[::-1]
+        return [(self.uuids[i], score) for i, score in zip(candidates[order].tolist(), s[order].tolist())]
+
+    # get the stats of a player in the form of the player data files
+    def playerStats(self, uuid):
+        i = self.uuidIndex[uuid]
+        columns = numpy.nonzero(self.output[i])[0]
+        values = self.values[i, columns].tolist()
+        ranks = self.ranks[i, columns].tolist()
+
+        playerStats = dict()
+        for j, value, rank in zip(columns.tolist(), values, ranks):
+            entry = {'value': value}
+            if rank > 0:
+                entry['rank'] = rank
+
+            playerStats[self.names[j]] = entry
+
+        return playerStats
@@ -14,10 +14,18 @@ defaultConfig = {
         "defaultLanguage": "en",     # the default client language
         "playersPerPage": 100,       # how many players to display per page
         "playerCacheUUIDPrefix": 2,  # length of UUID prefix for player cache - more = smaller caches
-        "showLastOnline": True       # whether to show the last online time in the browser
+        "showLastOnline": True,      # whether to show the last online time in the browser
+        "precompress": True,         # write pre-compressed .gz (and .br) siblings of JSON files for the web server
+        "pagedRankings": False,      # write rankings as pages of playersPerPage entries along with a head file
+        "rankingDeltas": False,      # with paged rankings, also write the changes since the previous ranking
+        "playerSearch": True         # write an index for searching players by name prefix
     },
     "players": {
         "profileUpdateInterval": 3,  # update profile after this many days
+        "profileFetchConcurrency": 4, # number of concurrent requests to Mojang's API
+        "profileFetchRate": 1,       # maximum number of requests to Mojang's API per second (0 = unlimited)
+        "profileFetchTimeout": 10,   # timeout for requests to Mojang's API in seconds
+        "profileApiUrl": "https://sessionserver.mojang.com/session/minecraft/profile/", # URL of the profile API
         "updateInactive": False,     # also update profile for inactive players
         "inactiveDays": 7,           # number of offline days before a player is considered inactive
         "minPlaytime": 60,           # number of minutes a player must have played before entering stats
@@ -31,4 +39,9 @@ defaultConfig = {
         "bronze": 1                  # crown score worth of a bronze medal
     },
     "events": [],                    # list of events
+    "timeseries": {
+        "enabled": False,            # record the changes of all stats with every update
+        "downsampleDays": 7,         # merge the changes of a day into one record after this many days
+        "retentionDays": 0           # delete the changes of days older than this (0 = keep forever)
+    },
 }
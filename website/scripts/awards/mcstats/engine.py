@@ -0,0 +1,1185 @@
+import collections
+import concurrent.futures
+import copy
+import datetime
+import glob
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+
+import javaproperties
+import mojang
+
+from mcstats import activity
+from mcstats import classification
+from mcstats import eventhistory
+from mcstats import incremental
+from mcstats import jsonio
+from mcstats import loader
+from mcstats import lowmem
+from mcstats import mcstats
+from mcstats import metrics
+from mcstats import output
+from mcstats import plan
+from mcstats import playersearch
+from mcstats import snapshot
+from mcstats import store
+from mcstats import timeseries
+from mcstats.config import defaultConfig
+from mcstats.util import handle_error
+from mcstats.util import RecursiveNamespace
+from mcstats.util import merge_dict
+
+# Error that prevents an update
+class UpdateError(Exception):
+    pass
+
+# load a configuration file, merged into the default configuration
+# if the file does not exist, the default configuration is written to it
+def load_config(filename):
+    configJson = copy.deepcopy(defaultConfig)
+
+    if os.path.isfile(filename):
+        try:
+            loadedConfigJson = jsonio.load(filename)
+        except Exception as e:
+            raise UpdateError('failed to load config JSON: ' + str(e))
+
+        merge_dict(configJson, loadedConfigJson)
+    else:
+        # save default
+        print('writing default config to ' + filename)
+        with open(filename, 'w') as configFile:
+            json.dump(configJson, configFile, indent=4)
+
+    return RecursiveNamespace(**configJson)
+
+# load the stat registry, restored from its snapshot in the awards database if the stat modules did not change
+# without a database, the stat modules are imported and no snapshot is written
+# the registry is only loaded once, so this may be called any number of times
+def load_registry(database = None):
+    return snapshot.load_registry(os.path.join(database, 'registry-snapshot.json') if database else None)
+
+# get the sources (server path and world name) from the configuration
+def collect_sources(config):
+    sources = []
+    if hasattr(config.server, 'path') and config.server.path:
+        handle_error('server.path is deprecated, please use server.sources instead to configure your paths')
+
+        worldName = config.server.worldName
+        if isinstance(config.server.path, list):
+            serverPaths = config.server.path
+        else:
+            serverPaths = [config.server.path]
+
+        for path in serverPaths:
+            sources.append((path, worldName))
+
+    if isinstance(config.server.sources, list):
+        for e in config.server.sources:
+            sources.append((e.path, e.worldName))
+
+    if len(sources) == 0:
+        raise UpdateError('server.sources not configured, please consult the documentation and edit the configuration')
+
+    for (path, worldName) in sources:
+        if not os.path.isdir(path):
+            raise UpdateError('invalid path in server.sources: ' + str(path))
+
+    return sources
+
+# number of the best players in the head file of a paged ranking
+rankingHeadSize = 10
+
+# event definitions
+Event = collections.namedtuple('Event', ['name', 'title', 'stat', 'startTime', 'endTime', 'historyInterval'])
+eventTimeFormat = '%Y-%m-%d %H:%M'
+
+# get the event definitions from the configuration
+def parse_events(config, statByName):
+    events = []
+    eventNames = set()
+
+    for e in config.events:
+        if e.name in statByName:
+            handle_error('ERROR: event name must not collide with a stat name: \"' + e.name + '\"')
+            continue
+
+        if e.name in eventNames:
+            handle_error('ERROR: duplicate event name: \"' + e.name + '\"')
+            continue
+
+        if not e.stat in statByName:
+            handle_error('ERROR: event \"' + e.name + '\" refers to unknown stat "' + e.stat + '"')
+            continue
+
+        stat = statByName[e.stat]
+        startTime = int(datetime.datetime.strptime(e.startTime, eventTimeFormat).timestamp())
+        endTime = int(datetime.datetime.strptime(e.endTime, eventTimeFormat).timestamp())
+
+        if startTime >= endTime:
+            handle_error('ERROR: event \"' + e.name + '\": end time (' + e.endTime + ' is before start time (' + e.startTime + ')')
+            continue
+
+        # length of the history buckets, given in minutes
+        if hasattr(e, 'historyInterval'):
+            historyInterval = int(60 * e.historyInterval)
+            if historyInterval <= 0:
+                handle_error('ERROR: event \"' + e.name + '\": history interval must be positive')
+                continue
+        else:
+            historyInterval = eventhistory.defaultInterval
+
+        events.append(Event(title=e.title, name=e.name, stat=stat, startTime=startTime, endTime=endTime, historyInterval=historyInterval))
+        eventNames.add(e.name)
+
+    return events
+
+# Awards engine
+#
+# Computes the awards database from the configured sources. Everything that does
+# not depend on the player data is set up once and kept between updates: the
+# stat registry, the compiled extraction plan, the worker processes and the
+# incremental and profile caches. This way, a long-running process can update
+# regularly without paying for the setup every time.
+#
+# The time of each update is taken from the given clock.
+class Engine:
+    def __init__(self, config, clock = time.time, jobs = 1, engine = 'default', incrementalUpdate = False, writeThreads = 4, sqliteStore = False, writePlayerFiles = True):
+        self.config = config
+        self.clock = clock
+        self.jobs = jobs
+        self.writeThreads = writeThreads
+        self.pool = None
+
+        # without the player files, players can only be queried from the SQLite player database
+        if not (writePlayerFiles or sqliteStore):
+            raise UpdateError('the player files can only be omitted when using the SQLite player database')
+
+        self.writePlayerFiles = writePlayerFiles
+
+        if engine == 'columnar':
+            from mcstats import columnar # imported on demand, loading numpy takes a while
+            if not columnar.available():
+                raise UpdateError('the columnar engine requires numpy')
+
+        self.columnar = (engine == 'columnar')
+        self.lowMemory = (engine == 'lowmem')
+
+        # stats
+        self.registry = load_registry(config.database)
+        self.statByName = dict()
+        for mcstat in self.registry:
+            self.statByName[mcstat.name] = mcstat
+
+        mcstats.CrownScore.gold = config.crown.gold
+        mcstats.CrownScore.silver = config.crown.silver
+        mcstats.CrownScore.bronze = config.crown.bronze
+
+        # sources
+        self.sources = collect_sources(config)
+        self.statsDirs = []
+        self.advancementDirs = []
+
+        for (path, worldName) in self.sources:
+            worldDir = os.path.join(path, worldName)
+            self.statsDirs.append(os.path.join(worldDir, 'stats'))
+            self.advancementDirs.append(os.path.join(worldDir, 'advancements'))
+
+        self.primaryServerPath = self.sources[0][0]
+
+        # players
+        self.inactiveTime = 86400 * config.players.inactiveDays
+        self.minPlaytime = config.players.minPlaytime
+        self.profileUpdateInterval = 86400 * config.players.profileUpdateInterval
+
+        # database paths
+        self.dbRankingsPath = os.path.join(config.database, 'rankings')
+        self.dbPlayerDataPath = os.path.join(config.database, 'playerdata')
+        self.dbPlayerCachePath = os.path.join(config.database, 'playercache')
+        self.dbPlayerSearchPath = os.path.join(config.database, 'playersearch')
+        self.dbTimeSeriesPath = os.path.join(config.database, 'timeseries')
+        self.dbEventsPath = os.path.join(config.database, 'events')
+
+        self.playerCacheQ = config.client.playerCacheUUIDPrefix
+        self.playersPerPage = config.client.playersPerPage
+        self.pagedRankings = config.client.pagedRankings
+        self.rankingDeltas = config.client.rankingDeltas
+
+        self.dbPlayersFilename = os.path.join(config.database, 'players.json')
+        self.dbStatsCacheFilename = os.path.join(config.database, 'incremental.sqlite')
+        self.dbClassificationFilename = os.path.join(config.database, 'classification.json')
+        self.dbActivityFilename = os.path.join(config.database, 'activity.sqlite')
+        self.dbStoreFilename = os.path.join(config.database, 'awards.sqlite')
+        self.dbProfileCacheFilename = os.path.join(config.database, 'profiles.json')
+        self.dbSummaryFilename = os.path.join(config.database, 'summary.json.gz')
+        self.dbMetricsFilename = os.path.join(config.database, 'metrics.json')
+
+        self.dbPlayerListPath = os.path.join(config.database, 'playerlist')
+        self.dbPlayerListAllFilename = os.path.join(self.dbPlayerListPath, 'all{}.json.gz')
+        self.dbPlayerListActiveFilename = os.path.join(self.dbPlayerListPath, 'active{}.json.gz')
+
+        # events
+        self.events = parse_events(config, self.statByName)
+        self.eventStats = []
+        self.eventHistories = dict()
+        for e in self.events:
+            self.eventStats.append(mcstats.EventStat(e.name, e.title, e.stat, e.startTime, e.endTime))
+            self.eventHistories[e.name] = eventhistory.EventHistory(
+                os.path.join(self.dbEventsPath, e.name + '.history.jsonl'), e.startTime, e.historyInterval)
+
+        # compile registry and event stats into a single extraction plan
+        self.readerPlan = plan.compile(self.registry + self.eventStats)
+        self.playerLoader = loader.PlayerLoader(self.statsDirs, self.advancementDirs, self.readerPlan, self.minPlaytime)
+
+        # load the activity index
+        self.activityIndex = activity.ActivityIndex(self.dbActivityFilename)
+        self.activityIndex.load()
+
+        # load the key classifications of previous updates
+        self.classificationCache = classification.ClassificationCache(self.dbClassificationFilename)
+        self.classificationCache.load(self.readerPlan)
+
+        # index for searching players by name
+        if config.client.playerSearch:
+            self.playerSearch = playersearch.PlayerSearchIndex(self.dbPlayerSearchPath)
+        else:
+            self.playerSearch = None
+
+        # load the state of the stat time series
+        if config.timeseries.enabled:
+            self.timeSeries = timeseries.StatTimeSeries(self.dbTimeSeriesPath, self.registry,
+                config.timeseries.downsampleDays, config.timeseries.retentionDays)
+            self.timeSeries.load()
+        else:
+            self.timeSeries = None
+
+        # load the incremental cache
+        if incrementalUpdate:
+            self.statsCache = incremental.PlayerStatsCache(self.dbStatsCacheFilename, incremental.registry_signature(self.events))
+            self.statsCache.load()
+        else:
+            self.statsCache = None
+
+        # the SQLite player database replaces players.json if enabled
+        if sqliteStore:
+            self.playerStore = store.PlayerStore(self.dbStoreFilename)
+        else:
+            self.playerStore = None
+
+        # profile fetching via Mojang API
+        self.profileCache = mojang.ProfileCache(self.dbProfileCacheFilename, self.profileUpdateInterval)
+        self.profileCache.load()
+
+        self.profileFetcher = mojang.ProfileFetcher(
+            concurrency=config.players.profileFetchConcurrency,
+            rate=config.players.profileFetchRate,
+            timeout=config.players.profileFetchTimeout,
+            cache=self.profileCache,
+            url=config.players.profileApiUrl)
+
+    # shut down the worker processes
+    def close(self):
+        if self.pool:
+            self.pool.shutdown()
+            self.pool = None
+
+        if self.playerStore:
+            self.playerStore.close()
+
+    # test whether a player counts as active at the given time
+    def isActive(self, last, now):
+        return ((now - last) <= self.inactiveTime)
+
+    # test whether a player's profile is due for an update
+    def needsProfileUpdate(self, player, active, now):
+        if (not 'name' in player) or active or self.config.players.updateInactive:
+            if 'update' in player:
+                update_time = player['update']
+            else:
+                update_time = 0
+
+            return (not 'name' in player) or (not 'skin' in player) or (now - update_time > self.profileUpdateInterval)
+        else:
+            return False
+
+    # call a function for each source, concurrently if there are multiple sources
+    # returns the results in the order of the sources
+    def mapSources(self, f):
+        if len(self.sources) > 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(self.sources)) as pool:
+                return list(pool.map(f, range(len(self.sources))))
+        else:
+            return [f(i) for i in range(len(self.sources))]
+
+    # list the stats and advancements files of all sources
+    # returns a list of (stats files, advancements files) for each source, see loader.scan_dir
+    def scanSources(self):
+        def scan(i):
+            try:
+                statsFiles = loader.scan_dir(self.statsDirs[i])
+            except Exception as e:
+                raise UpdateError('failed to read player data directory: ' + self.statsDirs[i] + ': ' + str(e))
+
+            try:
+                advancementFiles = loader.scan_dir(self.advancementDirs[i])
+            except FileNotFoundError:
+                advancementFiles = dict()
+
+            return (statsFiles, advancementFiles)
+
+        return self.mapSources(scan)
+
+    # signatures of a player's stats and advancements files
+    # they are taken from the scan of the sources if given
+    def getFileSignature(self, uuid, scan = None):
+        signature = []
+        for i, statsDir in enumerate(self.statsDirs):
+            if scan:
+                (statsFiles, advancementFiles) = scan[i]
+                signature.append(statsFiles.get(uuid))
+                signature.append(advancementFiles.get(uuid))
+            else:
+                signature.append(incremental.file_signature(os.path.join(statsDir, uuid + '.json')))
+                signature.append(incremental.file_signature(os.path.join(self.advancementDirs[i], uuid + '.json')))
+
+        return signature
+
+    # get server.properties motd if no server name is set
+    def readServerName(self):
+        if self.config.server.customName:
+            return self.config.server.customName
+
+        serverName = None
+
+        p = re.compile('^motd=(.+)$')
+        with open(os.path.join(self.primaryServerPath, 'server.properties'), encoding='utf-8') as f:
+            for line in f:
+                m = p.match(line)
+                if m:
+                    serverName = javaproperties.unescape(m.group(1)).replace('\n', '<br>')
+                    break
+
+        if not serverName:
+            serverName = ''
+            print('Server name could not be extracted from server.properties - does it contain a "motd" line?')
+
+        return serverName
+
+    # read a JSON list of player entries from each source
+    # returns the lists in the order of the sources, sources whose file cannot be read are skipped
+    def readSourceLists(self, filename, purpose):
+        def read(i):
+            listFile = os.path.join(self.sources[i][0], filename)
+            try:
+                return jsonio.load(listFile)
+            except:
+                handle_error('Cannot open ' + listFile + ' for ' + purpose)
+                return []
+
+        return self.mapSources(read)
+
+    # try and load usercache
+    def readUsercache(self):
+        usercache = dict()
+        for entries in self.readSourceLists('usercache.json', 'offline player lookup'):
+            for entry in entries:
+                usercache[entry['uuid']] = entry['name']
+
+        return usercache
+
+    # get the UUIDs of excluded players
+    def readExcludedPlayers(self):
+        excludePlayers = set()
+
+        for uuid in self.config.players.excludeUUIDs:
+            excludePlayers.add(uuid)
+
+        # exclude banned players
+        if self.config.players.excludeBanned:
+            for entries in self.readSourceLists('banned-players.json', 'banned player exclusion'):
+                for entry in entries:
+                    excludePlayers.add(entry['uuid'])
+
+        # exclude ops
+        if self.config.players.excludeOps:
+            for entries in self.readSourceLists('ops.json', 'op exclusion'):
+                for entry in entries:
+                    excludePlayers.add(entry['uuid'])
+
+        return excludePlayers
+
+    # initialize database
+    def initDatabase(self):
+        for path in [self.config.database, self.dbRankingsPath, self.dbEventsPath,
+                     self.dbPlayerDataPath, self.dbPlayerCachePath, self.dbPlayerSearchPath, self.dbPlayerListPath]:
+            if not os.path.isdir(path):
+                os.mkdir(path)
+
+        if self.timeSeries and not os.path.isdir(self.dbTimeSeriesPath):
+            os.mkdir(self.dbTimeSeriesPath)
+
+    # load the players from the previous update and find new ones in the scanned stats dirs
+    def loadPlayers(self, excludePlayers, scan):
+        # load information from previous update
+        # players.json is still read if the player database is empty, e.g., when it is first enabled
+        players = self.playerStore.loadPlayers() if self.playerStore else None
+        if players is None:
+            if os.path.isfile(self.dbPlayersFilename):
+                try:
+                    players = jsonio.load(self.dbPlayersFilename)
+                except Exception as e:
+                    raise UpdateError('error loading previous database: ' + self.dbPlayersFilename + ': ' + str(e))
+            else:
+                players = dict()
+
+        # remove excluded players
+        for uuid in excludePlayers:
+            if uuid in players:
+                del players[uuid]
+
+        # find available player IDs in stats dirs
+        for (statsFiles, advancementFiles) in scan:
+            for uuid in statsFiles:
+                if (not uuid in players) and (not uuid in excludePlayers):
+                    players[uuid] = {}
+
+        return players
+
+    # reset the event stats for an update and load their previous state
+    # returns the names of the events that have not yet ended
+    def loadEvents(self, now):
+        activeEvents = set()
+
+        for eventStat in self.eventStats:
+            eventStat.reset(now)
+
+            # load the initial ranking and the previous deltas if available
+            history = self.eventHistories[eventStat.name]
+            history.load()
+            if not history.exists():
+                self.migrateEventData(eventStat, history, now)
+
+            if history.exists():
+                eventStat.initialRanking = dict(history.initial)
+                eventStat.setDeltas(history.ranking)
+            elif eventStat.hasStarted():
+                print('event \"' + eventStat.name + '\" has already started, but no initial ranking is available')
+
+            if not eventStat.hasEnded():
+                activeEvents.add(eventStat.name)
+
+        return activeEvents
+
+    # create the history of an event from an event data file written before histories were kept
+    def migrateEventData(self, eventStat, history, now):
+        eventDataFile = os.path.join(self.dbEventsPath, eventStat.name + '.json')
+        if os.path.isfile(eventDataFile):
+            eventData = jsonio.load(eventDataFile)
+            if 'initialRanking' in eventData:
+                history.append(eventStat.startTime - 1, eventData['initialRanking'], {})
+                history.append(now, {}, {entry['uuid']: entry['value'] for entry in eventData['ranking']})
+
+    # record the state of an event in its history and write the event data for the client
+    def writeEvent(self, writer, eventStat, now):
+        self.eventHistories[eventStat.name].append(now, eventStat.initialRanking, eventStat.deltas)
+        writer.writeJson(os.path.join(self.dbEventsPath, eventStat.name + '.json'), eventStat.serialize())
+
+    # read player data files and compute stat values
+    # the existing files are taken from the scan of the sources if given
+    # if a spill is given, the stat values are moved there as soon as a player is loaded
+    # returns a dict of UUID -> (last online time, play time in ticks, data version, stat values)
+    def loadPlayerData(self, players, updateMetrics, spill = None, scan = None):
+        playerData = dict()
+        loadPlayers = []
+        fileSignatures = dict()
+        numSkipped = 0
+
+        # find players whose data files need to be read
+        for uuid in players:
+            signature = self.getFileSignature(uuid, scan)
+
+            # players who are not eligible for the stats need not be read again until their files change
+            indexed = self.activityIndex.get(uuid, signature)
+            if indexed and not self.playerLoader.needsValues(indexed[1], indexed[2]):
+                playerData[uuid] = indexed + (None,)
+                numSkipped += 1
+                continue
+
+            if self.statsCache:
+                cacheEntry = self.statsCache.get(uuid, signature)
+
+                if cacheEntry:
+                    # data files did not change since the last update
+                    values = self.statsCache.getValues(cacheEntry)
+                    if values is not None or not self.playerLoader.needsValues(cacheEntry['playtime'], cacheEntry['version']):
+                        if spill and values is not None:
+                            values = spill.append(values)
+
+                        self.activityIndex.put(uuid, signature, cacheEntry['last'], cacheEntry['playtime'], cacheEntry['version'])
+                        playerData[uuid] = (cacheEntry['last'], cacheEntry['playtime'], cacheEntry['version'], values)
+                        continue
+
+            fileSignatures[uuid] = signature
+            loadPlayers.append(uuid)
+
+        # read player data files and compute stat values
+        inProcess = not (self.jobs > 1 and len(loadPlayers) > 1)
+        if not inProcess:
+            if not self.pool:
+                self.pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.jobs,
+                    initializer=loader.init_worker,
+                    initargs=(self.playerLoader,))
+
+            chunkSize = max(1, len(loadPlayers) // (self.jobs * 8))
+            tasks = [(uuid, fileSignatures[uuid]) for uuid in loadPlayers]
+            results = self.pool.map(loader.load_player, tasks, chunksize=chunkSize)
+            loadResults = zip(loadPlayers, results)
+        else:
+            loader.init_worker(self.playerLoader)
+            loadResults = ((uuid, loader.load_player((uuid, fileSignatures[uuid]))) for uuid in loadPlayers)
+
+        updateMetrics.count('playersSkipped', numSkipped)
+        updateMetrics.count('playersCached', len(playerData) - numSkipped)
+        updateMetrics.count('playersLoaded', len(loadPlayers))
+
+        for uuid, (result, (filesRead, bytesRead), classified) in loadResults:
+            updateMetrics.count('filesRead', filesRead)
+            updateMetrics.count('bytesRead', bytesRead)
+
+            # keys classified by workers are added to the plan, so they can be persisted
+            # keys classified in this process are already in the plan, and new
+            if classified:
+                if inProcess:
+                    numClassified = sum(len(keys) for i, keys in classified)
+                else:
+                    numClassified = self.readerPlan.addClassified(classified)
+
+                updateMetrics.count('keysClassified', numClassified)
+                self.classificationCache.update(numClassified)
+
+            # check if any data is available
+            if result is None:
+                continue
+
+            (last, playtimeTicks, version, values) = result
+            if values is not None:
+                values = dict(zip(self.playerLoader.valueNames(version), values))
+
+            self.activityIndex.put(uuid, fileSignatures[uuid], last, playtimeTicks, version)
+
+            if self.statsCache:
+                cacheEntry = self.statsCache.put(uuid, fileSignatures[uuid], last, playtimeTicks, version)
+                if values is not None:
+                    self.statsCache.putValues(cacheEntry, values)
+
+            if spill and values is not None:
+                values = spill.append(values)
+
+            playerData[uuid] = (last, playtimeTicks, version, values)
+
+        return playerData
+
+    # fetch the profiles of players that are due for an update
+    # returns the fetched profiles and the errors for failed players
+    def fetchProfiles(self, players, playerData, now, updateMetrics):
+        # collect players whose profiles are due for an update
+        profileUpdates = []
+        for uuid, player in players.items():
+            if uuid in playerData:
+                (last, playtimeTicks, version, values) = playerData[uuid]
+                if values is not None and self.needsProfileUpdate(player, self.isActive(last, now), now):
+                    profileUpdates.append(uuid)
+
+        if len(profileUpdates) > 0:
+            print('updating ' + str(len(profileUpdates)) + ' player profiles ...')
+
+        numFetched = self.profileFetcher.numFetched
+        numCached = self.profileFetcher.numCached
+
+        (profiles, profileErrors) = self.profileFetcher.fetch_all(profileUpdates, now)
+
+        updateMetrics.count('profilesFetched', self.profileFetcher.numFetched - numFetched)
+        updateMetrics.count('profilesCached', self.profileFetcher.numCached - numCached)
+        updateMetrics.count('profileErrors', len(profileErrors))
+
+        return (profiles, profileErrors)
+
+    # apply a fetched profile to a player
+    # returns False if the player's name is unknown, which excludes the player
+    def updateProfile(self, uuid, player, active, now, profiles, profileErrors, usercache):
+        if (not 'name' in player) or active or self.config.players.updateInactive:
+            if uuid in profiles:
+                profile = profiles[uuid]
+                if profile:
+                    # get name and skin
+                    player['name'] = profile['name']
+                    player['skin'] = profile['skin']
+
+                # profile updated
+                player['update'] = now
+
+            elif uuid in profileErrors:
+                print('\tfailed to update profile for ' + uuid)
+                print(profileErrors[uuid])
+
+            if (not 'name' in player) and (uuid in usercache):
+                # no profile available, but the UUID is in the usercache
+                player['name'] = usercache[uuid]
+
+            if (not 'name' in player):
+                # there is no way to find the name of this player
+                # this may happen if the player has no valid Mojang UUID
+                # since the ID also no longer appears in the usercache, chances are we're dealing with an inactive player anyway
+                print('\texcluding invalid player ' + uuid)
+                return False
+
+        return True
+
+    # find the stats to compute award rankings for
+    def findAwardStats(self, serverVersion):
+        awardStats = []
+        awardNames = set()
+
+        for mcstat in self.registry:
+            if mcstat.linkedStat:
+                continue
+
+            if serverVersion > mcstat.maxVersion:
+                # no longer supported, but don't print a warning
+                continue
+
+            if serverVersion < mcstat.minVersion:
+                print('stat "' + mcstat.name + '" is not supported by server version '
+                      + str(serverVersion) + ' (required: ' + str(mcstat.minVersion) + ')')
+                continue
+
+            if mcstat.name in awardNames:
+                print('WARNING: stat name "' + mcstat.name + '" already in use')
+                continue
+
+            awardStats.append(mcstat)
+            awardNames.add(mcstat.name)
+
+        return awardStats
+
+    # test whether an event appears on the client
+    def isEventVisible(self, event, serverVersion):
+        # events that did not yet start should not appear on the client
+        if not event.hasStarted():
+            return False
+
+        # check version
+        if serverVersion < event.minVersion:
+            print('event "' + event.name + '" is not supported by server version '
+                  + str(serverVersion) + ' (required: ' + str(event.minVersion) + ')')
+            return False
+
+        return True
+
+    # create the summary of an event for the client
+    def eventSummary(self, event, best):
+        esummary = {
+            'title':     event.title,
+            'link':      event.link.name,
+            'startTime': event.startTime,
+            'stopTime':  event.endTime,
+            'active':    event.isRunning(),
+        }
+
+        if best:
+            esummary['best'] = {'uuid': best[0], 'value': best[1]}
+
+        return esummary
+
+    # copy server icon if available
+    # returns whether there is an icon
+    def copyServerIcon(self):
+        serverIconFile = os.path.join(self.primaryServerPath, 'server-icon.png')
+        if os.path.isfile(serverIconFile):
+            shutil.copy(serverIconFile, self.config.database)
+            return True
+        else:
+            return False
+
+    # gather info for client
+    def clientInfo(self, serverName, hasIcon, numPlayers, numActivePlayers, now):
+        config = self.config
+        return {
+            'hasIcon': hasIcon,
+            'serverName': serverName,
+            'updateTime': now,
+            'inactiveDays': config.players.inactiveDays,
+            'minPlayTime': self.minPlaytime,
+            'crown': [config.crown.gold, config.crown.silver, config.crown.bronze],
+            'cacheQ': self.playerCacheQ,
+            'numPlayers': numPlayers,
+            'numActive': numActivePlayers,
+            'playersPerPage': self.playersPerPage,
+            'showLastOnline': config.client.showLastOnline,
+            'defaultLanguage': config.client.defaultLanguage,
+            'pagedRankings': self.pagedRankings,
+        }
+
+    # write the summary for the client
+    def writeSummary(self, writer, info, players, summaryPlayerIds, awards, summaryEvents, outHof):
+        # summary players
+        summaryPlayers = dict()
+        for uuid in summaryPlayerIds:
+            player = players[uuid]
+            summaryPlayers[uuid] = {
+                'name': player['name'],
+                'skin': player['skin'] if ('skin' in player) else False,
+                'last': player['last'],
+            }
+
+        summary = {
+            'info': info,
+            'players': summaryPlayers,
+            'awards': awards,
+            'events': summaryEvents,
+            'hof': outHof,
+        }
+
+        writer.writeJson(self.dbSummaryFilename, summary, compress=True)
+
+    # write the ranking of a stat, given as a list of (uuid, value) pairs
+    def writeRanking(self, writer, name, ranking):
+        outRanking = [{'uuid':id,'value':value} for id, value in ranking]
+        path = os.path.join(self.dbRankingsPath, name)
+        if self.pagedRankings:
+            # remove the ranking file written while paged rankings were disabled
+            for filename in glob.glob(glob.escape(path + '.json') + '*'):
+                os.unlink(filename)
+
+            self.writeRankingPages(writer, path, outRanking)
+        else:
+            # remove the pages written while paged rankings were enabled
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+
+            writer.writeJson(path + '.json', outRanking, precompress=True)
+
+    # write a ranking as pages of playersPerPage entries
+    #
+    # The head file holds the best players, the number of ranked players and
+    # pages, and a version that changes along with the ranking. If enabled, a
+    # delta file holds the values that changed and the players that were removed
+    # since the previous version. Since rankings are ordered by value and UUID, a
+    # client can apply the delta to the previous version and sort the result.
+    def writeRankingPages(self, writer, path, outRanking):
+        if not os.path.isdir(path):
+            os.mkdir(path)
+
+        headFilename = os.path.join(path, 'head.json')
+        try:
+            previousHead = jsonio.load(headFilename)
+        except (OSError, ValueError):
+            previousHead = None
+
+        version = hashlib.sha1(jsonio.dumps(outRanking)).hexdigest()
+        numPages = (len(outRanking) + self.playersPerPage - 1) // self.playersPerPage
+
+        # compute the changes against the previous version from its pages
+        if self.rankingDeltas and previousHead and previousHead['version'] != version:
+            try:
+                previous = dict()
+                for page in range(1, previousHead['pages'] + 1):
+                    for entry in jsonio.load(os.path.join(path, str(page) + '.json')):
+                        previous[entry['uuid']] = entry['value']
+
+                current = {entry['uuid']: entry['value'] for entry in outRanking}
+                writer.writeJson(os.path.join(path, 'delta.json'), {
+                    'from':    previousHead['version'],
+                    'to':      version,
+                    'set':     {uuid: value for uuid, value in current.items() if previous.get(uuid) != value},
+                    'removed': [uuid for uuid in previous if not uuid in current],
+                }, precompress=True)
+            except (OSError, ValueError) as e:
+                print('cannot compute ranking delta for ' + path + ': ' + str(e))
+
+        # remove pages the ranking no longer fills
+        if previousHead:
+            for page in range(numPages + 1, previousHead['pages'] + 1):
+                for filename in glob.glob(os.path.join(path, str(page) + '.json*')):
+                    os.unlink(filename)
+
+        for page in range(numPages):
+            writer.writeJson(os.path.join(path, str(page + 1) + '.json'),
+                outRanking[page * self.playersPerPage : (page + 1) * self.playersPerPage], precompress=True)
+
+        writer.writeJson(headFilename, {
+            'version': version,
+            'total':   len(outRanking),
+            'pages':   numPages,
+            'top':     outRanking[:rankingHeadSize],
+        }, precompress=True)
+
+    # info on an update stored in the player database, which a query service needs to present the players
+    def storeInfo(self, now, awardStats):
+        return {
+            'rankings':       [mcstat.name for mcstat in awardStats],
+            'updateTime':     now,
+            'inactiveTime':   self.inactiveTime,
+            'playersPerPage': self.playersPerPage,
+            'cacheQ':         self.playerCacheQ,
+        }
+
+    # create player cache for client
+    # if keys are given, only the caches with these UUID prefixes are written
+    def writePlayerCache(self, writer, players, keys = None):
+        playercache = dict()
+        for uuid, player in players.items():
+            key = uuid[:self.playerCacheQ]
+            if keys is not None and not key in keys:
+                continue
+
+            if not key in playercache:
+                playercache[key] = list()
+
+            playercache[key].append({
+                'uuid': uuid,
+                'name': player['name'],
+                'skin': player['skin'] if ('skin' in player) else False,
+                'last': player['last']
+            })
+
+        for key, cache in playercache.items():
+            writer.writeJson(os.path.join(self.dbPlayerCachePath, key + '.json'), cache, precompress=True)
+
+    # write the paged lists of all and of active players
+    def writePlayerLists(self, writer, playerlist, now):
+        # write player list (all players)
+        playerlist = sorted(playerlist, key=lambda x: x['name'].lower())
+        for i in range(0, len(playerlist), self.playersPerPage):
+            page = int(i / self.playersPerPage)
+            writer.writeJson(self.dbPlayerListAllFilename.format(page + 1),
+                playerlist[i : i + self.playersPerPage], compress=True)
+
+        # write active player list
+        playerlist = list(filter(lambda x: self.isActive(x['last'], now), playerlist))
+        for i in range(0, len(playerlist), self.playersPerPage):
+            page = int(i / self.playersPerPage)
+            writer.writeJson(self.dbPlayerListActiveFilename.format(page + 1),
+                playerlist[i : i + self.playersPerPage], compress=True)
+
+    # do an update at the current time of the clock
+    # returns the metrics of the update
+    def update(self):
+        now = int(self.clock())
+        config = self.config
+
+        updateMetrics = metrics.Metrics()
+        updateMetrics.phase('init')
+
+        serverName = self.readServerName()
+        usercache = self.readUsercache()
+        excludePlayers = self.readExcludedPlayers()
+
+        self.initDatabase()
+        writer = output.OutputWriter(config.database, self.writeThreads, config.client.precompress)
+        spill = None
+        statMatrix = None
+
+        try:
+            updateMetrics.phase('load')
+
+            # in low-memory mode, stat values are moved to disk right away
+            if self.lowMemory:
+                spill = lowmem.ValueSpill(self.registry, config.database)
+
+            scan = self.scanSources()
+            players = self.loadPlayers(excludePlayers, scan)
+            activeEvents = self.loadEvents(now)
+            playerData = self.loadPlayerData(players, updateMetrics, spill, scan)
+            self.activityIndex.retain(playerData)
+            if self.statsCache:
+                self.statsCache.retain(playerData)
+
+            updateMetrics.phase('profiles')
+
+            (profiles, profileErrors) = self.fetchProfiles(players, playerData, now, updateMetrics)
+
+            updateMetrics.phase('compute')
+
+            # reset the rankings of the previous update
+            for mcstat in self.registry:
+                mcstat.clear()
+
+            # init the stat matrix for the columnar or low-memory engine
+            if self.columnar:
+                from mcstats import columnar
+                statMatrix = columnar.StatMatrix(self.registry, playerData.keys())
+            elif self.lowMemory:
+                statMatrix = lowmem.SpillMatrix(spill)
+
+            # update player data
+            serverVersion = 0
+            hof = mcstats.Ranking(mcstats.crownRankingKey)
+
+            for uuid, player in players.items():
+                # check if any data is available
+                if not uuid in playerData:
+                    continue
+
+                (last, playtimeTicks, version, values) = playerData[uuid]
+
+                if version < 1451: # 17w47a is the absolute minimum
+                    print('unsupported data version ' + str(version) + ' for ' + uuid)
+                    continue
+
+                # find latest overall server version
+                serverVersion = max(serverVersion, version)
+
+                # get total amount of time played
+                playtimeMinutes = playtimeTicks / (20 * 60);
+                if playtimeMinutes < self.minPlaytime:
+                    # invalidate player and continue
+                    player.pop('name', None)
+                    player.pop('last', None)
+                    continue
+
+                # determine activity
+                player['last'] = last
+                active = self.isActive(last, now)
+
+                # update skin
+                if not self.updateProfile(uuid, player, active, now, profiles, profileErrors, usercache):
+                    continue
+
+                # init database data
+                playerStats = dict()
+                if statMatrix:
+                    # registry stats are kept in the stat matrix, only events are handled below
+                    # only their values are looked up, so spilled values are not read in full
+                    statMatrix.setPlayer(uuid, version, active, values)
+                    player['stats'] = None
+                    enterStats = self.eventStats
+
+                    for mcstat in enterStats:
+                        value = values.get(mcstat.name)
+                        if value is not None:
+                            playerStats[mcstat.name] = {'value': value}
+                else:
+                    enterStats = self.registry + self.eventStats
+                    player['stats'] = playerStats
+
+                    for name, value in values.items():
+                        playerStats[name] = {'value': value}
+
+                # enter into rankings
+                for mcstat in enterStats:
+                    if mcstat.name in playerStats:
+                        value = playerStats[mcstat.name]['value']
+
+                        if mcstat.canEnterRanking(uuid, active):
+                            mcstat.enter(uuid, value)
+
+                        if mcstat.playerStatRelevant:
+                            playerStats[mcstat.name] = {'value': value} # collapse
+                        else:
+                            del playerStats[mcstat.name] # we don't need this anymore
+
+                # init crown score
+                if active and not statMatrix:
+                    crown = mcstats.CrownScore()
+                    player['crown'] = crown
+                    hof.enter(uuid, crown)
+
+            updateMetrics.phase('rank')
+
+            # find stats to compute award rankings for
+            summaryPlayerIds = set()
+            awards = dict()
+            awardStats = self.findAwardStats(serverVersion)
+
+            # compute all rankings at once in the stat matrix
+            if statMatrix:
+                statMatrix.rank(awardStats)
+
+            # compute award rankings
+            for mcstat in awardStats:
+                if statMatrix:
+                    ranking = statMatrix.ranking(mcstat.name)
+                else:
+                    # sort ranking
+                    mcstat.sort()
+
+                    # process crown score points
+                    for i, entry in enumerate(mcstat.top(3)):
+                        players[entry.id]['crown'].increase(i)
+
+                    # set player ranks
+                    ranking = mcstat.ranking
+                    for i, entry in enumerate(ranking):
+                        players[entry.id]['stats'][mcstat.name]['rank'] = i+1
+
+                # write ranking
+                self.writeRanking(writer, mcstat.name, ranking)
+
+                # set first rank in award info
+                award = dict(mcstat.meta)
+                if(len(ranking) > 0):
+                    (id, value) = ranking[0]
+                    award['best'] = {'uuid': id, 'value': value}
+                    summaryPlayerIds.add(id)
+
+                # add to award info list
+                awards[mcstat.name] = award
+
+            # process events
+            summaryEvents = dict()
+
+            for event in self.eventStats:
+                if not self.isEventVisible(event, serverVersion):
+                    continue
+
+                # sort ranking
+                event.sort()
+
+                # create summary
+                if(len(event.ranking) > 0):
+                    best = event.top(1)[0]
+                    summaryPlayerIds.add(best.id)
+                else:
+                    best = None
+
+                summaryEvents[event.name] = self.eventSummary(event, best)
+
+            updateMetrics.phase('write')
+
+            # filter valid players
+            validPlayers = dict()
+            serverPlayers = dict()
+
+            playerlist = []
+            numActivePlayers = 0
+
+            for uuid, player in players.items():
+                if ('last' in player) and ('name' in player) and ('stats' in player):
+                    validPlayers[uuid] = player
+
+                    name = player['name']
+                    skin = player['skin'] if 'skin' in player else False
+                    last = player['last']
+
+                    serverPlayers[uuid] = {
+                        'name': name,
+                        'skin': skin,
+                        'last': last,
+                        'update': player['update'] if 'update' in player else 0
+                    }
+
+                    clientInfo = {
+                        'uuid': uuid,
+                        'name': name,
+                        'skin': skin,
+                        'last': last,
+                    }
+
+                    playerlist.append(clientInfo)
+
+                    if self.isActive(last, now):
+                        numActivePlayers += 1
+
+                    if statMatrix:
+                        playerStats = statMatrix.playerStats(uuid)
+                    else:
+                        playerStats = player['stats']
+
+                    data = jsonio.dumps(playerStats)
+                    if self.writePlayerFiles:
+                        writer.write(os.path.join(self.dbPlayerDataPath, uuid + '.json'), data, precompress=True)
+
+                    if self.playerStore:
+                        self.playerStore.putPlayer(uuid, serverPlayers[uuid], playerStats, store.stats_digest(data))
+
+                    if self.timeSeries:
+                        self.timeSeries.record(uuid, self.activityIndex.getSignature(uuid), playerStats)
+
+            players = validPlayers
+
+            # write players for next server update
+            if self.playerStore:
+                self.playerStore.commit(serverPlayers, self.storeInfo(now, awardStats))
+            else:
+                writer.writeJson(self.dbPlayersFilename, serverPlayers)
+
+            # write incremental cache for next server update
+            if self.statsCache:
+                self.statsCache.save()
+
+            self.activityIndex.save()
+            self.classificationCache.save(self.readerPlan)
+
+            # append the changes of all stats to the time series
+            if self.timeSeries:
+                updateMetrics.count('timeSeriesDeltas', self.timeSeries.commit(now))
+
+            # write event data
+            for eventStat in self.eventStats:
+                if eventStat.name in activeEvents:
+                    self.writeEvent(writer, eventStat, now)
+
+            # gather info for client
+            info = self.clientInfo(serverName, self.copyServerIcon(), len(playerlist), numActivePlayers, now)
+
+            # write hall of fame for client
+            # compute hall of fame
+            if statMatrix:
+                hofRanking = statMatrix.hallOfFame(mcstats.CrownScore.gold, mcstats.CrownScore.silver, mcstats.CrownScore.bronze)
+            else:
+                hof.sort()
+                hofRanking = [(entry.id, entry.value.score) for entry in hof.ranking]
+
+            outHof = []
+            for id, score in hofRanking:
+                if score[0] == 0:
+                    break
+
+                outHof.append({
+                    'uuid': id,
+                    'value': score
+                })
+                summaryPlayerIds.add(id)
+
+            # write summary for client
+            self.writeSummary(writer, info, players, summaryPlayerIds, awards, summaryEvents, outHof)
+
+            # write player cache and lists for client
+            if self.writePlayerFiles:
+                self.writePlayerCache(writer, players)
+                self.writePlayerLists(writer, playerlist, now)
+
+            # write player search index for client
+            if self.playerSearch:
+                updateMetrics.count('searchShardsWritten', self.playerSearch.write(writer, players))
+        finally:
+            # wait for all files to be written
+            writer.close()
+
+            # discard what was written to the player database if the update failed
+            if self.playerStore:
+                self.playerStore.rollback()
+
+            if self.timeSeries:
+                self.timeSeries.discard()
+
+            if spill:
+                if statMatrix:
+                    statMatrix.close()
+                spill.close()
+
+        updateMetrics.count('filesWritten', writer.numWritten)
+        updateMetrics.count('filesSkipped', writer.numSkipped)
+        updateMetrics.count('bytesWritten', writer.bytesWritten)
+
+        # write metrics of this update
+        updateMetricsData = updateMetrics.serialize()
+        output.write_atomic(self.dbMetricsFilename, jsonio.dumps(updateMetricsData))
+
+        return updateMetricsData
@@ -0,0 +1,132 @@
+import os
+
+from mcstats import jsonio
+from mcstats import output
+
+# default length of a history bucket in seconds
+defaultInterval = 3600
+
+# History of an event's rankings in time buckets
+#
+# The history is an append-only file of JSON lines. Each line belongs to the time
+# bucket of the update that wrote it and holds only what changed since the
+# previous line: the initial values of players (recorded until the event starts)
+# and the deltas of players in the event ranking. Replaying the lines yields the
+# current state, and the state at the end of any bucket can be used to show the
+# progress of an event over time.
+#
+# Updates that fall into the same bucket append lines of their own. When the file
+# has grown to more than twice the number of buckets, it is compacted into one
+# line per bucket, with everything recorded before the event started merged into
+# the first line. The history is thus bounded by the duration of the event
+# divided by the bucket interval.
+class EventHistory:
+    def __init__(self, filename, startTime, interval = defaultInterval):
+        self.filename = filename
+        self.startTime = startTime
+        self.interval = interval
+        self.clear()
+
+    def clear(self):
+        self.initial = dict()
+        self.ranking = dict()
+        self.buckets = [] # list of [time, initial changes, ranking changes]
+        self.numLines = 0
+
+    # get the start time of the bucket a point in time falls into
+    # everything before the start of the event falls into a single bucket
+    def bucketTime(self, t):
+        if t < self.startTime:
+            return self.startTime - self.interval
+        else:
+            return t - (t - self.startTime) % self.interval
+
+    def exists(self):
+        return os.path.isfile(self.filename)
+
+    # load the history, compacting it if necessary
+    def load(self):
+        self.clear()
+        if not self.exists():
+            return
+
+        damaged = False
+        with open(self.filename, 'rb') as f:
+            for line in f:
+                try:
+                    record = jsonio.loads(line)
+                except ValueError:
+                    # a line that was not written completely, which must not be appended to
+                    print('ignoring incomplete line in event history ' + self.filename)
+                    damaged = True
+                    continue
+
+                self.apply(record['time'], record.get('initial', {}), record.get('ranking', {}))
+                self.numLines += 1
+
+        if damaged or self.numLines > 2 * len(self.buckets):
+            self.compact()
+
+    # apply a record to the state and merge it into its bucket
+    def apply(self, t, initial, ranking):
+        t = self.bucketTime(t)
+        if self.buckets and self.buckets[-1][0] == t:
+            bucket = self.buckets[-1]
+        else:
+            bucket = [t, dict(), dict()]
+            self.buckets.append(bucket)
+
+        self.initial.update(initial)
+        self.ranking.update(ranking)
+        bucket[1].update(initial)
+        bucket[2].update(ranking)
+
+    # encode a bucket as a line
+    @staticmethod
+    def encode(t, initial, ranking):
+        record = {'time': t}
+        if initial:
+            record['initial'] = initial
+        if ranking:
+            record['ranking'] = ranking
+
+        return jsonio.dumps(record) + b'\n'
+
+    # rewrite the history with one line per bucket
+    def compact(self):
+        data = b''.join(self.encode(*bucket) for bucket in self.buckets)
+        output.write_atomic(self.filename, data)
+        self.numLines = len(self.buckets)
+
+    # record the current initial values and ranking of the event at the given time
+    # only the changes are appended to the file
+    # returns whether anything changed
+    def append(self, now, initial, ranking):
+        initialChanges = {uuid: value for uuid, value in initial.items() if self.initial.get(uuid) != value}
+        rankingChanges = {uuid: value for uuid, value in ranking.items() if self.ranking.get(uuid) != value}
+        if not (initialChanges or rankingChanges):
+            return False
+
+        t = self.bucketTime(now)
+        with open(self.filename, 'ab') as f:
+            f.write(self.encode(t, initialChanges, rankingChanges))
+
+        self.apply(t, initialChanges, rankingChanges)
+        self.numLines += 1
+        return True
+
+    # get the ranking deltas as of the end of the bucket the given time falls into
+    def rankingAt(self, t):
+        t = self.bucketTime(t)
+        ranking = dict()
+        for time, initial, changes in self.buckets:
+            if time > t:
+                break
+
+            ranking.update(changes)
+
+        return ranking
+
+    # get the progress of a player as a list of (bucket time, delta) pairs
+    def progress(self, uuid):
+        return [(time, changes[uuid]) for time, initial, changes in self.buckets if uuid in changes]
@@ -0,0 +1,152 @@
+import hashlib
+import json
+import os
+import sqlite3
+
+from mcstats import jsonio
+
+# signature of a data file - modification time and size, or None if it does not exist
+def file_signature(filename):
+    try:
+        st = os.stat(filename)
+    except FileNotFoundError:
+        return None
+
+    return [st.st_mtime_ns, st.st_size]
+
+# signature of the stat definitions and events
+# any change to the stat modules or event configuration invalidates the whole cache
+def registry_signature(events):
+    h = hashlib.sha1()
+    baseDir = os.path.dirname(__file__)
+    for dirpath, dirnames, filenames in os.walk(baseDir):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.endswith('.py'):
+                path = os.path.join(dirpath, filename)
+                h.update(os.path.relpath(path, baseDir).encode())
+                h.update(str(file_signature(path)).encode())
+
+    for e in events:
+        h.update(json.dumps([e.name, e.stat.name, e.startTime, e.endTime]).encode())
+
+    return h.hexdigest()
+
+# Cache of per-player data used by the incremental update mode
+#
+# For each player, the signatures of all stats and advancement files are stored
+# along with the basic data extracted from them (last online time, play time and
+# data version) and the computed stat values. As long as the signatures match,
+# the files need not be parsed again.
+#
+# Like the activity index, the cache is an SQLite table in the awards database
+# holding one row per player, so only players whose data changed are written.
+class PlayerStatsCache:
+    def __init__(self, filename, registrySignature):
+        self.filename = filename
+        self.registrySignature = registrySignature
+        self.entries = dict()
+        self.changed = dict()
+        self.removed = set()
+        self.invalidated = False
+
+    def connect(self):
+        db = sqlite3.connect(self.filename)
+        db.execute('PRAGMA synchronous = NORMAL')
+        db.execute('''CREATE TABLE IF NOT EXISTS players (
+            uuid TEXT PRIMARY KEY,
+            entry TEXT NOT NULL
+        ) WITHOUT ROWID''')
+        db.execute('''CREATE TABLE IF NOT EXISTS info (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        ) WITHOUT ROWID''')
+        return db
+
+    # load the cache from disk, discarding it if it was built for different stats
+    def load(self):
+        self.entries = dict()
+        self.changed = dict()
+        self.removed = set()
+        self.invalidated = False
+
+        if not os.path.isfile(self.filename):
+            self.invalidated = True
+            return
+
+        try:
+            db = self.connect()
+            try:
+                registry = db.execute("SELECT value FROM info WHERE key = 'registry'").fetchone()
+                if registry is None or registry[0] != self.registrySignature:
+                    print('stat definitions or events changed, discarding incremental cache')
+                    self.invalidated = True
+                    return
+
+                for uuid, entry in db.execute('SELECT uuid, entry FROM players'):
+                    self.entries[uuid] = jsonio.loads(entry)
+            finally:
+                db.close()
+        except (sqlite3.Error, ValueError) as e:
+            print('discarding unreadable incremental cache ' + self.filename + ': ' + str(e))
+            self.entries = dict()
+            self.invalidated = True
+
+    # get the cached entry for the player if the data files did not change
+    def get(self, uuid, signature):
+        entry = self.entries.get(uuid)
+        if entry and entry['files'] == signature:
+            return entry
+        else:
+            return None
+
+    # get the cached stat values of the entry, if available
+    def getValues(self, entry):
+        return entry.get('values')
+
+    # store the basic data extracted from the player's data files
+    def put(self, uuid, signature, last, playtimeTicks, version):
+        entry = {
+            'files':    signature,
+            'last':     last,
+            'playtime': playtimeTicks,
+            'version':  version,
+        }
+        self.entries[uuid] = entry
+        self.changed[uuid] = entry
+        self.removed.discard(uuid)
+        return entry
+
+    # store the computed stat values for a cache entry
+    def putValues(self, entry, values):
+        entry['values'] = values
+
+    # remove all players except the given ones
+    def retain(self, uuids):
+        for uuid in [uuid for uuid in self.entries if not uuid in uuids]:
+            del self.entries[uuid]
+            self.changed.pop(uuid, None)
+            self.removed.add(uuid)
+
+    # write the changed rows to disk
+    def save(self):
+        if not (self.invalidated or self.changed or self.removed):
+            return
+
+        db = self.connect()
+        try:
+            with db:
+                if self.invalidated:
+                    db.execute('DELETE FROM players')
+                    db.execute('INSERT OR REPLACE INTO info VALUES (?, ?)', ('registry', self.registrySignature))
+                else:
+                    db.executemany('DELETE FROM players WHERE uuid = ?', [(uuid,) for uuid in self.removed])
+
+                db.executemany('INSERT OR REPLACE INTO players VALUES (?, ?)',
+                    [(uuid, jsonio.dumps(entry).decode()) for uuid, entry in self.changed.items()])
+        finally:
+            db.close()
+
+        self.changed = dict()
+        self.removed = set()
+        self.invalidated = False
@@ -0,0 +1,37 @@
+import json
+
+# use orjson if available, which is considerably faster than the json module
+try:
+    import orjson
+except ImportError:
+    orjson = None # type: ignore[assignment]
+
+# name of the JSON backend in use
+backend = 'orjson' if orjson else 'json'
+
+# parse JSON from bytes or a string
+def loads(data):
+    if orjson:
+        return orjson.loads(data)
+    else:
+        return json.loads(data)
+
+# parse a JSON file
+# the file is read as bytes and parsed directly, avoiding a decoded copy
+def load(filename):
+    with open(filename, 'rb') as f:
+        return loads(f.read())
+
+# serialize an object to JSON bytes
+def dumps(obj, sort_keys = False):
+    if orjson:
+        option = orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+
+        try:
+            return orjson.dumps(obj, option=option)
+        except TypeError:
+            pass # e.g., integers exceeding 64 bits, use the json module
+
+    return json.dumps(obj, sort_keys=sort_keys).encode()
@@ -0,0 +1,492 @@
+import bisect
+import os
+
+from mcstats import jsonio
+from mcstats import mcstats
+from mcstats import metrics
+from mcstats import output
+from mcstats import store
+
+# Ranking kept sorted while entries are inserted, removed and repositioned
+#
+# Entries are kept as (value, id) pairs in ascending order, so the best entry is
+# the last one. Changing an entry only shifts the ranks of the entries between
+# its old and new position (or below it if the entry is inserted or removed),
+# which are reported so the affected players can be updated.
+class SortedRanking:
+    def __init__(self):
+        self.keys = []
+        self.values = dict()
+
+    def __len__(self):
+        return len(self.keys)
+
+    # set the value of the entry with the given id, None removes the entry
+    # returns the ids of the other entries whose rank changed
+    def set(self, id, value):
+        old = self.values.get(id)
+        if old == value:
+            return []
+
+        keys = self.keys
+        if old is not None:
+            a = bisect.bisect_left(keys, (old, id))
+            del keys[a]
+            del self.values[id]
+
+        if value is not None:
+            b = bisect.bisect_left(keys, (value, id))
+            keys.insert(b, (value, id))
+            self.values[id] = value
+
+        if old is None:
+            shifted = keys[:b] # inserted, entries below moved down
+        elif value is None:
+            shifted = keys[:a] # removed, entries below moved up
+        elif b >= a:
+            shifted = keys[a:b] # moved up, entries passed moved down
+        else:
+            shifted = keys[b+1:a+1] # moved down, entries passed moved up
+
+        return [id for value, id in shifted]
+
+    # get the rank of an entry, starting at 1
+    def rank(self, id):
+        return len(self.keys) - bisect.bisect_left(self.keys, (self.values[id], id))
+
+    # get the k best entries as (id, value) pairs
+    def top(self, k):
+        return [(id, value) for value, id in reversed(self.keys[-k:])] if k > 0 else []
+
+    # get all entries as (id, value) pairs, best first
+    def ranking(self):
+        return [(id, value) for value, id in reversed(self.keys)]
+
+# Live updater for the awards database
+#
+# Keeps the state of all players and the rankings in memory so that changes to
+# individual players can be applied without a full update. After a rebuild, which
+# computes everything from scratch, changed players are reloaded and moved within
+# the rankings. Only the output files affected by the changes are written.
+#
+# The output is the same as that of the engine's update.
+class LiveUpdater:
+    def __init__(self, engine):
+        self.engine = engine
+        self.players = dict()
+        self.playerData = dict()
+        self.valid = dict()         # UUID -> activity of the players that appear on the client
+        self.entries = dict()       # UUID -> ranking name -> value entered into the ranking
+        self.rankings = dict()      # award stat name -> SortedRanking
+        self.eventRankings = dict() # event name -> SortedRanking
+        self.eventStates = dict()
+        self.awardStats = []
+        self.serverVersion = 0
+        self.serverName = ''
+        self.usercache = dict()
+        self.excludePlayers = set()
+        self.hasIcon = False
+        self.resetChanges()
+
+    def resetChanges(self):
+        self.dirtyStats = set()
+        self.dirtyEvents = set()
+        self.dirtyPlayers = set()
+        self.dirtyCaches = set()
+        self.playersChanged = False
+
+    # get the latest data version over all players
+    def findServerVersion(self):
+        serverVersion = 0
+        for (last, playtimeTicks, version, values) in self.playerData.values():
+            if version >= 1451:
+                serverVersion = max(serverVersion, version)
+
+        return serverVersion
+
+    # get the state of the events, which determines what the client displays
+    def getEventStates(self):
+        return {event.name: (event.hasStarted(), event.hasEnded()) for event in self.engine.eventStats}
+
+    # compute everything from scratch and write all output files
+    # returns the metrics of the update
+    def rebuild(self):
+        engine = self.engine
+        now = int(engine.clock())
+
+        updateMetrics = metrics.Metrics()
+        updateMetrics.phase('init')
+
+        self.serverName = engine.readServerName()
+        self.usercache = engine.readUsercache()
+        self.excludePlayers = engine.readExcludedPlayers()
+        engine.initDatabase()
+        self.hasIcon = engine.copyServerIcon()
+
+        updateMetrics.phase('load')
+
+        scan = engine.scanSources()
+        self.players = engine.loadPlayers(self.excludePlayers, scan)
+        engine.loadEvents(now)
+        self.playerData = engine.loadPlayerData(self.players, updateMetrics, scan=scan)
+        engine.activityIndex.retain(self.playerData)
+        if engine.statsCache:
+            engine.statsCache.retain(self.playerData)
+
+        updateMetrics.phase('profiles')
+
+        (profiles, profileErrors) = engine.fetchProfiles(self.players, self.playerData, now, updateMetrics)
+
+        updateMetrics.phase('compute')
+
+        self.serverVersion = self.findServerVersion()
+        self.awardStats = engine.findAwardStats(self.serverVersion)
+        self.rankings = {mcstat.name: SortedRanking() for mcstat in self.awardStats}
+
+        # event rankings start with the state loaded from the database
+        self.eventRankings = dict()
+        for event in engine.eventStats:
+            ranking = SortedRanking()
+            for id, delta in event.deltas.items():
+                ranking.set(id, delta)
+
+            self.eventRankings[event.name] = ranking
+
+        self.eventStates = self.getEventStates()
+        self.valid = dict()
+        self.entries = dict()
+        for uuid in self.players:
+            self.updatePlayer(uuid, now, profiles, profileErrors)
+
+        # write everything
+        self.dirtyStats = set(self.rankings.keys())
+        self.dirtyEvents = set(self.eventRankings.keys())
+        self.dirtyPlayers = set(self.valid.keys())
+        self.dirtyCaches = None
+        self.playersChanged = True
+        return self.flush(now, updateMetrics)
+
+    # apply changes to the data files of the given players
+    # players whose activity changed are also updated
+    # returns the metrics of the update, or None if nothing changed
+    def update(self, changed):
+        engine = self.engine
+        now = int(engine.clock())
+        for event in engine.eventStats:
+            event.now = now
+
+        updateMetrics = metrics.Metrics()
+        updateMetrics.phase('load')
+
+        changed = [uuid for uuid in changed if not uuid in self.excludePlayers]
+        for uuid in changed:
+            if not uuid in self.players:
+                self.players[uuid] = {}
+
+        if len(changed) > 0:
+            self.usercache = engine.readUsercache()
+
+        loaded = engine.loadPlayerData(changed, updateMetrics)
+        for uuid in changed:
+            if uuid in loaded:
+                self.playerData[uuid] = loaded[uuid]
+            else:
+                self.playerData.pop(uuid, None)
+
+        engine.activityIndex.retain(self.playerData)
+        if engine.statsCache:
+            engine.statsCache.retain(self.playerData)
+
+        if self.findServerVersion() != self.serverVersion:
+            # the set of award stats may have changed
+            return self.rebuild()
+
+        updateMetrics.phase('profiles')
+
+        # players whose profiles are due for an update are updated as well
+        changedPlayers = {uuid: self.players[uuid] for uuid in changed}
+        for uuid, active in self.valid.items():
+            if not uuid in changedPlayers and engine.needsProfileUpdate(self.players[uuid], active, now):
+                changedPlayers[uuid] = self.players[uuid]
+
+        (profiles, profileErrors) = engine.fetchProfiles(changedPlayers, self.playerData, now, updateMetrics)
+
+        updateMetrics.phase('compute')
+
+        for uuid in changedPlayers:
+            self.updatePlayer(uuid, now, profiles, profileErrors)
+
+        # players that became inactive leave the rankings
+        for uuid, active in list(self.valid.items()):
+            if engine.isActive(self.players[uuid]['last'], now) != active:
+                self.updatePlayer(uuid, now)
+
+        # events that started or ended change the summary
+        eventStates = self.getEventStates()
+        if eventStates != self.eventStates:
+            self.eventStates = eventStates
+            self.dirtyEvents.update(self.eventRankings.keys())
+
+        if not (self.dirtyStats or self.dirtyEvents or self.dirtyPlayers or self.playersChanged):
+            return None
+
+        return self.flush(now, updateMetrics)
+
+    # update a player and the rankings
+    def updatePlayer(self, uuid, now, profiles = None, profileErrors = None):
+        engine = self.engine
+        if profiles is None:
+            profiles = dict()
+        if profileErrors is None:
+            profileErrors = dict()
+
+        player = self.players[uuid]
+        data = self.playerData.get(uuid)
+        oldEntries = self.entries.get(uuid, {})
+
+        # event rankings keep their entries unless a player improves
+        entries = {name: value for name, value in oldEntries.items() if name in self.eventRankings}
+        valid = False
+        active = False
+
+        if data:
+            (last, playtimeTicks, version, values) = data
+
+            if version < 1451: # 17w47a is the absolute minimum
+                print('unsupported data version ' + str(version) + ' for ' + uuid)
+            elif playtimeTicks / (20 * 60) < engine.minPlaytime:
+                # invalidate player
+                player.pop('name', None)
+                player.pop('last', None)
+            else:
+                # determine activity
+                player['last'] = last
+                active = engine.isActive(last, now)
+                valid = engine.updateProfile(uuid, player, active, now, profiles, profileErrors, self.usercache)
+
+            if valid:
+                for mcstat in self.awardStats:
+                    value = values.get(mcstat.name)
+                    if value is not None and value > 0 and mcstat.canEnterRanking(uuid, active):
+                        entries[mcstat.name] = value
+
+                for event in engine.eventStats:
+                    if event.name in values and event.canEnterRanking(uuid, active):
+                        value = values[event.name]['value']
+                        if event.hasStarted():
+                            delta = value - event.initialRanking.get(uuid, 0)
+                            if delta > 0:
+                                entries[event.name] = delta
+                        elif value > 0 and event.initialRanking.get(uuid) != value:
+                            # event is not yet running, update the initial score
+                            event.initialRanking[uuid] = value
+                            self.dirtyEvents.add(event.name)
+
+        # move the player within the rankings
+        for name in oldEntries.keys() | entries.keys():
+            value = entries.get(name)
+            if oldEntries.get(name) != value:
+                if name in self.rankings:
+                    self.dirtyPlayers.update(self.rankings[name].set(uuid, value))
+                    self.dirtyStats.add(name)
+                else:
+                    self.eventRankings[name].set(uuid, value)
+                    self.dirtyEvents.add(name)
+
+        if entries:
+            self.entries[uuid] = entries
+        else:
+            self.entries.pop(uuid, None)
+
+        if valid:
+            self.valid[uuid] = active
+            self.dirtyPlayers.add(uuid)
+        else:
+            self.valid.pop(uuid, None)
+
+        self.playersChanged = True
+        if self.dirtyCaches is not None:
+            self.dirtyCaches.add(uuid[:engine.playerCacheQ])
+
+    # get the stats of a player for the client
+    def playerStats(self, uuid):
+        (last, playtimeTicks, version, values) = self.playerData[uuid]
+        entries = self.entries.get(uuid, {})
+
+        playerStats = dict()
+        for name, value in values.items():
+            mcstat = self.engine.statByName.get(name)
+            if mcstat and mcstat.playerStatRelevant:
+                playerStats[name] = {'value': value}
+                if name in entries and name in self.rankings:
+                    playerStats[name]['rank'] = self.rankings[name].rank(uuid)
+
+        return playerStats
+
+    # write the output files affected by the changes
+    def flush(self, now, updateMetrics):
+        engine = self.engine
+        config = engine.config
+
+        updateMetrics.phase('write')
+
+        # partial flushes keep the digests of the files they do not write in the manifest
+        writer = output.OutputWriter(config.database, engine.writeThreads, config.client.precompress,
+            merge=self.dirtyCaches is not None)
+        try:
+            # write rankings
+            for name in self.dirtyStats:
+                engine.writeRanking(writer, name, self.rankings[name].ranking())
+
+            # write player data
+            storeStats = dict()
+            for uuid in self.dirtyPlayers:
+                if uuid in self.valid:
+                    playerStats = self.playerStats(uuid)
+                    data = jsonio.dumps(playerStats)
+                    if engine.writePlayerFiles:
+                        writer.write(os.path.join(engine.dbPlayerDataPath, uuid + '.json'), data, precompress=True)
+
+                    if engine.playerStore:
+                        storeStats[uuid] = (playerStats, store.stats_digest(data))
+
+                    if engine.timeSeries:
+                        engine.timeSeries.record(uuid, engine.activityIndex.getSignature(uuid), playerStats)
+
+            # write players for next server update
+            validPlayers = dict()
+            serverPlayers = dict()
+            playerlist = []
+            numActivePlayers = 0
+
+            for uuid, player in self.players.items():
+                if uuid in self.valid:
+                    validPlayers[uuid] = player
+
+                    name = player['name']
+                    skin = player['skin'] if 'skin' in player else False
+                    last = player['last']
+
+                    serverPlayers[uuid] = {
+                        'name': name,
+                        'skin': skin,
+                        'last': last,
+                        'update': player['update'] if 'update' in player else 0
+                    }
+
+                    if engine.playerStore:
+                        engine.playerStore.putPlayer(uuid, serverPlayers[uuid], *storeStats.get(uuid, (None, None)))
+
+                    playerlist.append({
+                        'uuid': uuid,
+                        'name': name,
+                        'skin': skin,
+                        'last': last,
+                    })
+
+                    if engine.isActive(last, now):
+                        numActivePlayers += 1
+
+            if engine.playerStore:
+                engine.playerStore.commit(serverPlayers, engine.storeInfo(now, self.awardStats))
+            elif self.playersChanged:
+                writer.writeJson(engine.dbPlayersFilename, serverPlayers)
+
+            # write the caches for the next update, so they survive a restart
+            engine.activityIndex.save()
+            if engine.statsCache:
+                engine.statsCache.save()
+
+            engine.classificationCache.save(engine.readerPlan)
+
+            # append the changes of all stats to the time series
+            if engine.timeSeries:
+                updateMetrics.count('timeSeriesDeltas', engine.timeSeries.commit(now))
+
+            # write event data
+            for event in engine.eventStats:
+                if event.name in self.dirtyEvents and not event.hasEnded():
+                    event.setDeltas(self.eventRankings[event.name].ranking())
+                    engine.writeEvent(writer, event, now)
+
+            # awards and crown scores
+            summaryPlayerIds = set()
+            awards = dict()
+            crowns = dict()
+
+            for mcstat in self.awardStats:
+                award = dict(mcstat.meta)
+                for i, (id, value) in enumerate(self.rankings[mcstat.name].top(3)):
+                    if i == 0:
+                        award['best'] = {'uuid': id, 'value': value}
+                        summaryPlayerIds.add(id)
+
+                    if not id in crowns:
+                        crowns[id] = [0, 0, 0, 0]
+
+                    crowns[id][i+1] += 1
+
+                awards[mcstat.name] = award
+
+            # hall of fame
+            outHof = []
+            for id, score in crowns.items():
+                score[0] = mcstats.CrownScore.compute(score[1], score[2], score[3])
+
+            for id, score in sorted(crowns.items(), key=lambda e: (e[1], e[0]), reverse=True):
+                if score[0] == 0:
+                    break
+
+                outHof.append({
+                    'uuid': id,
+                    'value': score
+                })
+                summaryPlayerIds.add(id)
+
+            # events
+            summaryEvents = dict()
+            for event in engine.eventStats:
+                if not engine.isEventVisible(event, self.serverVersion):
+                    continue
+
+                best = self.eventRankings[event.name].top(1)
+                if best and best[0][0] in validPlayers:
+                    best = best[0]
+                    summaryPlayerIds.add(best[0])
+                else:
+                    best = None
+
+                summaryEvents[event.name] = engine.eventSummary(event, best)
+
+            # write summary for client
+            info = engine.clientInfo(self.serverName, self.hasIcon, len(playerlist), numActivePlayers, now)
+            engine.writeSummary(writer, info, validPlayers, summaryPlayerIds, awards, summaryEvents, outHof)
+
+            # write player cache and lists for client
+            if self.playersChanged and engine.writePlayerFiles:
+                engine.writePlayerCache(writer, validPlayers, self.dirtyCaches)
+                engine.writePlayerLists(writer, playerlist, now)
+
+            # write player search index for client
+            if self.playersChanged and engine.playerSearch:
+                engine.playerSearch.write(writer, validPlayers)
+        finally:
+            # wait for all files to be written
+            writer.close()
+
+            # discard what was written to the player database if the update failed
+            if engine.playerStore:
+                engine.playerStore.rollback()
+
+            if engine.timeSeries:
+                engine.timeSeries.discard()
+
+        self.resetChanges()
+
+        updateMetrics.count('filesWritten', writer.numWritten)
+        updateMetrics.count('filesSkipped', writer.numSkipped)
+        updateMetrics.count('bytesWritten', writer.bytesWritten)
+
+        updateMetricsData = updateMetrics.serialize()
+        output.write_atomic(engine.dbMetricsFilename, jsonio.dumps(updateMetricsData))
+        return updateMetricsData
@@ -0,0 +1,204 @@
+import json
+import os
+
+from mcstats import jsonio
+
+# extract the given advancements from the raw contents of an advancements file
+# returns a dict of the advancements that are present
+#
+# Instead of parsing the whole file, each advancement key is searched in the
+# raw data and only the value following it is parsed. Advancement keys may also
+# appear as criteria, but the value of a criterion is a string, while that of
+# an advancement is an object. If a key appears more than once or not in the
+# expected form, the whole file is parsed.
+def extract_advancements(data, keys):
+    result = dict()
+    decoder = json.JSONDecoder()
+    for key in keys:
+        needle = json.dumps(key).encode()
+        i = data.find(needle)
+        if i < 0:
+            continue # not present
+
+        # skip the colon following the key
+        colon = i + len(needle)
+        while data[colon:colon + 1].isspace():
+            colon += 1
+
+        value = None
+        if data[colon:colon + 1] == b':' and data.find(needle, colon) < 0:
+            value = decoder.raw_decode(data[colon + 1:].decode('utf-8').lstrip())[0]
+
+        if not isinstance(value, dict):
+            advancements = jsonio.loads(data)
+            return {key: advancements[key] for key in keys if key in advancements}
+
+        result[key] = value
+
+    return result
+
+# list the player data files in a directory
+# returns a dict of UUID -> file signature (modification time in nanoseconds and size)
+def scan_dir(path):
+    files = dict()
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.name.endswith('.json'):
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue # removed since listing
+
+                files[entry.name[:-5]] = [st.st_mtime_ns, st.st_size] # cut off '.json' extension
+
+    return files
+
+# Loader for the data files of a player
+#
+# Reads a player's stats and advancements files from all sources and evaluates
+# the extraction plan on them. The result is compact enough to be sent back
+# from a worker process.
+#
+# Which files exist is given by the player's file signature, which lists the
+# signatures of the stats and advancements files of each source (None for
+# missing files), so the loader need not check for them.
+#
+# Of the advancements files, only the advancements read by the plan are
+# extracted. If no stat reads advancements, the files are not read at all.
+class PlayerLoader:
+    def __init__(self, statsDirs, advancementDirs, readerPlan, minPlaytime):
+        self.statsDirs = statsDirs
+        self.advancementDirs = advancementDirs
+        self.readerPlan = readerPlan
+        self.advancementKeys = None if readerPlan.advancementKeys is None else sorted(readerPlan.advancementKeys)
+        self.minPlaytime = minPlaytime
+        self.filesRead = 0
+        self.bytesRead = 0
+
+    # read a data file
+    def readBytes(self, filename):
+        with open(filename, 'rb') as f:
+            data = f.read()
+
+        self.filesRead += 1
+        self.bytesRead += len(data)
+        return data
+
+    # read and parse a JSON data file
+    def readFile(self, filename):
+        return jsonio.loads(self.readBytes(filename))
+
+    # read the advancements needed by the plan from an advancements file
+    def readAdvancements(self, filename):
+        data = self.readBytes(filename)
+        if self.advancementKeys is None:
+            return jsonio.loads(data)
+        else:
+            return extract_advancements(data, self.advancementKeys)
+
+    # read a player's data files
+    # returns the last online time, the total play time, the data version and the list of stats datasets
+    def readData(self, uuid, signature):
+        last = 0
+        playtimeTicks = 0
+        version = 0
+        datasets = []
+
+        for i, statsDir in enumerate(self.statsDirs):
+            statsSignature = signature[2 * i]
+            if statsSignature is not None:
+                try:
+                    data = self.readFile(os.path.join(statsDir, uuid + '.json'))
+                except FileNotFoundError:
+                    continue # removed since listing
+
+                last = max(last, statsSignature[0] // 1000000000)
+
+                # the data version of the last file read is used
+                if 'DataVersion' in data:
+                    version = data['DataVersion']
+                else:
+                    version = 0
+
+                if 'stats' in data:
+                    stats = data['stats']
+
+                    if 'minecraft:custom' in stats:
+                        custom = stats['minecraft:custom']
+                        if 'minecraft:play_time' in custom:
+                            playtimeTicks += int(custom['minecraft:play_time']) # new in 21w16a (data version 2711)
+                        if 'minecraft:play_one_minute' in custom:
+                            playtimeTicks += int(custom['minecraft:play_one_minute'])
+
+                    # also attempt to load advancements
+                    if signature[2 * i + 1] is not None and self.advancementKeys != []:
+                        try:
+                            stats['advancements'] = self.readAdvancements(os.path.join(self.advancementDirs[i], uuid + '.json'))
+                        except FileNotFoundError:
+                            pass # removed since listing
+
+                    datasets.append(stats)
+
+        return (last, playtimeTicks, version, datasets)
+
+    # test whether stat values are needed for a player
+    def needsValues(self, playtimeTicks, version):
+        if version < 1451: # 17w47a is the absolute minimum
+            return False
+
+        return (playtimeTicks / (20 * 60)) >= self.minPlaytime
+
+    # compute the aggregated stat values over all datasets
+    # the result is a list of values in the order of the plan's eligible stats for the data version
+    def computeValues(self, datasets, version):
+        results = None
+        for stats in datasets:
+            values = self.readerPlan.read(stats, version)
+            if results is None:
+                results = [value for mcstat, value in values]
+            else:
+                for i, (mcstat, value) in enumerate(values):
+                    results[i] = mcstat.aggregate(results[i], value)
+
+        return [value['value'] for value in results]
+
+    # get the names of the stats in a value list for the given data version
+    def valueNames(self, version):
+        return [mcstat.name for mcstat, out, slot in self.readerPlan.getEligible(version)]
+
+    # load a player
+    # returns None if no data is available, or the last online time, the total
+    # play time, the data version and the stat values if they are needed
+    def load(self, uuid, signature):
+        (last, playtimeTicks, version, datasets) = self.readData(uuid, signature)
+        if len(datasets) == 0:
+            return None
+
+        if self.needsValues(playtimeTicks, version):
+            values = self.computeValues(datasets, version)
+        else:
+            values = None
+
+        return (last, playtimeTicks, version, values)
+
+    # get the number of files and bytes read since the previous call
+    def takeCounters(self):
+        counters = (self.filesRead, self.bytesRead)
+        self.filesRead = 0
+        self.bytesRead = 0
+        return counters
+
+# the loader used by a worker process
+workerLoader = None
+
+# initialize a worker process
+def init_worker(loader):
+    global workerLoader
+    workerLoader = loader
+
+# load a player, given by UUID and file signature, in a worker process
+# returns the result along with the number of files and bytes read and the keys classified meanwhile
+def load_player(task):
+    (uuid, signature) = task
+    result = workerLoader.load(uuid, signature)
+    return (result, workerLoader.takeCounters(), workerLoader.readerPlan.takeClassified())
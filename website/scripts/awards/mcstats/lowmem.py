@@ -0,0 +1,245 @@
+import array
+import mmap
+import os
+import tempfile
+
+# marks a stat that is not available for a player
+MISSING = -2**63
+
+# Spill file for the stat values of all players
+#
+# Each player's values for the registry stats are appended to an unnamed
+# temporary file as a fixed-width record of 64-bit integers as soon as the
+# player is loaded. Only the record index is kept in memory. Event values are
+# few and kept along with it.
+class ValueSpill:
+    def __init__(self, stats, dirname):
+        self.stats = stats
+        self.names = [mcstat.name for mcstat in stats]
+        self.statIndex = {name: j for j, name in enumerate(self.names)}
+        self.width = len(stats)
+        self.dirname = dirname
+        self.file = tempfile.TemporaryFile(dir=dirname, prefix='.spill.')
+        self.count = 0
+        self.dirty = False
+        self.view = None
+        self.mapping = None
+
+    def close(self):
+        if self.view is not None:
+            self.view.release()
+            self.mapping.close()
+
+        self.file.close()
+
+    # append the values of a player
+    # returns the spilled values
+    def append(self, values):
+        record = array.array('q', [MISSING]) * self.width
+        events = None
+        for name, value in values.items():
+            j = self.statIndex.get(name)
+            if j is not None:
+                record[j] = value
+            else:
+                if events is None:
+                    events = dict()
+                events[name] = value
+
+        self.file.write(record.tobytes())
+        self.dirty = True
+
+        i = self.count
+        self.count += 1
+        return SpilledValues(self, i, events)
+
+    # get the values of all players as a flat, read-only array
+    def values(self):
+        if self.view is None:
+            self.file.flush()
+            self.dirty = False
+            if self.count * self.width > 0:
+                self.mapping = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+                self.view = memoryview(self.mapping).cast('q')
+            else:
+                return []
+
+        return self.view
+
+    # get the record of a player
+    def record(self, i):
+        if self.view is not None:
+            return self.view[i * self.width : (i + 1) * self.width].tolist()
+
+        if self.dirty:
+            self.file.flush()
+            self.dirty = False
+
+        size = 8 * self.width
+        return array.array('q', os.pread(self.file.fileno(), size, i * size)).tolist()
+
+# Stat values of a player kept in a spill file
+#
+# Behaves like the dict of stat values the loader produces for a player.
+class SpilledValues:
+    __slots__ = ['spill', 'index', 'events']
+
+    def __init__(self, spill, index, events):
+        self.spill = spill
+        self.index = index
+        self.events = events
+
+    def items(self):
+        names = self.spill.names
+        for j, value in enumerate(self.spill.record(self.index)):
+            if value != MISSING:
+                yield (names[j], value)
+
+        if self.events:
+            yield from self.events.items()
+
+    def keys(self):
+        return [name for name, value in self.items()]
+
+    def __getitem__(self, name):
+        j = self.spill.statIndex.get(name)
+        if j is None:
+            if self.events and name in self.events:
+                return self.events[name]
+        else:
+            value = self.spill.record(self.index)[j]
+            if value != MISSING:
+                return value
+
+        raise KeyError(name)
+
+    def __contains__(self, name):
+        try:
+            self[name]
+            return True
+        except KeyError:
+            return False
+
+    def get(self, name, default = None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+# Stat rankings computed from a value spill
+#
+# Has the interface of the columnar engine's StatMatrix, but needs memory only
+# for one stat at a time. Rankings are computed one by one from the columns of
+# the spill file, and the ranks are written to a second temporary file for the
+# player data files. Only the medals of the crown score are kept in memory.
+class SpillMatrix:
+    def __init__(self, spill):
+        self.spill = spill
+        self.stats = spill.stats
+        self.statIndex = spill.statIndex
+        self.relevant = [mcstat.playerStatRelevant for mcstat in self.stats]
+        self.names = spill.names
+
+        n = spill.count
+        self.uuids = [None] * n
+        self.uuidIndex = dict()
+        self.valid = bytearray(n)
+        self.active = bytearray(n)
+
+        self.rankedNames = set()
+        self.medals = dict()
+        self.uuidOrder = None
+
+        # ranks of all players in all stats, 0 if not ranked
+        self.rankFile = tempfile.TemporaryFile(dir=spill.dirname, prefix='.ranks.')
+        size = 4 * n * spill.width
+        if size > 0:
+            self.rankFile.truncate(size)
+            self.rankMapping = mmap.mmap(self.rankFile.fileno(), size)
+            self.ranks = memoryview(self.rankMapping).cast('i')
+        else:
+            self.rankMapping = None
+            self.ranks = None
+
+    def close(self):
+        if self.ranks is not None:
+            self.ranks.release()
+            self.rankMapping.close()
+
+        self.rankFile.close()
+
+    # store the stat values of a player, which must have been spilled
+    def setPlayer(self, uuid, version, active, values):
+        i = values.index
+        self.uuids[i] = uuid
+        self.uuidIndex[uuid] = i
+        self.valid[i] = True
+        self.active[i] = active
+
+    # prepare computing the rankings, which are computed one by one when requested
+    def rank(self, stats):
+        # position of each player in the order of UUIDs, used to break ties
+        self.uuidOrder = [0] * len(self.uuids)
+        for k, i in enumerate(sorted(self.uuidIndex.values(), key=lambda i: self.uuids[i])):
+            self.uuidOrder[i] = k
+
+    # compute the ranking of a stat as a list of (uuid, value) pairs
+    # like MinecraftStat, only active players with a value greater than zero enter a ranking
+    def ranking(self, name):
+        j = self.statIndex[name]
+        m = self.spill.width
+        column = self.spill.values()[j::m]
+        column = column.tolist() if len(column) > 0 else []
+
+        active = self.active
+        uuidOrder = self.uuidOrder
+        entered = [i for i, value in enumerate(column) if active[i] and value > 0]
+        entered.sort(key=lambda i: (column[i], uuidOrder[i]), reverse=True)
+
+        if not name in self.rankedNames:
+            self.rankedNames.add(name)
+            ranks = self.ranks
+            for position, i in enumerate(entered):
+                ranks[i * m + j] = position + 1
+
+            # medals for the crown score
+            for place, i in enumerate(entered[:3]):
+                medals = self.medals.get(i)
+                if medals is None:
+                    medals = [0, 0, 0]
+                    self.medals[i] = medals
+
+                medals[place] += 1
+
+        uuids = self.uuids
+        return [(uuids[i], column[i]) for i in entered]
+
+    # compute the hall of fame as a list of (uuid, [crown score, gold, silver, bronze]) pairs
+    # only active players with a crown score greater than zero are listed
+    def hallOfFame(self, gold, silver, bronze):
+        hof = []
+        for i, (g, s, b) in self.medals.items():
+            score = gold * g + silver * s + bronze * b
+            if self.valid[i] and self.active[i] and score > 0:
+                hof.append((self.uuids[i], [score, g, s, b]))
+
+        hof.sort(key=lambda e: (e[1], self.uuidOrder[self.uuidIndex[e[0]]]), reverse=True)
+        return hof
+
+    # get the stats of a player in the form of the player data files
+    def playerStats(self, uuid):
+        i = self.uuidIndex[uuid]
+        m = self.spill.width
+        values = self.spill.record(i)
+        ranks = self.ranks[i * m : (i + 1) * m].tolist() if self.ranks is not None else []
+
+        playerStats = dict()
+        for j, value in enumerate(values):
+            if value != MISSING and self.relevant[j]:
+                entry = {'value': value}
+                if ranks[j] > 0:
+                    entry['rank'] = ranks[j]
+
+                playerStats[self.names[j]] = entry
+
+        return playerStats
@@ -1,9 +1,7 @@
+import collections
 import json
+import operator
 import re
-import time
-
-# get a fixed sense of "now"
-now = int(time.time())
 
 # basic path reading function
 def read(stats, path, default):
@@ -47,12 +45,20 @@ class StatSumReader:
         return sum
 
 # Reader that sums up all stats matching one of multiple regular expressions
+#
+# The expressions are compiled when they are first needed.
 class StatSumMatchReader:
     def __init__(self, path, patterns):
         self.path = path
-        self.progs = []
-        for p in patterns:
-            self.progs.append(re.compile('^{}$'.format(p)))
+        self.patterns = list(patterns)
+        self._progs = None
+
+    @property
+    def progs(self):
+        if self._progs is None:
+            self._progs = [re.compile('^{}$'.format(p)) for p in self.patterns]
+
+        return self._progs
 
     def read(self, stats):
         sum = 0
@@ -64,45 +70,65 @@ class StatSumMatchReader:
 
         return sum
 
-# Ranking entries
-class RankingEntry:
-    def __init__(self, id, value):
-        self.id = id
-        self.value = value
+# get the keys of the advancements read by a reader, or None if it reads all advancements
+# advancements are read via paths starting with 'advancements', followed by the advancement key
+def reader_advancement_keys(reader):
+    keys = set()
 
-    def __eq__(self, other):
-        return self.id == other.id and self.value == other.value
+    path = getattr(reader, 'path', None)
+    if path and path[0] == 'advancements':
+        if len(path) < 2:
+            return None
 
-    def __ne__(self, other):
-        return not self.__eq__(other)
+        keys.add(path[1])
 
-    def __lt__(self, other):
-        if self.value != other.value:
-            return self.value < other.value
-        else: # use player ID as fallback to keep things deterministic
-            return self.id < other.id
+    for r in getattr(reader, 'summands', []) + [getattr(reader, 'a', None), getattr(reader, 'b', None)]:
+        if r is not None:
+            readerKeys = reader_advancement_keys(r)
+            if readerKeys is None:
+                return None
 
-    def __gt__(self, other):
-        return not self.__eq__(other) and not self.__lt__(other)
+            keys.update(readerKeys)
 
-    def __le__(self, other):
-        return self.__eq__(other) or self.__lt__(other)
+    return keys
 
-    def __ge__(self, other):
-        return self.__eq__(other) or self.__gt__(other)
+# Ranking entries
+RankingEntry = collections.namedtuple('RankingEntry', ['id', 'value'])
+
+# sort key for ranking entries - by value, using player ID as fallback to keep things deterministic
+rankingKey = operator.itemgetter(1, 0)
+
+# sort key for ranking entries with a crown score value
+def crownRankingKey(entry):
+    return (entry.value.score, entry.id)
 
 # Rankings
 class Ranking:
-    def __init__(self):
+    def __init__(self, key = rankingKey):
         self.ranking = []
+        self.key = key
+        self.isSorted = True
 
     # enter the player with id and value into the ranking
     def enter(self, id, value):
         self.ranking.append(RankingEntry(id, value))
+        self.isSorted = False
+
+    # remove all entries
+    def clear(self):
+        self.ranking = []
+        self.isSorted = True
 
     # sort ranking
     def sort(self):
-        self.ranking.sort(reverse=True)
+        if not self.isSorted:
+            self.ranking.sort(key=self.key, reverse=True)
+            self.isSorted = True
+
+    # get the k best entries
+    def top(self, k):
+        self.sort()
+        return self.ranking[:k]
 
 # Aggregation functions
 def aggregateSum(a, b):
@@ -133,6 +159,11 @@ class MinecraftStat(Ranking):
     def read(self, stats):
         return {'value': self.reader.read(stats)}
 
+    # get the keys of the advancements this stat reads, or None if it needs all of them
+    # stats that read advancements other than through their reader must override this
+    def advancementKeys(self):
+        return reader_advancement_keys(self.reader)
+
     # test if this stat can be used right now
     def isEligible(self, version):
         return (version >= self.minVersion and version <= self.maxVersion)
@@ -142,10 +173,10 @@ class MinecraftStat(Ranking):
         return active
 
 # Event statistics for temporary events
+#
+# Whether the event is running is determined by the time of the update (now).
 class EventStat(Ranking):
-    def __init__(self, name, title, link, startTime, endTime):
-        global now
-
+    def __init__(self, name, title, link, startTime, endTime, now = 0):
         self.name = name
         self.title = title
         self.link = link
@@ -153,41 +184,70 @@ class EventStat(Ranking):
         self.maxVersion = link.maxVersion
         self.startTime = startTime
         self.endTime = endTime
+        self.now = now
         self.initialRanking = dict()
+        self.deltas = dict()
         self.ranking = []
+        self.key = rankingKey
+        self.isSorted = True
         self.linkedStat = True
         self.playerStatRelevant = False
 
     # enter the player with id and value delta into the ranking
+    # a player's delta replaces the one entered previously (e.g., loaded from the database)
     def enter(self, id, value):
-        global now
-        
         value = value['value'] # yikes!
 
         if self.hasStarted():
             # subtract initial value and enter
-            if id in self.initialRanking:
-                initial = self.initialRanking[id]
-            else:
-                initial = 0
-
-            MinecraftStat.enter(self, id, value - initial)
+            delta = value - self.initialRanking.get(id, 0)
+            if delta > 0:
+                self.deltas[id] = delta
+                self.isSorted = False
         elif value > 0:
             # event is not yet running, update the initial score
             self.initialRanking[id] = value
 
+    # remove all entries
+    def clear(self):
+        Ranking.clear(self)
+        self.deltas = dict()
+
+    # remove all entries and the initial ranking for a new update at the given time
+    def reset(self, now):
+        self.clear()
+        self.initialRanking = dict()
+        self.now = now
+
+    # replace the ranking by the given deltas
+    def setDeltas(self, deltas):
+        self.deltas = dict(deltas)
+        self.isSorted = False
+
+    # sort ranking, which is built from the players' deltas
+    def sort(self):
+        if not self.isSorted:
+            self.ranking = [RankingEntry(id, delta) for id, delta in self.deltas.items()]
+            Ranking.sort(self)
+
     # read the statistic value from the player stats via the linked stat
     def read(self, stats):
         return {'value': self.link.read(stats)}
 
+    # aggregate values read from multiple sources via the linked stat
+    def aggregate(self, a, b):
+        return {'value': self.link.aggregate(a['value'], b['value'])}
+
+    # get the keys of the advancements the linked stat reads
+    def advancementKeys(self):
+        return self.link.advancementKeys()
+
     # test if the event has already started
     def hasStarted(self):
-        global now
-        return now >= self.startTime
+        return self.now >= self.startTime
 
     def hasEnded(self):
-        global now
-        return now >= self.endTime
+        return self.now >= self.endTime
 
     def isRunning(self):
         return self.hasStarted() and not self.hasEnded()
@@ -200,20 +260,21 @@ class EventStat(Ranking):
     def canEnterRanking(self, id, active):
         return not self.hasEnded() # nb: inactive players must be considered for the initial ranking
 
-    # serializes the event stat to a dictionary
+    # serializes the event stat and its ranking to a dictionary
+    # the initial values are kept in the event history
     def serialize(self):
+        self.sort()
         ranking = []
         for entry in self.ranking:
             ranking.append({'uuid':entry.id,'value':entry.value})
 
         return {
-            'name':           self.name,
-            'title':          self.title,
-            'link':           self.link.name,
-            'startTime':      self.startTime,
-            'endTime':        self.endTime,
-            'initialRanking': self.initialRanking,
-            'ranking':        ranking
+            'name':      self.name,
+            'title':     self.title,
+            'link':      self.link.name,
+            'startTime': self.startTime,
+            'endTime':   self.endTime,
+            'ranking':   ranking
         }
 
 # Crown score (a meta statistic)
@@ -259,4 +320,4 @@ class CrownScore:
         self.score[0] = CrownScore.compute(self.score[1], self.score[2], self.score[3])
 
 # the global registry
-registry = []
+registry: list = []
@@ -0,0 +1,71 @@
+import resource
+import time
+
+# peak resident set size of this process and its (waited for) children in bytes
+def peak_rss():
+    # ru_maxrss is given in kilobytes on Linux
+    return 1024 * max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+# CPU time used by this process and its (waited for) children in seconds
+def cpu_time():
+    t = 0
+    for who in [resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN]:
+        usage = resource.getrusage(who)
+        t += usage.ru_utime + usage.ru_stime
+
+    return t
+
+# Timings and counters of an update
+#
+# Phases run one after another. Starting a phase ends the previous one, which
+# allows timing the sections of the updater script without restructuring it.
+# For each phase, the wall time and the CPU time (including worker processes)
+# are measured.
+class Metrics:
+    def __init__(self):
+        self.phases = dict()
+        self.counters = dict()
+        self.current = None
+        self.startTime = time.time()
+        self.startWall = time.perf_counter()
+        self.startCpu = cpu_time()
+        self.phaseWall = self.startWall
+        self.phaseCpu = self.startCpu
+
+    # end the current phase, if any, and start a new one
+    def phase(self, name):
+        self.end()
+        self.current = name
+        self.phaseWall = time.perf_counter()
+        self.phaseCpu = cpu_time()
+
+    # end the current phase
+    def end(self):
+        if self.current:
+            wall = time.perf_counter() - self.phaseWall
+            cpu = cpu_time() - self.phaseCpu
+
+            phase = self.phases.setdefault(self.current, {'wall': 0, 'cpu': 0})
+            phase['wall'] += wall
+            phase['cpu'] += cpu
+            self.current = None
+
+    # increase a counter
+    def count(self, name, n = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    # get the metrics as a dict
+    def serialize(self):
+        self.end()
+        return {
+            'time': int(self.startTime),
+            'phases': {name: {k: round(t, 6) for k, t in p.items()} for name, p in self.phases.items()},
+            'total': {
+                'wall': round(time.perf_counter() - self.startWall, 6),
+                'cpu':  round(cpu_time() - self.startCpu, 6),
+            },
+            'counters': dict(self.counters),
+            'peakRss': peak_rss(),
+        }
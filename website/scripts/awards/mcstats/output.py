@@ -0,0 +1,159 @@
+import collections
+import concurrent.futures
+import gzip
+import hashlib
+import os
+import tempfile
+
+from mcstats import jsonio
+
+try:
+    import brotli # type: ignore
+except ImportError:
+    brotli = None # type: ignore[assignment]
+
+# compressors for pre-compressed siblings of files, by file extension
+def compress_gzip(data):
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+def compress_brotli(data):
+    # a window no larger than the data avoids allocating large buffers for small files
+    return brotli.compress(data, quality=9, lgwin=max(10, min(24, len(data).bit_length() + 1)))
+
+precompressors = [('.gz', compress_gzip), ('.br', compress_brotli)]
+
+# write a file atomically by writing a temporary file and renaming it
+# this way, the web server never serves a partially written file
+def write_atomic(filename, data):
+    dirname, basename = os.path.split(filename)
+    fd, tmpFilename = tempfile.mkstemp(dir=dirname, prefix='.' + basename + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+
+        os.chmod(tmpFilename, 0o644)
+        os.replace(tmpFilename, filename)
+    except:
+        os.unlink(tmpFilename)
+        raise
+
+# Writer for the files of the awards database
+#
+# Files are only rewritten if their content changed since the previous update.
+# For this, the digests of all written contents are kept in a manifest in the
+# database. Files are written atomically by a pool of threads. The number of
+# pending writes is limited, so the contents of all files are never held in
+# memory at once.
+#
+# Normally, the manifest only keeps the files written by the last writer, so the
+# digests of files that are no longer written are dropped. Writers of partial
+# updates can merge their digests into the manifest instead.
+#
+# If requested, pre-compressed siblings (.gz and, if the brotli module is
+# available, .br) are written along with a file, so the web server can serve
+# them without compressing on every request.
+class OutputWriter:
+    def __init__(self, database, threads = 4, precompress = True, merge = False):
+        self.database = database
+        self.precompress = precompress
+        self.merge = merge
+        self.precompressors = [(ext, f) for ext, f in precompressors if f != compress_brotli or brotli]
+        self.manifestFilename = os.path.join(database, '.outputs.json')
+        self.digests = dict()
+        self.newDigests = dict()
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, threads))
+        self.futures = collections.deque()
+        self.maxPending = 16 * max(1, threads)
+        self.numWritten = 0
+        self.numSkipped = 0
+        self.bytesWritten = 0
+
+        if os.path.isfile(self.manifestFilename):
+            try:
+                self.digests = jsonio.load(self.manifestFilename)
+            except Exception as e:
+                print('discarding unreadable output manifest ' + self.manifestFilename + ': ' + str(e))
+
+    # write a file unless it already has the given content
+    # returns the manifest key and digest, and the number of bytes written (None if the file was skipped)
+    def writeFile(self, filename, data, compress, precompress):
+        key = os.path.relpath(filename, self.database)
+        digest = hashlib.sha1(data).hexdigest()
+
+        if precompress:
+            siblings = self.precompressors
+        else:
+            siblings = []
+
+        if self.digests.get(key) == digest and os.path.isfile(filename) and \
+                all(os.path.isfile(filename + ext) for ext, f in siblings):
+            return (key, digest, None)
+
+        if compress:
+            content = compress_gzip(data)
+        else:
+            content = data
+
+        write_atomic(filename, content)
+        numBytes = len(content)
+
+        for ext, f in precompressors:
+            if (ext, f) in siblings:
+                content = f(data)
+                write_atomic(filename + ext, content)
+                numBytes += len(content)
+            elif os.path.isfile(filename + ext):
+                # remove outdated sibling so it is not served instead of the new file
+                os.unlink(filename + ext)
+
+        return (key, digest, numBytes)
+
+    # write raw bytes
+    # if compress is set, the file is gzip compressed, if precompress is set, pre-compressed siblings are written
+    def write(self, filename, data, compress = False, precompress = False):
+        precompress = precompress and self.precompress and not compress
+        self.futures.append(self.pool.submit(self.writeFile, filename, data, compress, precompress))
+
+        # wait for the oldest writes if too many are pending
+        while len(self.futures) > self.maxPending:
+            self.collect(self.futures.popleft())
+
+    # write an object as JSON
+    def writeJson(self, filename, obj, compress = False, precompress = False):
+        self.write(filename, jsonio.dumps(obj), compress, precompress)
+
+    # wait for a pending write and count it
+    def collect(self, future):
+        (key, digest, numBytes) = future.result()
+        self.newDigests[key] = digest
+        if numBytes is not None:
+            self.numWritten += 1
+            self.bytesWritten += numBytes
+        else:
+            self.numSkipped += 1
+
+    # wait for all pending writes
+    def flush(self):
+        while self.futures:
+            self.collect(self.futures.popleft())
+
+    # wait for all pending writes and store the manifest
+    # unless merging, files that were not written by this writer are dropped from the manifest
+    def close(self):
+        try:
+            self.flush()
+        except:
+            # files may have been written without being recorded, so the manifest can no longer be trusted
+            self.pool.shutdown()
+            if os.path.isfile(self.manifestFilename):
+                os.unlink(self.manifestFilename)
+            raise
+
+        self.pool.shutdown()
+        if self.merge:
+            digests = self.digests
+            digests.update(self.newDigests)
+        else:
+            digests = self.newDigests
+
+        write_atomic(self.manifestFilename, jsonio.dumps(digests))
@@ -0,0 +1,246 @@
+from mcstats import mcstats
+
+# operations evaluated after all groups have been read
+OP_SUM  = 0 # sum of multiple slots
+OP_DIFF = 1 # difference of two slots
+OP_CALL = 2 # reader that cannot be compiled
+
+# kinds of stat outputs
+OUT_VALUE    = 0 # the stat value is a slot
+OUT_EVENT    = 1 # event linked to a stat whose value is a slot
+OUT_FALLBACK = 2 # the stat's own read function is called
+
+# Key matching for all StatSumMatchReaders that read the same group
+#
+# The regular expressions are evaluated only once for every distinct key. The
+# result is the list of slots the key's value contributes to, along with how
+# many patterns of the respective reader matched. Keys classified since they
+# were last taken are tracked, so the classifications can be collected from
+# worker processes and persisted.
+class GroupMatcher:
+    def __init__(self):
+        self.readers = []
+        self.targets = dict()
+        self.classified = dict()
+
+    def add(self, slot, reader):
+        self.readers.append((slot, reader))
+
+    def classify(self, key):
+        targets = []
+        for slot, reader in self.readers:
+            n = 0
+            for p in reader.progs:
+                if p.match(key):
+                    n += 1
+
+            if n > 0:
+                targets.append((slot, n))
+
+        targets = tuple(targets)
+        self.targets[key] = targets
+        self.classified[key] = targets
+        return targets
+
+# Stats group (e.g., "minecraft:custom") read by the plan
+class PlanGroup:
+    def __init__(self, path):
+        self.path = path
+        self.leaves = []
+        self.matcher = None
+
+# Extraction plan compiled from a list of stats
+#
+# All readers of the stats are flattened into a list of value slots. Plain
+# readers are grouped by the stats group they read from, so that each group is
+# looked up only once per player and regex matching is done only once per
+# distinct key.
+#
+# The plan also collects the keys of the advancements read by the stats (None
+# if all are needed), so only those need to be extracted from the advancements
+# files.
+class ReaderPlan:
+    def __init__(self, stats):
+        self.stats = stats
+        self.numSlots = 0
+        self.groups = dict()
+        self.ops = []
+        self.slotByKey = dict()
+        self.outputs = []
+        self.eligible = dict()
+        self.advancementKeys = set()
+
+        for mcstat in stats:
+            self.outputs.append(self.compileStat(mcstat))
+
+            if self.advancementKeys is not None:
+                keys = mcstat.advancementKeys()
+                if keys is None:
+                    self.advancementKeys = None
+                else:
+                    self.advancementKeys.update(keys)
+
+        self.groupList = list(self.groups.values())
+
+    def newSlot(self, key = None):
+        slot = self.numSlots
+        self.numSlots += 1
+        if key is not None:
+            self.slotByKey[key] = slot
+        return slot
+
+    def getGroup(self, path):
+        path = tuple(path)
+        if not path in self.groups:
+            self.groups[path] = PlanGroup(path)
+
+        return self.groups[path]
+
+    # compile a reader into a value slot
+    def compileReader(self, reader):
+        t = type(reader)
+        if t is mcstats.StatReader and len(reader.path) > 0:
+            key = ('read', tuple(reader.path), reader.default)
+            try:
+                if key in self.slotByKey:
+                    return self.slotByKey[key]
+            except TypeError:
+                key = None # unhashable default
+
+            slot = self.newSlot(key)
+            self.getGroup(reader.path[:-1]).leaves.append((slot, reader.path[-1], reader.default))
+            return slot
+
+        elif t is mcstats.StatSumMatchReader:
+            key = ('match', tuple(reader.path), tuple(reader.patterns))
+            if key in self.slotByKey:
+                return self.slotByKey[key]
+
+            slot = self.newSlot(key)
+            group = self.getGroup(reader.path)
+            if not group.matcher:
+                group.matcher = GroupMatcher()
+
+            group.matcher.add(slot, reader)
+            return slot
+
+        elif t is mcstats.StatSumReader:
+            summands = [self.compileReader(s) for s in reader.summands]
+            slot = self.newSlot()
+            self.ops.append((OP_SUM, slot, summands))
+            return slot
+
+        elif t is mcstats.StatDiffReader:
+            a = self.compileReader(reader.a)
+            b = self.compileReader(reader.b)
+            slot = self.newSlot()
+            self.ops.append((OP_DIFF, slot, (a, b)))
+            return slot
+
+        else:
+            slot = self.newSlot()
+            self.ops.append((OP_CALL, slot, reader))
+            return slot
+
+    # compile a stat into an output
+    def compileStat(self, mcstat):
+        t = type(mcstat)
+        if isinstance(mcstat, mcstats.EventStat):
+            link = mcstat.link
+            if t.read is mcstats.EventStat.read and type(link).read is mcstats.MinecraftStat.read:
+                return (mcstat, OUT_EVENT, self.compileReader(link.reader))
+        elif isinstance(mcstat, mcstats.MinecraftStat):
+            if t.read is mcstats.MinecraftStat.read:
+                return (mcstat, OUT_VALUE, self.compileReader(mcstat.reader))
+
+        return (mcstat, OUT_FALLBACK, None)
+
+    # get the groups that have a matcher
+    def matcherGroups(self):
+        return [group for group in self.groupList if group.matcher]
+
+    # get the keys classified since the previous call
+    # returns a list of (group index, classified keys) pairs
+    def takeClassified(self):
+        result = []
+        for i, group in enumerate(self.groupList):
+            matcher = group.matcher
+            if matcher and matcher.classified:
+                result.append((i, matcher.classified))
+                matcher.classified = dict()
+
+        return result
+
+    # add keys classified by another instance of the plan (e.g., in a worker process)
+    # returns the number of keys that were not yet known
+    def addClassified(self, classified):
+        n = 0
+        for i, keys in classified:
+            targets = self.groupList[i].matcher.targets
+            for key, t in keys.items():
+                if not key in targets:
+                    targets[key] = t
+                    n += 1
+
+        return n
+
+    # get the outputs eligible for the given data version
+    def getEligible(self, version):
+        if not version in self.eligible:
+            self.eligible[version] = [o for o in self.outputs if o[0].isEligible(version)]
+
+        return self.eligible[version]
+
+    # read all stats eligible for the given data version
+    # returns a list of (stat, value) pairs, the value being what the stat's read function would return
+    def read(self, stats, version):
+        values = [0] * self.numSlots
+
+        for group in self.groupList:
+            data = mcstats.read(stats, group.path, None)
+            if data is None:
+                for slot, key, default in group.leaves:
+                    values[slot] = default
+                continue
+
+            if isinstance(data, dict):
+                get = data.get
+                for slot, key, default in group.leaves:
+                    values[slot] = get(key, default)
+            else:
+                for slot, key, default in group.leaves:
+                    values[slot] = mcstats.read(data, [key], default)
+
+            matcher = group.matcher
+            if matcher:
+                targets = matcher.targets
+                for k, v in data.items():
+                    t = targets.get(k)
+                    if t is None:
+                        t = matcher.classify(k)
+
+                    for slot, n in t:
+                        values[slot] += v * n
+
+        for op, slot, arg in self.ops:
+            if op == OP_SUM:
+                values[slot] = sum([values[i] for i in arg])
+            elif op == OP_DIFF:
+                values[slot] = values[arg[0]] - values[arg[1]]
+            else:
+                values[slot] = arg.read(stats)
+
+        result = []
+        for mcstat, out, slot in self.getEligible(version):
+            if out == OUT_VALUE:
+                result.append((mcstat, {'value': values[slot]}))
+            elif out == OUT_EVENT:
+                result.append((mcstat, {'value': {'value': values[slot]}}))
+            else:
+                result.append((mcstat, mcstat.read(stats)))
+
+        return result
+
+# compile the given stats into an extraction plan
+def compile(stats):
+    return ReaderPlan(stats)
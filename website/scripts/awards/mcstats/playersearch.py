@@ -0,0 +1,98 @@
+import glob
+import hashlib
+import os
+
+from mcstats import jsonio
+
+# length of the name prefixes the index is sharded by
+prefixLength = 2
+
+# number of hex digits of a shard's digest stored in the index
+digestLength = 12
+
+# characters that may appear in a shard key, others are replaced by '-'
+keyChars = set('abcdefghijklmnopqrstuvwxyz0123456789_')
+
+# normalize a player name for searching
+def normalize_name(name):
+    return name.lower()
+
+# get the key of the shard a player name belongs to
+def shard_key(name):
+    key = ''.join(c if c in keyChars else '-' for c in normalize_name(name)[:prefixLength])
+    return key if key else '-'
+
+# Index for searching players by name prefix
+#
+# Players are sharded by the first characters of their lowercase name, so the
+# players matching a search are found in a single small file, or a few files for
+# searches shorter than the prefix length. Each shard is a list of [name, uuid]
+# pairs sorted by lowercase name. The rest of a player's data can be found in the
+# player cache.
+#
+# The index file lists the shards along with a digest of their contents, which
+# tells the client which shards exist and can be used to revalidate them. Only
+# shards whose digest changed are written, so the index is only rewritten when
+# players are renamed, added or removed.
+class PlayerSearchIndex:
+    def __init__(self, path):
+        self.path = path
+        self.indexFilename = os.path.join(path, 'index.json')
+        self.shards = None # key -> digest as written
+
+    def shardFilename(self, key):
+        return os.path.join(self.path, key + '.json')
+
+    # load the shard digests from the index file
+    def load(self):
+        self.shards = dict()
+        if not os.path.isfile(self.indexFilename):
+            return
+
+        try:
+            index = jsonio.load(self.indexFilename)
+            if index.get('prefixLength') == prefixLength:
+                self.shards = index['shards']
+        except Exception as e:
+            print('discarding unreadable player search index ' + self.indexFilename + ': ' + str(e))
+
+    # write the shards for the given players (UUID -> player) that changed
+    # returns the number of shards written
+    def write(self, writer, players):
+        if self.shards is None or not os.path.isfile(self.indexFilename):
+            self.load()
+
+        shards = dict()
+        for uuid, player in players.items():
+            key = shard_key(player['name'])
+            if not key in shards:
+                shards[key] = list()
+
+            shards[key].append([player['name'], uuid])
+
+        digests = dict()
+        numWritten = 0
+        for key in sorted(shards):
+            entries = sorted(shards[key], key=lambda e: (normalize_name(e[0]), e[1]))
+            data = jsonio.dumps(entries)
+            digests[key] = hashlib.sha1(data).hexdigest()[:digestLength]
+
+            filename = self.shardFilename(key)
+            if self.shards.get(key) != digests[key] or not os.path.isfile(filename):
+                writer.write(filename, data, precompress=True)
+                numWritten += 1
+
+        # remove shards no player belongs to anymore
+        for key in self.shards:
+            if not key in digests:
+                for filename in glob.glob(glob.escape(self.shardFilename(key)) + '*'):
+                    os.unlink(filename)
+
+        if digests != self.shards:
+            writer.writeJson(self.indexFilename, {
+                'prefixLength': prefixLength,
+                'shards':       digests,
+            }, precompress=True)
+            self.shards = digests
+
+        return numWritten
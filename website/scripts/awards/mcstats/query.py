@@ -0,0 +1,190 @@
+import collections
+import hashlib
+import http.server
+import os
+import re
+import sqlite3
+import threading
+import urllib.parse
+
+from mcstats import jsonio
+from mcstats import store
+
+# request paths, which mirror the files written by the update
+rankingPath = re.compile(r'^/rankings/([A-Za-z0-9_]+)\.json$')
+playerDataPath = re.compile(r'^/playerdata/([0-9a-fA-F-]+)\.json$')
+playerCachePath = re.compile(r'^/playercache/([0-9a-fA-F-]+)\.json$')
+playerListPath = re.compile(r'^/playerlist/(all|active)([0-9]+)\.json$')
+
+# Read-only queries over the SQLite player database
+#
+# Serves rankings, player stats, player caches and paged player lists in the
+# form of the files written by the update, so they need not be written for
+# every player. Responses are kept in an LRU cache along with their ETags. The
+# cache is keyed by the generation of the database, so it is invalidated by any
+# update that changed something.
+#
+# The database is read through a single connection. Since it is in WAL mode,
+# reading does not block an update writing to it.
+class QueryService:
+    def __init__(self, database, cacheSize = 1024):
+        self.playerStore = store.PlayerStore(os.path.join(database, 'awards.sqlite'), readonly=True)
+        self.dbLock = threading.Lock()
+        self.cacheSize = cacheSize
+        self.cache = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.playerLists = dict() # generation -> players sorted by name
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        with self.dbLock:
+            self.playerStore.close()
+
+    # answer a request for a path
+    # returns the HTTP status, the response body and its ETag
+    def get(self, path):
+        try:
+            with self.dbLock:
+                generation = self.playerStore.generation()
+        except sqlite3.Error:
+            # reconnect with the next request, the database may not have been created yet
+            self.close()
+            return (503, b'{"error":"the player database is not available"}', None)
+
+        key = (generation, path)
+        with self.lock:
+            response = self.cache.get(key)
+            if response is not None:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return response
+
+        try:
+            with self.dbLock:
+                obj = self.query(path, generation)
+        except sqlite3.Error:
+            self.close()
+            return (503, b'{"error":"the player database is not available"}', None)
+
+        if obj is None:
+            return (404, b'{"error":"not found"}', None)
+
+        body = jsonio.dumps(obj)
+        response = (200, body, '"' + hashlib.sha1(body).hexdigest() + '"')
+
+        with self.lock:
+            self.misses += 1
+            self.cache[key] = response
+            while len(self.cache) > self.cacheSize:
+                self.cache.popitem(last=False)
+
+        return response
+
+    # query the object for a path, or None if there is none
+    def query(self, path, generation):
+        playerStore = self.playerStore
+
+        m = rankingPath.match(path)
+        if m:
+            if not m.group(1) in playerStore.getInfo().get('rankings', []):
+                return None
+
+            return [{'uuid': uuid, 'value': value} for uuid, value in playerStore.ranking(m.group(1))]
+
+        m = playerDataPath.match(path)
+        if m:
+            return playerStore.playerStats(m.group(1))
+
+        m = playerCachePath.match(path)
+        if m:
+            prefix = m.group(1)
+            cache = [{'uuid': uuid, 'name': name, 'skin': skin, 'last': last}
+                for uuid, name, skin, last in playerStore.playerList() if uuid.startswith(prefix)]
+
+            if len(cache) == 0 or len(prefix) != playerStore.getInfo().get('cacheQ', len(prefix)):
+                return None
+
+            return cache
+
+        m = playerListPath.match(path)
+        if m:
+            info = playerStore.getInfo()
+            playerlist = self.sortedPlayerList(generation)
+            if m.group(1) == 'active':
+                updateTime = info.get('updateTime', 0)
+                inactiveTime = info.get('inactiveTime', 0)
+                playerlist = [p for p in playerlist if updateTime - p['last'] <= inactiveTime]
+
+            playersPerPage = info.get('playersPerPage', 100)
+            page = int(m.group(2))
+            if page < 1 or (page - 1) * playersPerPage >= len(playerlist):
+                return None
+
+            return playerlist[(page - 1) * playersPerPage : page * playersPerPage]
+
+        return None
+
+    # get the list of all players sorted by name, like the player list files
+    def sortedPlayerList(self, generation):
+        with self.lock:
+            playerlist = self.playerLists.get(generation)
+
+        if playerlist is None:
+            playerlist = [{'uuid': uuid, 'name': name, 'skin': skin, 'last': last}
+                for uuid, name, skin, last in self.playerStore.playerList()]
+            playerlist.sort(key=lambda x: x['name'].lower())
+
+            with self.lock:
+                self.playerLists = {generation: playerlist}
+
+        return playerlist
+
+# HTTP request handler for a query service
+class QueryRequestHandler(http.server.BaseHTTPRequestHandler):
+    service = None
+
+    def do_GET(self):
+        path = urllib.parse.urlsplit(self.path).path
+        (status, body, etag) = self.service.get(path)
+
+        if etag is not None and etag_matches(self.headers.get('If-None-Match'), etag):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        if etag is not None:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+# test whether an If-None-Match header matches an ETag
+def etag_matches(header, etag):
+    if not header:
+        return False
+
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+
+        if tag == etag or tag == '*':
+            return True
+
+    return False
+
+# create an HTTP server for a query service
+def create_server(service, host, port):
+    handler = type('Handler', (QueryRequestHandler,), {'service': service})
+    server = http.server.ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
@@ -0,0 +1,174 @@
+import importlib
+import os
+import sys
+
+from mcstats import jsonio
+from mcstats import mcstats
+from mcstats import output
+
+# Snapshot of the stat registry
+#
+# Importing the stat modules, each of which builds its readers and compiles its
+# regular expressions, makes up much of the startup time of an update. The
+# snapshot describes all stats - names, metadata, readers with their match
+# patterns and version bounds - so the registry can be restored from a single
+# file. It is regenerated by importing the stat modules whenever one of them
+# changes. The snapshot is kept in the awards database, as the source tree may
+# not be writable.
+#
+# Stats that use classes of their own (like the Explorer award) cannot be
+# described by data. Their modules are still imported when loading a snapshot.
+
+snapshotVersion = 1
+
+baseDir = os.path.dirname(__file__)
+statsDir = os.path.join(baseDir, 'stats')
+
+# signature of the stat modules and the modules defining the stat classes
+def modules_signature():
+    files = []
+    with os.scandir(statsDir) as it:
+        for entry in it:
+            if entry.name.endswith('.py'):
+                st = entry.stat()
+                files.append([entry.name, st.st_mtime_ns, st.st_size])
+
+    for filename in ['mcstats.py', 'snapshot.py']:
+        st = os.stat(os.path.join(baseDir, filename))
+        files.append([filename, st.st_mtime_ns, st.st_size])
+
+    return sorted(files)
+
+# describe a reader, or return None if it is not one of the basic readers
+def serialize_reader(reader):
+    t = type(reader)
+    if t is mcstats.StatReader:
+        return ['read', reader.path, reader.default]
+    elif t is mcstats.StatSumMatchReader:
+        return ['match', reader.path, reader.patterns]
+    elif t is mcstats.StatSumReader:
+        summands = [serialize_reader(s) for s in reader.summands]
+        return None if None in summands else ['sum', summands]
+    elif t is mcstats.StatDiffReader:
+        a = serialize_reader(reader.a)
+        b = serialize_reader(reader.b)
+        return None if a is None or b is None else ['diff', a, b]
+    else:
+        return None
+
+# create a reader from its description
+def deserialize_reader(data):
+    kind = data[0]
+    if kind == 'read':
+        return mcstats.StatReader(data[1], data[2])
+    elif kind == 'match':
+        return mcstats.StatSumMatchReader(data[1], data[2])
+    elif kind == 'sum':
+        return mcstats.StatSumReader([deserialize_reader(s) for s in data[1]])
+    elif kind == 'diff':
+        return mcstats.StatDiffReader(deserialize_reader(data[1]), deserialize_reader(data[2]))
+    else:
+        raise ValueError('unknown reader kind: ' + str(kind))
+
+# describe a stat, or return None if it is not a basic stat
+def serialize_stat(mcstat):
+    if type(mcstat) is not mcstats.MinecraftStat or mcstat.aggregate is not mcstats.aggregateSum:
+        return None
+
+    reader = serialize_reader(mcstat.reader)
+    if reader is None:
+        return None
+
+    return {
+        'name':               mcstat.name,
+        'meta':               mcstat.meta,
+        'reader':             reader,
+        'minVersion':         mcstat.minVersion,
+        'maxVersion':         None if mcstat.maxVersion == float('inf') else mcstat.maxVersion,
+        'playerStatRelevant': mcstat.playerStatRelevant,
+    }
+
+# create a stat from its description
+def deserialize_stat(data):
+    maxVersion = data['maxVersion']
+    mcstat = mcstats.MinecraftStat(
+        data['name'],
+        data['meta'],
+        deserialize_reader(data['reader']),
+        data['minVersion'],
+        float('inf') if maxVersion is None else maxVersion)
+
+    mcstat.playerStatRelevant = data['playerStatRelevant']
+    return mcstat
+
+# import the stat modules one by one and describe the stats they add to the registry
+# returns the registry and its snapshot
+def generate():
+    from mcstats import stats
+
+    entries = []
+    for name in stats.__all__:
+        first = len(mcstats.registry)
+        importlib.import_module('mcstats.stats.' + name)
+        moduleStats = mcstats.registry[first:]
+
+        described = [serialize_stat(mcstat) for mcstat in moduleStats]
+        if None in described:
+            # the module needs to be imported when loading the snapshot
+            described = [{'name': mcstat.name, 'module': name} for mcstat in moduleStats]
+
+        entries.extend(described)
+
+    snapshot = {
+        'version':   snapshotVersion,
+        'signature': modules_signature(),
+        'stats':     entries,
+    }
+    return (mcstats.registry, snapshot)
+
+# restore the registry from a snapshot
+def restore(snapshot):
+    moduleStats = dict()
+    registry = []
+    for entry in snapshot['stats']:
+        if 'module' in entry:
+            name = 'mcstats.stats.' + entry['module']
+            if not name in sys.modules:
+                first = len(mcstats.registry)
+                importlib.import_module(name)
+                for mcstat in mcstats.registry[first:]:
+                    moduleStats[mcstat.name] = mcstat
+
+            registry.append(moduleStats[entry['name']])
+        else:
+            registry.append(deserialize_stat(entry))
+
+    mcstats.registry[:] = registry
+    return mcstats.registry
+
+# load the registry from the snapshot, or regenerate the snapshot if it is outdated
+# if no filename is given, the stat modules are imported without writing a snapshot
+# the registry is only loaded once, so this may be called any number of times
+def load_registry(filename = None):
+    if len(mcstats.registry) > 0:
+        return mcstats.registry
+
+    if filename is None:
+        return generate()[0]
+
+    signature = modules_signature()
+    try:
+        snapshot = jsonio.load(filename)
+        if snapshot.get('version') == snapshotVersion and snapshot.get('signature') == signature:
+            return restore(snapshot)
+    except (OSError, ValueError, KeyError):
+        pass
+
+    (registry, snapshot) = generate()
+    try:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        output.write_atomic(filename, jsonio.dumps(snapshot))
+    except OSError as e:
+        print('failed to write registry snapshot: ' + str(e))
+
+    return registry
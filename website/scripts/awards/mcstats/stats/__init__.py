@@ -1,3 +1,4 @@
-import os, pkgutil
+import os
 
-__all__ = list(module for _, module, _ in pkgutil.iter_modules([os.path.dirname(__file__)]))
+__all__ = sorted(filename[:-3] for filename in os.listdir(os.path.dirname(__file__))
+                 if filename.endswith('.py') and filename != '__init__.py')
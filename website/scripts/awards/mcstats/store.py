@@ -0,0 +1,193 @@
+import hashlib
+import os
+import sqlite3
+
+from mcstats import jsonio
+
+# Player database in SQLite
+#
+# An alternative to players.json as the record of the players of the previous
+# update, which also holds the stat values and ranks of every player. The
+# database is kept in WAL mode, so it can be read (e.g., by a query service)
+# while an update writes to it.
+#
+# Each player row carries the digest of the player's stats. During an update,
+# only players whose data or stats digest changed are written, so an update
+# amounts to a few row updates rather than rewriting the whole file. Players are
+# numbered in the order they were added, which is the order of players.json.
+#
+# Along with the players, some info on the update (e.g., its time) is stored, and
+# a generation number that is increased with every update that changed anything.
+class PlayerStore:
+    def __init__(self, filename, readonly = False):
+        self.filename = filename
+        self.readonly = readonly
+        self.db = None
+        self.dirty = False
+        self.players = dict() # UUID -> (name, skin, last, update, digest) as stored
+        self.seqs = dict()
+        self.nextSeq = 0
+
+    def connect(self):
+        if self.db is None and self.readonly:
+            self.db = sqlite3.connect('file:' + self.filename + '?mode=ro', uri=True, check_same_thread=False)
+        elif self.db is None:
+            self.db = sqlite3.connect(self.filename, check_same_thread=False)
+            self.db.execute('PRAGMA journal_mode = WAL')
+            self.db.execute('PRAGMA synchronous = NORMAL')
+            self.db.execute('''CREATE TABLE IF NOT EXISTS players (
+                uuid TEXT PRIMARY KEY,
+                seq INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                skin TEXT,
+                last INTEGER NOT NULL,
+                "update" INTEGER NOT NULL,
+                digest TEXT
+            ) WITHOUT ROWID''')
+            self.db.execute('''CREATE TABLE IF NOT EXISTS stats (
+                uuid TEXT NOT NULL,
+                stat TEXT NOT NULL,
+                value INTEGER NOT NULL,
+                rank INTEGER,
+                PRIMARY KEY (uuid, stat)
+            ) WITHOUT ROWID''')
+            self.db.execute('CREATE INDEX IF NOT EXISTS stats_rank ON stats (stat, rank) WHERE rank IS NOT NULL')
+            self.db.execute('''CREATE TABLE IF NOT EXISTS info (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            ) WITHOUT ROWID''')
+
+        return self.db
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def exists(self):
+        return os.path.isfile(self.filename)
+
+    # load the players of the previous update
+    # returns a dict of UUID -> player in the form of players.json, or None if the store is empty
+    def loadPlayers(self):
+        self.players = dict()
+        self.seqs = dict()
+        self.nextSeq = 0
+        if not self.exists():
+            return None
+
+        for row in self.connect().execute('SELECT uuid, seq, name, skin, last, "update", digest FROM players ORDER BY seq'):
+            self.players[row[0]] = row[2:]
+            self.seqs[row[0]] = row[1]
+            self.nextSeq = row[1] + 1
+
+        if len(self.players) == 0:
+            return None
+
+        players = dict()
+        for uuid, (name, skin, last, update, digest) in self.players.items():
+            players[uuid] = {
+                'name': name,
+                'skin': skin if skin is not None else False,
+                'last': last,
+                'update': update,
+            }
+
+        return players
+
+    # store a player, given in the form of players.json, along with the player's stats
+    # the stats are only written if their digest changed, if no stats are given, the stored ones are kept
+    # changes are written in a transaction that is finished by commit
+    def putPlayer(self, uuid, player, playerStats = None, digest = None):
+        previous = self.players.get(uuid)
+        if playerStats is None:
+            digest = previous[4] if previous else None
+
+        skin = player['skin'] if player['skin'] else None
+        row = (player['name'], skin, player['last'], player['update'], digest)
+        if previous == row:
+            return
+
+        seq = self.seqs.get(uuid)
+        if seq is None:
+            seq = self.nextSeq
+            self.seqs[uuid] = seq
+            self.nextSeq += 1
+
+        db = self.connect()
+        db.execute('INSERT OR REPLACE INTO players VALUES (?, ?, ?, ?, ?, ?, ?)', (uuid, seq) + row)
+        if playerStats is not None and (previous is None or previous[4] != digest):
+            db.execute('DELETE FROM stats WHERE uuid = ?', (uuid,))
+            db.executemany('INSERT INTO stats VALUES (?, ?, ?, ?)',
+                [(uuid, name, entry['value'], entry.get('rank')) for name, entry in playerStats.items()])
+
+        self.players[uuid] = row
+        self.dirty = True
+
+    # finish writing the results of an update
+    # players other than the given ones are removed, and the given info is stored
+    def commit(self, uuids, info = None):
+        db = self.connect()
+        removed = [(uuid,) for uuid in self.players if not uuid in uuids]
+        db.executemany('DELETE FROM players WHERE uuid = ?', removed)
+        db.executemany('DELETE FROM stats WHERE uuid = ?', removed)
+
+        previous = self.getInfo()
+        info = {key: value for key, value in (info or {}).items() if previous.get(key) != value}
+        if removed or info or self.dirty:
+            info['generation'] = previous.get('generation', 0) + 1
+            db.executemany('INSERT OR REPLACE INTO info VALUES (?, ?)',
+                [(key, jsonio.dumps(value).decode()) for key, value in info.items()])
+
+        db.commit()
+        self.dirty = False
+
+        for (uuid,) in removed:
+            del self.players[uuid]
+            del self.seqs[uuid]
+
+    # discard the results of an update
+    def rollback(self):
+        if self.db is not None and self.db.in_transaction:
+            self.db.rollback()
+            self.loadPlayers()
+
+        self.dirty = False
+
+    # get the stored info
+    def getInfo(self):
+        return {key: jsonio.loads(value) for key, value in self.connect().execute('SELECT key, value FROM info')}
+
+    # get the generation of the data, which changes with every update that changed anything
+    def generation(self):
+        row = self.connect().execute("SELECT value FROM info WHERE key = 'generation'").fetchone()
+        return jsonio.loads(row[0]) if row else 0
+
+    # get all players as a list of (uuid, name, skin, last) tuples in the order they were added
+    def playerList(self):
+        return [(uuid, name, skin if skin is not None else False, last) for uuid, name, skin, last in
+            self.connect().execute('SELECT uuid, name, skin, last FROM players ORDER BY seq')]
+
+    # get the stats of a player in the form of the player data files, or None if the player is unknown
+    def playerStats(self, uuid):
+        rows = self.connect().execute('SELECT stat, value, rank FROM stats WHERE uuid = ?', (uuid,)).fetchall()
+        if len(rows) == 0:
+            return None
+
+        playerStats = dict()
+        for name, value, rank in rows:
+            entry = {'value': value}
+            if rank is not None:
+                entry['rank'] = rank
+            playerStats[name] = entry
+
+        return playerStats
+
+    # get the ranking of a stat as a list of (uuid, value) pairs
+    def ranking(self, stat):
+        return self.connect().execute(
+            'SELECT uuid, value FROM stats WHERE stat = ? AND rank IS NOT NULL ORDER BY rank', (stat,)).fetchall()
+
+# digest of a player's stats as serialized for the player data file
+def stats_digest(data):
+    return hashlib.sha1(data).hexdigest()
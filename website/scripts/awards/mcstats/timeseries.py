@@ -0,0 +1,323 @@
+import collections
+import datetime
+import glob
+import gzip
+import os
+import sqlite3
+import zlib
+
+from mcstats import jsonio
+from mcstats import output
+
+secondsPerDay = 86400
+
+# number of chunks kept in memory by the reader
+chunkCacheSize = 64
+
+chunkSuffix = '.jsonl.gz'
+chunkDateFormat = '%Y-%m-%d'
+
+# get the start of the (UTC) day a point in time falls into
+def day_start(t):
+    return int(t - t % secondsPerDay)
+
+# get the name of the chunk of the day a point in time falls into
+def chunk_name(t):
+    return datetime.datetime.fromtimestamp(day_start(t), datetime.timezone.utc).strftime(chunkDateFormat)
+
+# get the start time of the day of a chunk
+def chunk_time(name):
+    return int(datetime.datetime.strptime(name, chunkDateFormat).replace(tzinfo=datetime.timezone.utc).timestamp())
+
+# encode records as a gzip member holding one JSON line per record
+def encode_records(records):
+    return gzip.compress(b''.join(jsonio.dumps(record) + b'\n' for record in records), mtime=0)
+
+# read the records of a chunk, which is a sequence of gzip members
+# returns the records and whether the chunk ends in a member that was not written completely
+def read_chunk(filename):
+    with open(filename, 'rb') as f:
+        data = f.read()
+
+    records = []
+    while data:
+        decompressor = zlib.decompressobj(wbits=31)
+        try:
+            lines = decompressor.decompress(data)
+            if not decompressor.eof:
+                return (records, True)
+
+            member = [jsonio.loads(line) for line in lines.splitlines() if line]
+        except (zlib.error, ValueError):
+            return (records, True)
+
+        records += member
+        data = decompressor.unused_data
+
+    return (records, False)
+
+# add the deltas of a record to totals (stat -> UUID -> value)
+def add_deltas(totals, deltas):
+    for name, players in deltas.items():
+        if not name in totals:
+            totals[name] = dict()
+
+        statTotals = totals[name]
+        for uuid, delta in players.items():
+            statTotals[uuid] = statTotals.get(uuid, 0) + delta
+
+# Time series of the stats of all players
+#
+# With every update, the changes of players' stat values since the previous
+# update are appended to the chunk of the current day as a record of the form
+# {'time': t, 'deltas': {stat: {uuid: delta}}}. Chunks are append-only files of
+# gzip members, one per update, so an update compresses and appends only its
+# own record. Summing up the deltas of any time range yields the progress of
+# all players in that range, e.g., for weekly leaders or growth charts.
+#
+# The current values of all players are kept in an SQLite state to compute the
+# deltas. Along with the values, the state holds the signature of every player's
+# data files from the activity index, and players whose files did not change are
+# not compared. When the time series is first recorded, the current values only
+# become the state, so the first record does not hold the players' entire history.
+#
+# Chunks of days that ended more than downsampleDays ago are merged into a
+# single record at the start of their day. Chunks older than retentionDays are
+# deleted, unless retentionDays is zero.
+class StatTimeSeries:
+    def __init__(self, path, registry = None, downsampleDays = 7, retentionDays = 0):
+        self.path = path
+        self.stateFilename = os.path.join(path, 'state.sqlite')
+        self.stats = [mcstat.name for mcstat in registry] if registry else []
+        self.downsampleDays = downsampleDays
+        self.retentionDays = retentionDays
+        self.players = None # UUID -> (signature, values)
+        self.info = dict()
+        self.pending = dict()
+        self.chunkCache = collections.OrderedDict()
+
+    def connect(self):
+        db = sqlite3.connect(self.stateFilename)
+        db.execute('PRAGMA synchronous = NORMAL')
+        db.execute('''CREATE TABLE IF NOT EXISTS players (
+            uuid TEXT PRIMARY KEY,
+            files TEXT,
+            stats TEXT NOT NULL
+        ) WITHOUT ROWID''')
+        db.execute('''CREATE TABLE IF NOT EXISTS info (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        ) WITHOUT ROWID''')
+        return db
+
+    def chunkFilename(self, name):
+        return os.path.join(self.path, name + chunkSuffix)
+
+    # get the names of all chunks in chronological order
+    def chunkNames(self):
+        return sorted(os.path.basename(filename)[:-len(chunkSuffix)]
+            for filename in glob.glob(os.path.join(glob.escape(self.path), '*' + chunkSuffix)))
+
+    # load the state of the previous update
+    def load(self):
+        self.players = dict()
+        self.info = dict()
+        self.pending = dict()
+
+        if os.path.isfile(self.stateFilename):
+            try:
+                db = self.connect()
+                try:
+                    for uuid, files, stats in db.execute('SELECT uuid, files, stats FROM players'):
+                        self.players[uuid] = (files, jsonio.loads(stats))
+
+                    for key, value in db.execute('SELECT key, value FROM info'):
+                        self.info[key] = jsonio.loads(value)
+                finally:
+                    db.close()
+            except sqlite3.Error as e:
+                print('discarding unreadable time series state ' + self.stateFilename + ': ' + str(e))
+                self.players = dict()
+                self.info = dict()
+
+        # repair the latest chunk and catch up with the records appended by an update that failed to store its state
+        names = self.chunkNames()
+        if names:
+            filename = self.chunkFilename(names[-1])
+            (records, damaged) = read_chunk(filename)
+            if damaged:
+                print('discarding incomplete record in time series chunk ' + filename)
+                output.write_atomic(filename, encode_records(records))
+
+            changed = dict()
+            for record in records:
+                if record['time'] > self.info.get('time', record['time']):
+                    for name, players in record['deltas'].items():
+                        for uuid, delta in players.items():
+                            values = dict(changed.get(uuid, self.players.get(uuid, (None, {})))[1])
+                            values[name] = values.get(name, 0) + delta
+                            changed[uuid] = (None, values)
+
+                    self.info['time'] = record['time']
+
+            if changed:
+                self.players.update(changed)
+                self.save(changed)
+
+    # record the stat values (name -> {'value': value}) of a player in the current update
+    # the signature is that of the player's data files in the activity index
+    def record(self, uuid, signature, playerStats):
+        previous = self.players.get(uuid)
+        if previous and signature is not None and previous[0] == signature:
+            return # the player's data files did not change
+
+        self.pending[uuid] = (signature, {name: playerStats[name]['value'] for name in self.stats if name in playerStats})
+
+    # append the changes recorded in the current update to the time series
+    # returns the number of deltas appended
+    def commit(self, now):
+        # the values of the first update are only recorded in the state
+        first = not 'time' in self.info
+
+        deltas = dict()
+        numDeltas = 0
+        for uuid, (signature, values) in ([] if first else self.pending.items()):
+            previousValues = self.players.get(uuid, (None, {}))[1]
+            for name in self.stats:
+                delta = values.get(name, 0) - previousValues.get(name, 0)
+                if delta != 0:
+                    if not name in deltas:
+                        deltas[name] = dict()
+
+                    deltas[name][uuid] = delta
+                    numDeltas += 1
+
+        if deltas:
+            # order the stats like the registry
+            deltas = {name: deltas[name] for name in self.stats if name in deltas}
+            with open(self.chunkFilename(chunk_name(now)), 'ab') as f:
+                f.write(encode_records([{'time': now, 'deltas': deltas}]))
+
+        changed = self.pending
+        self.pending = dict()
+        self.players.update(changed)
+        self.info['time'] = now
+        self.save(changed)
+
+        self.applyPolicy(now)
+        return numDeltas
+
+    # discard the values recorded in the current update
+    def discard(self):
+        self.pending = dict()
+
+    # write the changed players and the info to the state
+    def save(self, changed):
+        db = self.connect()
+        try:
+            with db:
+                db.executemany('INSERT OR REPLACE INTO players VALUES (?, ?, ?)',
+                    [(uuid, files, jsonio.dumps(values).decode()) for uuid, (files, values) in changed.items()])
+                db.executemany('INSERT OR REPLACE INTO info VALUES (?, ?)',
+                    [(key, jsonio.dumps(value).decode()) for key, value in self.info.items()])
+        finally:
+            db.close()
+
+    # downsample and delete old chunks
+    def applyPolicy(self, now):
+        today = day_start(now)
+        downsampleBefore = today - self.downsampleDays * secondsPerDay
+        downsampled = self.info.get('downsampled', 0)
+
+        for name in self.chunkNames():
+            t = chunk_time(name)
+            filename = self.chunkFilename(name)
+            if self.retentionDays > 0 and t < today - self.retentionDays * secondsPerDay:
+                os.unlink(filename)
+            elif t + secondsPerDay <= downsampleBefore and t > downsampled:
+                (records, damaged) = read_chunk(filename)
+                if len(records) > 1 or damaged:
+                    totals = dict()
+                    for record in records:
+                        add_deltas(totals, record['deltas'])
+
+                    output.write_atomic(filename, encode_records([{'time': t, 'deltas': totals}]))
+
+                self.info['downsampled'] = t
+
+        if self.info.get('downsampled', 0) != downsampled:
+            self.save({})
+
+    # read the records of a chunk along with their totals, using the cache of recently read chunks
+    def readChunk(self, name):
+        filename = self.chunkFilename(name)
+        try:
+            st = os.stat(filename)
+        except FileNotFoundError:
+            return ([], {})
+
+        signature = (st.st_size, st.st_mtime_ns)
+        entry = self.chunkCache.get(name)
+        if entry is None or entry[0] != signature:
+            (records, damaged) = read_chunk(filename)
+            totals = dict()
+            for record in records:
+                add_deltas(totals, record['deltas'])
+
+            entry = (signature, records, totals)
+            self.chunkCache[name] = entry
+            while len(self.chunkCache) > chunkCacheSize:
+                self.chunkCache.popitem(last=False)
+
+        self.chunkCache.move_to_end(name)
+        return entry[1:]
+
+    # iterate the records in a time range [start, end)
+    def records(self, start, end):
+        for name in self.chunkNames():
+            t = chunk_time(name)
+            if t + secondsPerDay <= start or t >= end:
+                continue
+
+            (records, totals) = self.readChunk(name)
+            for record in records:
+                if start <= record['time'] < end:
+                    yield record
+
+    # get the total changes of a stat in a time range [start, end) as a dict of UUID -> value
+    def totals(self, stat, start, end):
+        result = dict()
+        for name in self.chunkNames():
+            t = chunk_time(name)
+            if t + secondsPerDay <= start or t >= end:
+                continue
+
+            (records, totals) = self.readChunk(name)
+            if start <= t and t + secondsPerDay <= end:
+                # the whole day is in range
+                add_deltas(result, {stat: totals.get(stat, {})})
+            else:
+                for record in records:
+                    if start <= record['time'] < end:
+                        add_deltas(result, {stat: record['deltas'].get(stat, {})})
+
+        return result.get(stat, {})
+
+    # get the players with the greatest changes of a stat in a time range [start, end)
+    # returns a list of (uuid, value) pairs ordered like rankings
+    def leaders(self, stat, start, end, n = 10):
+        totals = [(uuid, value) for uuid, value in self.totals(stat, start, end).items() if value > 0]
+        totals.sort(key=lambda e: (e[1], e[0]), reverse=True)
+        return totals[:n]
+
+    # get the changes of a player's stat in a time range [start, end), summed up in intervals
+    # returns a list of (interval start, value) pairs for the intervals with changes
+    def series(self, stat, uuid, start, end, interval = secondsPerDay):
+        buckets = dict()
+        for record in self.records(start, end):
+            delta = record['deltas'].get(stat, {}).get(uuid, 0)
+            if delta != 0:
+                t = record['time'] - (record['time'] - start) % interval
+                buckets[t] = buckets.get(t, 0) + delta
+
+        return sorted(buckets.items())
@@ -0,0 +1,139 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+# inotify event masks (see inotify(7))
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM  = 0x00000040
+IN_MOVED_TO    = 0x00000080
+IN_DELETE      = 0x00000200
+IN_Q_OVERFLOW  = 0x00004000
+IN_NONBLOCK    = 0o4000
+IN_CLOEXEC     = 0o2000000
+
+# header of an inotify event: watch descriptor, mask, cookie and name length
+inotifyEventHeader = struct.Struct('iIII')
+
+# get the player UUID for a data file name, or None if it is not a player data file
+def player_uuid(filename):
+    if filename.endswith('.json') and not filename.startswith('.'):
+        return filename[:-5] # cut off '.json' extension
+    else:
+        return None
+
+# Watcher for player data files based on inotify (Linux only)
+#
+# Minecraft rewrites stats and advancements files whenever it saves a player,
+# so a file that was closed after writing, moved into place or deleted marks
+# the player as changed.
+class InotifyWatcher:
+    def __init__(self, dirs):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE
+        self.wds = dict()
+        for d in dirs:
+            if not os.path.isdir(d):
+                continue
+
+            wd = libc.inotify_add_watch(self.fd, os.fsencode(d), mask)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                os.close(self.fd)
+                raise OSError(errno, 'inotify_add_watch failed for ' + d)
+
+            self.wds[wd] = d
+
+    def close(self):
+        os.close(self.fd)
+
+    # wait for changes
+    # returns the UUIDs of the changed players, or None if events were lost and everything must be rescanned
+    def wait(self, timeout):
+        changed = set()
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        while readable:
+            try:
+                buf = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+
+            offset = 0
+            while offset < len(buf):
+                (wd, mask, cookie, length) = inotifyEventHeader.unpack_from(buf, offset)
+                offset += inotifyEventHeader.size
+                name = buf[offset:offset + length].rstrip(b'\0').decode(errors='replace')
+                offset += length
+
+                if mask & IN_Q_OVERFLOW:
+                    return None
+
+                uuid = player_uuid(name)
+                if uuid:
+                    changed.add(uuid)
+
+            readable, _, _ = select.select([self.fd], [], [], 0)
+
+        return changed
+
+# Watcher for player data files that periodically compares the modification
+# times and sizes of all files
+class PollingWatcher:
+    def __init__(self, dirs, interval = 10):
+        self.dirs = dirs
+        self.interval = interval
+        self.signatures = self.scan()
+        self.lastScan = time.monotonic()
+
+    def close(self):
+        pass
+
+    # get the signatures of all player data files
+    def scan(self):
+        signatures = dict()
+        for d in self.dirs:
+            try:
+                with os.scandir(d) as it:
+                    for entry in it:
+                        if player_uuid(entry.name):
+                            st = entry.stat()
+                            signatures[(d, entry.name)] = (st.st_mtime_ns, st.st_size)
+            except FileNotFoundError:
+                pass
+
+        return signatures
+
+    # wait for changes
+    # returns the UUIDs of the changed players
+    def wait(self, timeout):
+        delay = max(0, self.lastScan + self.interval - time.monotonic())
+        if delay > timeout:
+            time.sleep(timeout)
+            return set()
+
+        time.sleep(delay)
+        signatures = self.scan()
+        self.lastScan = time.monotonic()
+
+        changed = set()
+        for key in signatures.keys() | self.signatures.keys():
+            if signatures.get(key) != self.signatures.get(key):
+                changed.add(player_uuid(key[1]))
+
+        self.signatures = signatures
+        return changed
+
+# create a watcher for the given directories
+# inotify is used if available, otherwise the directories are polled in the given interval
+def create_watcher(dirs, pollInterval = 10):
+    try:
+        return InotifyWatcher(dirs)
+    except (OSError, AttributeError, TypeError) as e:
+        print('inotify is not available (' + str(e) + '), polling for changes every ' + str(pollInterval) + ' seconds')
+        return PollingWatcher(dirs, pollInterval)
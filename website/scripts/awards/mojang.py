@@ -1,40 +1,232 @@
 import base64
-import json
-import urllib.request
+import concurrent.futures
+import http.client
+import os
+import threading
+import time
+import urllib.parse
 
-profile_api_url = 'https://sessionserver.mojang.com/session/minecraft/profile/'
-
-# get player profile via Mojang's API
-# the returned object is the first property ("textures") decoded
-# may raise an error on failure
-def get_player_profile(uuid):
-    compact_uuid = uuid.replace('-', '')
-
-    response_str = None
+from mcstats import jsonio
+from mcstats import output
 
-    with urllib.request.urlopen(profile_api_url + compact_uuid) as response:
-        response_str = response.read().decode()
+profile_api_url = 'https://sessionserver.mojang.com/session/minecraft/profile/'
 
+# parse a response of the profile API
+# returns the player name and skin, or None if the response contains no profile
+def parse_player_profile(response_str, url):
     if response_str:
-        response = json.loads(response_str)
-        
+        response = jsonio.loads(response_str)
+
         if 'name' in response:
             # get player name
             profile = { 'name': response['name'] }
 
             # get player skin URL
             try:
-                dec = json.loads(base64.b64decode(response['properties'][0]['value']).decode())
+                dec = jsonio.loads(base64.b64decode(response['properties'][0]['value']))
                 profile['skin'] = dec['textures']['SKIN']['url'][38:] # remove URL prefix: http://textures.minecraft.net/texture/
             except:
                 profile['skin'] = False
 
             return profile
         else:
-            print('unexpected Mojang API response for ' + profile_api_url + compact_uuid + ':')
+            print('unexpected Mojang API response for ' + url + ':')
             print(response)
     else:
-        print('empty Mojang API response for ' + profile_api_url + compact_uuid)
-    
+        print('empty Mojang API response for ' + url)
+
     # failed
-    return None
\ No newline at end of file
+    return None
+
+# Token bucket limiting the rate of requests across threads
+class TokenBucket:
+    def __init__(self, rate, capacity = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.time = time.monotonic()
+        self.blocked_until = 0
+        self.lock = threading.Lock()
+
+    # wait until a request may be made
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if self.rate > 0:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.time) * self.rate)
+                else:
+                    self.tokens = self.capacity # unlimited
+
+                self.time = now
+
+                if now >= self.blocked_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = self.blocked_until - now
+                if self.rate > 0:
+                    wait = max(wait, (1 - self.tokens) / self.rate)
+
+            time.sleep(wait)
+
+    # block all requests for the given number of seconds
+    def block(self, seconds):
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+# On-disk cache of fetched profiles keyed by UUID
+class ProfileCache:
+    def __init__(self, filename, ttl):
+        self.filename = filename
+        self.ttl = ttl
+        self.entries = dict()
+        self.lock = threading.Lock()
+
+    def load(self):
+        if os.path.isfile(self.filename):
+            try:
+                self.entries = jsonio.load(self.filename)
+            except Exception as e:
+                print('discarding unreadable profile cache ' + self.filename + ': ' + str(e))
+
+    # get the cached entry for a UUID if it has not yet expired
+    # the entry holds the time it was fetched and the profile (None if there is none)
+    def get(self, uuid, now):
+        entry = self.entries.get(uuid)
+        if entry and now - entry['time'] <= self.ttl:
+            return entry
+        else:
+            return None
+
+    def put(self, uuid, profile, now):
+        with self.lock:
+            self.entries[uuid] = {'time': now, 'profile': profile}
+
+    # write the cache, dropping expired entries
+    def save(self, now):
+        with self.lock:
+            entries = {uuid: e for uuid, e in self.entries.items() if now - e['time'] <= self.ttl}
+            output.write_atomic(self.filename, jsonio.dumps(entries))
+
+# Error for failed profile requests
+class ProfileError(Exception):
+    pass
+
+# Concurrent, rate-limited profile fetcher
+#
+# Each worker thread keeps its own keep-alive connection to the session server.
+# Requests are limited by a token bucket shared between the threads. When the
+# server responds with 429 (too many requests), all threads back off.
+class ProfileFetcher:
+    def __init__(self, concurrency = 4, rate = 1, timeout = 10, retries = 3, cache = None, url = profile_api_url):
+        self.concurrency = max(1, concurrency)
+        self.bucket = TokenBucket(rate, max(1, min(concurrency, rate)))
+        self.timeout = timeout
+        self.retries = retries
+        self.cache = cache
+        self.url = urllib.parse.urlsplit(url)
+        self.local = threading.local()
+        self.numFetched = 0
+        self.numCached = 0
+
+    # get the keep-alive connection of the current thread
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            if self.url.scheme == 'https':
+                conn = http.client.HTTPSConnection(self.url.netloc, timeout=self.timeout)
+            else:
+                conn = http.client.HTTPConnection(self.url.netloc, timeout=self.timeout)
+
+            self.local.conn = conn
+
+        return conn
+
+    def close_connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
+
+    # do a single request, returns the status, the Retry-After header and the body
+    def request(self, path):
+        conn = self.connection()
+        conn.request('GET', path, headers={'Connection': 'keep-alive'})
+        response = conn.getresponse()
+        body = response.read()
+
+        if response.will_close:
+            self.close_connection()
+
+        return (response.status, response.getheader('Retry-After'), body)
+
+    # fetch the profile of a player
+    # returns None if the API has no profile for the UUID, raises ProfileError on failure
+    def fetch(self, uuid):
+        compact_uuid = uuid.replace('-', '')
+        path = self.url.path + compact_uuid
+        url = urllib.parse.urlunsplit(self.url) + compact_uuid
+
+        for attempt in range(self.retries + 1):
+            self.bucket.acquire()
+            try:
+                (status, retryAfter, body) = self.request(path)
+            except (http.client.HTTPException, OSError) as e:
+                # the connection may have been closed by the server, the next attempt uses a new one
+                self.close_connection()
+                if attempt < self.retries:
+                    continue
+                raise ProfileError('request to ' + url + ' failed: ' + str(e))
+
+            if status == 429:
+                # too many requests - back off
+                try:
+                    delay = float(retryAfter)
+                except (TypeError, ValueError):
+                    delay = 2 ** attempt
+
+                self.bucket.block(delay)
+                continue
+            elif status == 200 or status == 204:
+                return parse_player_profile(body.decode(), url)
+            else:
+                raise ProfileError('HTTP status ' + str(status) + ' for ' + url)
+
+        raise ProfileError('rate limited by ' + url)
+
+    # fetch the profiles for a batch of UUIDs
+    # returns the fetched profiles (None if there is none) and the errors for failed UUIDs
+    def fetch_all(self, uuids, now):
+        profiles = dict()
+        errors = dict()
+
+        pending = []
+        for uuid in uuids:
+            entry = self.cache.get(uuid, now) if self.cache else None
+            if entry:
+                profiles[uuid] = entry['profile']
+                self.numCached += 1
+            else:
+                pending.append(uuid)
+
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+                futures = {pool.submit(self.fetch, uuid): uuid for uuid in pending}
+                for future in concurrent.futures.as_completed(futures):
+                    uuid = futures[future]
+                    try:
+                        profiles[uuid] = future.result()
+                    except Exception as e:
+                        errors[uuid] = e
+                        continue
+
+                    self.numFetched += 1
+                    if self.cache:
+                        self.cache.put(uuid, profiles[uuid], now)
+        finally:
+            if self.cache:
+                self.cache.save(now)
+
+        return (profiles, errors)
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+import argparse
+import datetime
+import signal
+import sys
+
+from mcstats import engine
+from mcstats import query
+from mcstats.util import handle_error
+
+# stop gracefully when terminated
+def terminate(signum, frame):
+    sys.exit(0)
+
+# run the service
+def main():
+    # Parse command-line arguments
+    parser = argparse.ArgumentParser(description='Serve rankings, player stats and player lists from the MinecraftStats player database')
+    parser.add_argument('config', type=str, help='the configuration to use')
+    parser.add_argument('--host', type=str, default='127.0.0.1',
+                        help='address to listen on (default 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8081,
+                        help='port to listen on (default 8081)')
+    parser.add_argument('--cache-size', type=int, default=1024,
+                        help='number of responses kept in memory (default 1024)')
+
+    args = parser.parse_args()
+
+    signal.signal(signal.SIGTERM, terminate)
+
+    try:
+        config = engine.load_config(args.config)
+        service = query.QueryService(config.database, args.cache_size)
+        server = query.create_server(service, args.host, args.port)
+        try:
+            print(datetime.datetime.now().strftime("%H:%M:%S"), '', 'serving ' + config.database + ' on ' + args.host + ':' + str(args.port), flush=True)
+            server.serve_forever()
+        finally:
+            server.server_close()
+            service.close()
+    except engine.UpdateError as e:
+        handle_error('ERROR: ' + str(e), True)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
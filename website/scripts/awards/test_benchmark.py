@@ -0,0 +1,78 @@
+import gzip
+import json
+import os
+import pstats
+
+import pytest
+
+import benchmark
+
+# the benchmark size can be raised and a time budget set to catch regressions before deploying
+NUM_PLAYERS = int(os.environ.get("AWARDS_BENCHMARK_PLAYERS", "60"))
+MAX_SECONDS = float(os.environ.get("AWARDS_BENCHMARK_MAX_SECONDS", "0"))
+
+
+def test_generate_server(tmp_path):
+    server = benchmark.generate_server(str(tmp_path), 5, density=0.3)
+
+    stats = sorted(os.listdir(os.path.join(server, "world", "stats")))
+    assert len(stats) == 5
+    with open(os.path.join(server, "world", "stats", stats[0])) as f:
+        data = json.load(f)
+    assert data["DataVersion"] == benchmark.data_version
+    assert "minecraft:play_time" in data["stats"]["minecraft:custom"]
+
+    with open(os.path.join(server, "usercache.json")) as f:
+        assert sorted(e["uuid"] + ".json" for e in json.load(f)) == stats
+
+    assert os.path.isfile(os.path.join(server, "server.properties"))
+
+
+@pytest.mark.parametrize(
+    "update_args", [[], ["--incremental", "--jobs", "2"], ["--engine", "columnar"], ["--engine", "lowmem", "--jobs", "2"]]
+)
+def test_update_benchmark(tmp_path, update_args):
+    if "columnar" in update_args:
+        pytest.importorskip("numpy")
+
+    root = str(tmp_path)
+    results = benchmark.run_benchmark(root, NUM_PLAYERS, runs=2, update_args=update_args)
+    benchmark.print_results(results)
+
+    assert len(results) == 2
+    for metrics in results:
+        assert set(metrics["phases"]) == set(benchmark.phases)
+        assert metrics["peakRss"] > 0
+        assert metrics["counters"]["filesWritten"] + metrics["counters"]["filesSkipped"] > 0
+        if MAX_SECONDS > 0:
+            assert metrics["total"]["wall"] <= MAX_SECONDS
+
+    # the first update reads and writes everything, profiles are fetched from the stub
+    first, second = results
+    assert first["counters"]["filesRead"] >= NUM_PLAYERS
+    assert first["counters"]["bytesRead"] > 0
+    assert first["counters"]["profilesFetched"] > 0
+    assert first["counters"]["filesSkipped"] == 0
+
+    # the second update finds the profiles up to date and skips unchanged files
+    assert second["counters"]["profilesFetched"] == 0
+    assert second["counters"]["filesSkipped"] > 0
+
+    with open(os.path.join(root, "data", "players.json")) as f:
+        players = json.load(f)
+    assert len(players) > 0
+    assert all(p["name"].startswith("Player_") for p in players.values())
+
+    with gzip.open(os.path.join(root, "data", "summary.json.gz")) as f:
+        summary = json.load(f)
+    assert summary["info"]["numPlayers"] == len(players)
+    assert len(summary["awards"]) > 0
+
+
+def test_update_profile(tmp_path):
+    root = str(tmp_path)
+    profileFile = os.path.join(root, "update.prof")
+    benchmark.run_benchmark(root, 10, update_args=["--profile", profileFile])
+
+    stats = pstats.Stats(profileFile)
+    assert stats.total_calls > 0
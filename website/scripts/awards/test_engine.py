@@ -0,0 +1,421 @@
+import datetime
+import gzip
+import json
+import os
+
+import benchmark
+from mcstats import engine
+from mcstats import output
+from mcstats import playersearch
+from mcstats import timeseries
+
+
+def timestamp(s):
+    return int(datetime.datetime.strptime(s, engine.eventTimeFormat).timestamp())
+
+
+def read_json(filename):
+    opener = gzip.open if filename.endswith(".gz") else open
+    with opener(filename, "rt") as f:
+        return json.load(f)
+
+
+def test_engine_updates_with_clock(tmp_path, make_config):
+    root = str(tmp_path)
+    times = [timestamp("2029-12-31 12:00"), timestamp("2030-01-15 12:00"), timestamp("2030-01-15 12:30"), timestamp("2030-01-16 12:00")]
+    server = benchmark.generate_server(root, 30, now=times[0])
+
+    events = [
+        {
+            "name": "endermites",
+            "title": "Endermite Hunt",
+            "stat": "kill_endermite",
+            "startTime": "2030-01-01 00:00",
+            "endTime": "2030-02-01 00:00",
+        }
+    ]
+    config = make_config(root, server, players={"inactiveDays": 36500}, events=events)
+
+    clock = iter(times)
+    updater = engine.Engine(config, clock=lambda: next(clock))
+    try:
+        # before the event
+        updater.update()
+        database = os.path.join(root, "data")
+        summary = read_json(os.path.join(database, "summary.json.gz"))
+        assert summary["info"]["updateTime"] == times[0]
+        assert summary["events"] == {}
+        ranking = read_json(os.path.join(database, "rankings", "play.json"))
+        assert len(ranking) > 0
+
+        # a player kills endermites during the event
+        uuid = ranking[0]["uuid"]
+        statsFile = os.path.join(server, "world", "stats", uuid + ".json")
+        stats = read_json(statsFile)
+        killed = stats["stats"]["minecraft:killed"]
+        killed["minecraft:endermite"] = killed.get("minecraft:endermite", 0) + 1000
+        with open(statsFile, "w") as f:
+            json.dump(stats, f)
+
+        updater.update()
+        summary = read_json(os.path.join(database, "summary.json.gz"))
+        assert summary["info"]["updateTime"] == times[1]
+        assert summary["events"]["endermites"]["active"]
+        assert summary["events"]["endermites"]["best"] == {"uuid": uuid, "value": 1000}
+
+        # rankings start over with each update
+        assert read_json(os.path.join(database, "rankings", "play.json")) == ranking
+
+        # players appear in the event ranking only once
+        updater.update()
+        event = read_json(os.path.join(database, "events", "endermites.json"))
+        assert event["ranking"] == [{"uuid": uuid, "value": 1000}]
+        assert "initialRanking" not in event
+
+        # progress is appended to the event history in hourly buckets
+        killed["minecraft:endermite"] += 500
+        with open(statsFile, "w") as f:
+            json.dump(stats, f)
+
+        updater.update()
+        event = read_json(os.path.join(database, "events", "endermites.json"))
+        assert event["ranking"] == [{"uuid": uuid, "value": 1500}]
+
+        history = updater.eventHistories["endermites"]
+        history.load()
+        assert history.progress(uuid) == [(timestamp("2030-01-15 12:00"), 1000), (timestamp("2030-01-16 12:00"), 1500)]
+        assert history.rankingAt(times[2]) == {uuid: 1000}
+        assert len(history.initial) > 0
+    finally:
+        updater.close()
+
+
+def test_engine_merges_sources(tmp_path, make_config):
+    root = str(tmp_path)
+    now = timestamp("2030-01-15 12:00")
+    servers = [benchmark.generate_server(os.path.join(root, name), 20, seed=3, now=now) for name in ["a", "b"]]
+
+    # the second world has the same players, but one lacks advancements
+    advancementsDir = os.path.join(servers[1], "world", "advancements")
+    removed = sorted(os.listdir(advancementsDir))[0]
+    os.remove(os.path.join(advancementsDir, removed))
+
+    events = [
+        {
+            "name": "playtime",
+            "title": "Play Time Event",
+            "stat": "play",
+            "startTime": "2030-01-01 00:00",
+            "endTime": "2030-02-01 00:00",
+        }
+    ]
+    single = engine.Engine(make_config(root, servers[0], players={"minPlaytime": 0}, events=events), clock=lambda: now)
+    try:
+        scan = single.scanSources()
+        assert len(scan) == 1
+        (statsFiles, advancementFiles) = scan[0]
+        assert len(statsFiles) == 20
+        uuid = sorted(statsFiles)[0]
+        assert single.getFileSignature(uuid, scan) == single.getFileSignature(uuid)
+
+        single.update()
+        singleRanking = read_json(os.path.join(root, "data", "rankings", "play.json"))
+        singleEvent = read_json(os.path.join(root, "data", "events", "playtime.json"))
+    finally:
+        single.close()
+
+    config = make_config(
+        root,
+        servers[0],
+        database=os.path.join(root, "merged"),
+        server={"sources": [{"path": server, "worldName": "world"} for server in servers]},
+        players={"minPlaytime": 0},
+        events=events,
+    )
+    merged = engine.Engine(config, clock=lambda: now)
+    try:
+        scan = merged.scanSources()
+        numAdvancements = [len(advancementFiles) for statsFiles, advancementFiles in scan]
+        assert numAdvancements[1] == numAdvancements[0] - 1
+        assert merged.getFileSignature(removed[:-5], scan)[3] is None
+
+        merged.update()
+        mergedRanking = read_json(os.path.join(root, "merged", "rankings", "play.json"))
+        mergedEvent = read_json(os.path.join(root, "merged", "events", "playtime.json"))
+    finally:
+        merged.close()
+
+    # play time is summed up over both worlds
+    assert mergedRanking == [{"uuid": e["uuid"], "value": 2 * e["value"]} for e in singleRanking]
+
+    # and so is the progress in events
+    assert len(singleEvent["ranking"]) > 0
+    assert mergedEvent["ranking"] == [{"uuid": e["uuid"], "value": 2 * e["value"]} for e in singleEvent["ranking"]]
+
+
+def test_engine_skips_ineligible_players(tmp_path, make_config):
+    root = str(tmp_path)
+    now = timestamp("2030-01-15 12:00")
+    server = benchmark.generate_server(root, 20, now=now)
+
+    config = make_config(root, server, players={"minPlaytime": 10**9})
+    first = engine.Engine(config, clock=lambda: now)
+    try:
+        counters = first.update()["counters"]
+        assert counters["playersLoaded"] == 20
+        assert counters["playersSkipped"] == 0
+    finally:
+        first.close()
+
+    # the activity index persists, so no data files are read for players below the minimum play time
+    second = engine.Engine(config, clock=lambda: now)
+    try:
+        counters = second.update()["counters"]
+        assert counters["playersLoaded"] == 0
+        assert counters["playersSkipped"] == 20
+        assert counters.get("filesRead", 0) == 0
+
+        # a player whose files change is read again
+        uuid = sorted(second.activityIndex.entries)[0]
+        os.utime(os.path.join(server, "world", "stats", uuid + ".json"), (now, now))
+        counters = second.update()["counters"]
+        assert counters["playersLoaded"] == 1
+    finally:
+        second.close()
+
+
+def test_engine_writes_paged_rankings(tmp_path, make_config):
+    root = str(tmp_path)
+    now = timestamp("2030-01-15 12:00")
+    server = benchmark.generate_server(root, 20, now=now)
+
+    client = {"playersPerPage": 7, "pagedRankings": True, "rankingDeltas": True}
+    updater = engine.Engine(make_config(root, server, players={"inactiveDays": 36500}, client=client), clock=lambda: now)
+    try:
+        # the ranking file of an update without paged rankings is replaced by the pages
+        updater.pagedRankings = False
+        updater.update()
+        rankingPath = os.path.join(root, "data", "rankings", "play")
+        assert os.path.isfile(rankingPath + ".json")
+
+        updater.pagedRankings = True
+        updater.update()
+        assert not os.path.exists(rankingPath + ".json")
+        assert not os.path.exists(rankingPath + ".json.gz")
+
+        head = read_json(os.path.join(rankingPath, "head.json"))
+        ranking = []
+        for page in range(1, head["pages"] + 1):
+            entries = read_json(os.path.join(rankingPath, str(page) + ".json"))
+            assert len(entries) <= 7
+            ranking += entries
+        assert head["total"] == len(ranking) == 20
+        assert head["pages"] == 3
+        assert head["top"] == ranking[: engine.rankingHeadSize]
+        assert not os.path.exists(os.path.join(rankingPath, "delta.json"))
+
+        # the last player overtakes everyone else
+        uuid = ranking[-1]["uuid"]
+        statsFile = os.path.join(server, "world", "stats", uuid + ".json")
+        stats = read_json(statsFile)
+        stats["stats"]["minecraft:custom"]["minecraft:play_time"] = 10**9
+        with open(statsFile, "w") as f:
+            json.dump(stats, f)
+
+        updater.update()
+        newHead = read_json(os.path.join(rankingPath, "head.json"))
+        assert newHead["top"][0]["uuid"] == uuid
+
+        # the delta turns the previous ranking into the new one
+        delta = read_json(os.path.join(rankingPath, "delta.json"))
+        assert (delta["from"], delta["to"]) == (head["version"], newHead["version"])
+        assert delta["removed"] == []
+        values = {e["uuid"]: e["value"] for e in ranking}
+        values.update(delta["set"])
+        patched = sorted(values.items(), key=lambda e: (e[1], e[0]), reverse=True)
+        assert [e["uuid"] for e in newHead["top"]] == [id for id, value in patched[: engine.rankingHeadSize]]
+
+        # and the other way round
+        updater.pagedRankings = False
+        updater.update()
+        assert read_json(rankingPath + ".json")[0]["uuid"] == uuid
+        assert not os.path.exists(rankingPath)
+    finally:
+        updater.close()
+
+
+def test_engine_writes_player_search_index(tmp_path, make_config):
+    root = str(tmp_path)
+    now = timestamp("2030-01-15 12:00")
+    server = benchmark.generate_server(root, 20, now=now)
+
+    updater = engine.Engine(make_config(root, server), clock=lambda: now)
+    try:
+        counters = updater.update()["counters"]
+        assert counters["searchShardsWritten"] > 0
+
+        # every player is found in the shard of their name
+        searchPath = os.path.join(root, "data", "playersearch")
+        index = read_json(os.path.join(searchPath, "index.json"))
+        players = {}
+        for key in index["shards"]:
+            shard = read_json(os.path.join(searchPath, key + ".json"))
+            assert shard == sorted(shard, key=lambda e: (e[0].lower(), e[1]))
+            for name, uuid in shard:
+                assert playersearch.shard_key(name) == key
+                players[uuid] = name
+        assert len(players) == counters["playersLoaded"]
+
+        # nothing is written while names stay the same
+        counters = updater.update()["counters"]
+        assert counters["searchShardsWritten"] == 0
+
+        # a renamed player moves to another shard
+        (uuid, name) = sorted(players.items())[0]
+        renamed = {id: {"name": players[id]} for id in players}
+        renamed[uuid]["name"] = "~" + name
+        writer = output.OutputWriter(os.path.join(root, "data"))
+        try:
+            assert updater.playerSearch.write(writer, renamed) >= 1
+        finally:
+            writer.close()
+
+        index = read_json(os.path.join(searchPath, "index.json"))
+        assert read_json(os.path.join(searchPath, "-" + name[0].lower() + ".json")) == [["~" + name, uuid]]
+        oldKey = playersearch.shard_key(name)
+        if oldKey in index["shards"]:
+            assert not uuid in [e[1] for e in read_json(os.path.join(searchPath, oldKey + ".json"))]
+        else:
+            assert not os.path.exists(os.path.join(searchPath, oldKey + ".json"))
+    finally:
+        updater.close()
+
+
+def test_engine_records_time_series(tmp_path, make_config):
+    root = str(tmp_path)
+    times = [timestamp(s) for s in ["2030-01-10 12:00", "2030-01-10 13:00", "2030-01-10 18:00", "2030-01-12 12:00", "2030-01-14 12:00"]]
+    server = benchmark.generate_server(root, 20, now=times[0])
+
+    config = make_config(
+        root, server, players={"inactiveDays": 36500}, timeseries={"enabled": True, "downsampleDays": 1, "retentionDays": 3}
+    )
+
+    clock = iter(times)
+    updater = engine.Engine(config, clock=lambda: next(clock))
+    try:
+        # the first update only records the current values
+        assert updater.update()["counters"]["timeSeriesDeltas"] == 0
+        rankingFile = os.path.join(root, "data", "rankings", "play.json")
+        ranking = {e["uuid"]: e["value"] for e in read_json(rankingFile)}
+        uuid = sorted(ranking)[0]
+
+        # a player plays twice on the same day
+        statsFile = os.path.join(server, "world", "stats", uuid + ".json")
+        deltas = []
+        for i in range(2):
+            stats = read_json(statsFile)
+            stats["stats"]["minecraft:custom"]["minecraft:play_time"] += 72000 * (i + 1)
+            with open(statsFile, "w") as f:
+                json.dump(stats, f)
+
+            assert updater.update()["counters"]["timeSeriesDeltas"] > 0
+            value = {e["uuid"]: e["value"] for e in read_json(rankingFile)}[uuid]
+            deltas.append(value - ranking[uuid])
+            ranking[uuid] = value
+
+        series = updater.timeSeries
+        day = timeseries.day_start(times[0])
+        assert series.totals("play", times[0], times[2] + 1) == {uuid: sum(deltas)}
+        assert series.series("play", uuid, day, day + 86400, 3600) == [(times[1], deltas[0]), (times[2], deltas[1])]
+        assert series.totals("play", times[1] + 1, times[2] + 1) == {uuid: deltas[1]}
+
+        # the day is merged into a single record once it is over
+        assert updater.update()["counters"]["timeSeriesDeltas"] == 0
+        (records, damaged) = timeseries.read_chunk(series.chunkFilename(timeseries.chunk_name(day)))
+        assert [r["time"] for r in records] == [day]
+        assert series.leaders("play", day, day + 86400) == [(uuid, sum(deltas))]
+
+        # and deleted after the retention time
+        updater.update()
+        assert series.chunkNames() == []
+    finally:
+        updater.close()
+
+
+def test_engine_persists_key_classifications(tmp_path, make_config):
+    root = str(tmp_path)
+    now = timestamp("2030-01-15 12:00")
+    server = benchmark.generate_server(root, 20, now=now)
+
+    config = make_config(root, server)
+
+    # keys classified by several workers are counted once
+    first = engine.Engine(config, clock=lambda: now, jobs=2)
+    try:
+        counters = first.update()["counters"]
+        numKeys = sum(len(group.matcher.targets) for group in first.readerPlan.matcherGroups())
+        assert counters["keysClassified"] == numKeys > 0
+    finally:
+        first.close()
+
+    # known keys are not classified again, and the cache is not rewritten
+    cacheFile = os.path.join(root, "data", "classification.json")
+    mtime = os.stat(cacheFile).st_mtime_ns
+    for jobs in [1, 2]:
+        updater = engine.Engine(config, clock=lambda: now, jobs=jobs)
+        try:
+            counters = updater.update()["counters"]
+            assert counters.get("keysClassified", 0) == 0
+            assert counters["filesRead"] > 0
+        finally:
+            updater.close()
+    assert os.stat(cacheFile).st_mtime_ns == mtime
+
+
+def test_engine_updates_incrementally(tmp_path, make_config):
+    root = str(tmp_path)
+    now = timestamp("2030-01-15 12:00")
+    server = benchmark.generate_server(root, 20, now=now)
+
+    config = make_config(root, server, players={"inactiveDays": 36500})
+    first = engine.Engine(config, clock=lambda: now, incrementalUpdate=True)
+    try:
+        assert first.update()["counters"]["playersLoaded"] == 20
+    finally:
+        first.close()
+
+    # the cache persists, so unchanged files are not read again, and the cache is not rewritten
+    cacheFile = os.path.join(root, "data", "incremental.sqlite")
+    mtime = os.stat(cacheFile).st_mtime_ns
+    updater = engine.Engine(config, clock=lambda: now, incrementalUpdate=True)
+    try:
+        counters = updater.update()["counters"]
+        assert counters["playersLoaded"] == 0
+        assert counters["playersCached"] + counters["playersSkipped"] == 20
+        assert counters.get("filesRead", 0) == 0
+        assert os.stat(cacheFile).st_mtime_ns == mtime
+
+        # a player whose stats change is read again
+        rankingFile = os.path.join(root, "data", "rankings", "play.json")
+        uuid = read_json(rankingFile)[-1]["uuid"]
+        statsFile = os.path.join(server, "world", "stats", uuid + ".json")
+        stats = read_json(statsFile)
+        stats["stats"]["minecraft:custom"]["minecraft:play_time"] = 10**9
+        with open(statsFile, "w") as f:
+            json.dump(stats, f)
+
+        counters = updater.update()["counters"]
+        assert counters["playersLoaded"] == 1
+        assert counters["filesRead"] >= 1
+        ranking = read_json(rankingFile)
+        assert ranking[0]["uuid"] == uuid
+    finally:
+        updater.close()
+
+    # the rankings match those of a full update
+    full = engine.Engine(config, clock=lambda: now)
+    try:
+        assert full.update()["counters"]["playersLoaded"] == 20
+        assert read_json(rankingFile) == ranking
+    finally:
+        full.close()
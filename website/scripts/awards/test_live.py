@@ -0,0 +1,148 @@
+import datetime
+import gzip
+import json
+import os
+import random
+import shutil
+
+import benchmark
+from mcstats import engine
+from mcstats import incremental
+from mcstats import live
+
+
+def timestamp(s):
+    return int(datetime.datetime.strptime(s, engine.eventTimeFormat).timestamp())
+
+
+def read_database(database):
+    files = dict()
+    for dirpath, dirnames, filenames in os.walk(database):
+        for filename in filenames:
+            if filename in ["metrics.json", ".outputs.json"]:
+                continue
+            path = os.path.join(dirpath, filename)
+            if filename.endswith(".json.gz"):
+                with gzip.open(path, "rt") as f:
+                    files[os.path.relpath(path, database)] = json.load(f)
+            elif filename.endswith(".json"):
+                with open(path) as f:
+                    files[os.path.relpath(path, database)] = json.load(f)
+    return files
+
+
+def test_sorted_ranking():
+    rng = random.Random(1)
+    ranking = live.SortedRanking()
+    values = dict()
+
+    def ranks():
+        order = sorted(values.items(), key=lambda e: (e[1], e[0]), reverse=True)
+        return {id: i + 1 for i, (id, value) in enumerate(order)}
+
+    for i in range(2000):
+        id = "p" + str(rng.randrange(50))
+        value = rng.choice([None, rng.randrange(20)])
+        before = ranks()
+
+        shifted = ranking.set(id, value)
+        if value is None:
+            values.pop(id, None)
+        else:
+            values[id] = value
+
+        after = ranks()
+        assert set(shifted) == {k for k in after if k != id and before.get(k) != after[k]}
+        assert len(ranking) == len(values)
+        assert ranking.ranking() == sorted(values.items(), key=lambda e: (e[1], e[0]), reverse=True)
+        assert all(ranking.rank(k) == r for k, r in after.items())
+
+    assert ranking.top(3) == ranking.ranking()[:3]
+    assert ranking.top(0) == []
+
+
+def test_live_updates_match_full_updates(tmp_path, make_config):
+    root = str(tmp_path)
+    times = [timestamp("2029-12-31 12:00"), timestamp("2030-01-15 12:00")]
+    server = benchmark.generate_server(root, 30, now=times[0])
+
+    events = [
+        {
+            "name": "endermites",
+            "title": "Endermite Hunt",
+            "stat": "kill_endermite",
+            "startTime": "2030-01-01 00:00",
+            "endTime": "2030-02-01 00:00",
+        }
+    ]
+    configs = []
+    for name in ["full", "live", "store"]:
+        os.makedirs(os.path.join(root, name))
+        configs.append(make_config(os.path.join(root, name), server, players={"inactiveDays": 36500}, events=events))
+
+    fullClock = iter(times)
+    fullUpdater = engine.Engine(configs[0], clock=lambda: next(fullClock))
+    liveClock = iter(times)
+    liveEngine = engine.Engine(configs[1], clock=lambda: next(liveClock), incrementalUpdate=True)
+    storeClock = iter(times)
+    storeUpdater = engine.Engine(configs[2], clock=lambda: next(storeClock), sqliteStore=True)
+    try:
+        liveUpdater = live.LiveUpdater(liveEngine)
+
+        fullUpdater.update()
+        liveUpdater.rebuild()
+        storeUpdater.update()
+        full = read_database(configs[0].database)
+        assert read_database(configs[1].database) == full
+        check_store(storeUpdater, full)
+
+        # one player kills endermites during the event, another one is removed and a new one joins
+        statsDir = os.path.join(server, "world", "stats")
+        uuids = sorted(f[:-5] for f in os.listdir(statsDir))
+        statsFile = os.path.join(statsDir, uuids[0] + ".json")
+        with open(statsFile) as f:
+            stats = json.load(f)
+        killed = stats["stats"]["minecraft:killed"]
+        killed["minecraft:endermite"] = killed.get("minecraft:endermite", 0) + 1000
+        with open(statsFile, "w") as f:
+            json.dump(stats, f)
+
+        os.remove(os.path.join(statsDir, uuids[1] + ".json"))
+        newUuid = "00000000-0000-4000-8000-000000000001"
+        shutil.copy(os.path.join(statsDir, uuids[2] + ".json"), os.path.join(statsDir, newUuid + ".json"))
+
+        fullUpdater.update()
+        assert liveUpdater.update({uuids[0], uuids[1], newUuid}) is not None
+        storeUpdater.update()
+
+        full = read_database(configs[0].database)
+        assert read_database(configs[1].database) == full
+        assert full["summary.json.gz"]["events"]["endermites"]["best"] == {"uuid": uuids[0], "value": 1000}
+        check_store(storeUpdater, full)
+
+        # the caches are saved with every flush, so they survive a restart
+        statsCache = incremental.PlayerStatsCache(liveEngine.dbStatsCacheFilename, liveEngine.statsCache.registrySignature)
+        statsCache.load()
+        assert statsCache.entries == liveEngine.statsCache.entries
+        assert newUuid in statsCache.entries
+        assert not uuids[1] in statsCache.entries
+        assert os.path.isfile(liveEngine.dbClassificationFilename)
+    finally:
+        fullUpdater.close()
+        liveEngine.close()
+        storeUpdater.close()
+
+
+def check_store(updater, full):
+    # the player database replaces players.json, all other files are the same
+    files = read_database(updater.config.database)
+    assert "players.json" not in files
+    assert files == {name: data for name, data in full.items() if name != "players.json"}
+
+    playerStore = updater.playerStore
+    assert playerStore.loadPlayers() == full["players.json"]
+    for uuid in full["players.json"]:
+        assert playerStore.playerStats(uuid) == full[os.path.join("playerdata", uuid + ".json")]
+
+    ranking = full[os.path.join("rankings", "play.json")]
+    assert [{"uuid": uuid, "value": value} for uuid, value in playerStore.ranking("play")] == ranking
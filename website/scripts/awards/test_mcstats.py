@@ -0,0 +1,321 @@
+import json
+import os
+import random
+
+import pytest
+
+import benchmark
+from mcstats import classification
+from mcstats import engine
+from mcstats import loader
+from mcstats import lowmem
+from mcstats import mcstats
+from mcstats import output
+from mcstats import plan
+
+
+def make_stat(name, minVersion=1451):
+    return mcstats.MinecraftStat(name, {"unit": "int"}, mcstats.StatReader(["minecraft:custom", "minecraft:" + name]), minVersion)
+
+
+def test_columnar_matches_rankings():
+    columnar = pytest.importorskip("mcstats.columnar")
+    check_matrix_matches_rankings(lambda stats, players: columnar.StatMatrix(stats, [uuid for uuid, *_ in players]))
+
+
+def test_lowmem_matches_rankings(tmp_path):
+    spill = None
+    matrix = None
+
+    def create(stats, players):
+        nonlocal spill, matrix
+        spill = lowmem.ValueSpill(stats, str(tmp_path))
+        for i, (uuid, version, active, values) in enumerate(players):
+            players[i] = (uuid, version, active, spill.append(values))
+        matrix = lowmem.SpillMatrix(spill)
+        return matrix
+
+    try:
+        check_matrix_matches_rankings(create)
+    finally:
+        matrix.close()
+        spill.close()
+
+    # the spill files are unnamed
+    assert os.listdir(str(tmp_path)) == []
+
+
+def check_matrix_matches_rankings(create):
+    rng = random.Random(42)
+    players = []
+    stats = [make_stat("a"), make_stat("b"), make_stat("c", 2000)]
+    uuids = ["{:08x}-0000".format(rng.getrandbits(32)) for _ in range(50)]
+    hof = mcstats.Ranking(mcstats.crownRankingKey)
+    crowns = dict()
+
+    for uuid in uuids:
+        version = rng.choice([1500, 2500])
+        active = rng.random() < 0.8
+        # few distinct values to provoke ties
+        values = {mcstat.name: rng.randint(0, 3) for mcstat in stats if mcstat.isEligible(version)}
+        players.append((uuid, version, active, values))
+
+        for mcstat in stats:
+            if mcstat.name in values and mcstat.canEnterRanking(uuid, active):
+                mcstat.enter(uuid, values[mcstat.name])
+
+        if active:
+            crowns[uuid] = mcstats.CrownScore()
+            hof.enter(uuid, crowns[uuid])
+
+    matrix = create(stats, players)
+    for uuid, version, active, values in players:
+        matrix.setPlayer(uuid, version, active, values)
+
+    matrix.rank(stats)
+    for mcstat in stats:
+        mcstat.sort()
+        assert matrix.ranking(mcstat.name) == [tuple(entry) for entry in mcstat.ranking]
+
+        for i, entry in enumerate(mcstat.top(3)):
+            crowns[entry.id].increase(i)
+
+        for i, entry in enumerate(mcstat.ranking):
+            assert matrix.playerStats(entry.id)[mcstat.name]["rank"] == i + 1
+
+    for uuid, version, active, values in players:
+        assert {name: entry["value"] for name, entry in matrix.playerStats(uuid).items()} == dict(values.items())
+
+    hof.sort()
+    expected = [(entry.id, entry.value.score) for entry in hof.ranking if entry.value.score[0] > 0]
+    assert matrix.hallOfFame(4, 2, 1) == expected
+
+
+class ComparableEntry:
+    """Ranking entry ordered by the rich comparisons rankings used before sort keys"""
+
+    def __init__(self, id, value):
+        self.id = id
+        self.value = value
+
+    def __eq__(self, other):
+        return self.id == other.id and self.value == other.value
+
+    def __lt__(self, other):
+        if self.value != other.value:
+            return self.value < other.value
+        else:
+            return self.id < other.id
+
+
+class ComparableCrownScore:
+    def __init__(self, score):
+        self.score = score
+
+    def __eq__(self, other):
+        return self.score == other.score
+
+    def __lt__(self, other):
+        for a, b in zip(self.score, other.score):
+            if a != b:
+                return a < b
+        return False
+
+
+def test_ranking_keys_match_comparisons():
+    rng = random.Random(7)
+    ids = ["{:032x}".format(rng.getrandbits(128)) for i in range(200)]
+
+    # few distinct values, so there are many ties
+    entries = [(id, rng.randint(0, 5)) for id in ids]
+    ranking = mcstats.Ranking()
+    for id, value in entries:
+        ranking.enter(id, value)
+    assert ranking.top(3) == ranking.ranking[:3]
+    expected = sorted((ComparableEntry(id, value) for id, value in entries), reverse=True)
+    assert [(e.id, e.value) for e in ranking.ranking] == [(e.id, e.value) for e in expected]
+
+    scores = []
+    hof = mcstats.Ranking(mcstats.crownRankingKey)
+    for id in ids:
+        crown = mcstats.CrownScore()
+        for i in range(rng.randint(0, 3)):
+            crown.increase(rng.randint(0, 2))
+        scores.append((id, crown.score))
+        hof.enter(id, crown)
+    hof.sort()
+    expected = sorted((ComparableEntry(id, ComparableCrownScore(score)) for id, score in scores), reverse=True)
+    assert [(e.id, e.value.score) for e in hof.ranking] == [(e.id, e.value.score) for e in expected]
+
+
+def test_advancement_keys():
+    registry = engine.load_registry()
+    readerPlan = plan.compile(registry)
+    assert readerPlan.advancementKeys == {"minecraft:adventure/adventuring_time"}
+
+    # stats that do not read advancements do not need the files at all
+    assert plan.compile([make_stat("a")]).advancementKeys == set()
+
+    reader = mcstats.StatSumReader([
+        mcstats.StatReader(["advancements", "minecraft:story/root", "done"]),
+        mcstats.StatDiffReader(mcstats.StatReader(["minecraft:custom", "minecraft:jump"]), mcstats.StatReader(["advancements", "minecraft:end/root"])),
+    ])
+    assert mcstats.reader_advancement_keys(reader) == {"minecraft:story/root", "minecraft:end/root"}
+
+    # a reader of the whole advancements requires all of them
+    assert mcstats.reader_advancement_keys(mcstats.StatSumMatchReader(["advancements"], [".*"])) is None
+    stats = [make_stat("a"), mcstats.MinecraftStat("all", {}, mcstats.StatSumMatchReader(["advancements"], [".*"]))]
+    assert plan.compile(stats).advancementKeys is None
+
+
+def test_extract_advancements():
+    advancements = {
+        "minecraft:recipes/misc/bread": {"criteria": {"has_wheat": "2023-01-01 00:00:00 +0000"}, "done": True},
+        "minecraft:adventure/adventuring_time": {"criteria": {"minecraft:plains": "2023-01-01 00:00:00 +0000"}, "done": False},
+        "DataVersion": 3700,
+    }
+    keys = ["minecraft:adventure/adventuring_time", "minecraft:story/root"]
+    expected = {"minecraft:adventure/adventuring_time": advancements["minecraft:adventure/adventuring_time"]}
+
+    for indent in [None, 2]:
+        data = json.dumps(advancements, indent=indent).encode()
+        assert loader.extract_advancements(data, keys) == expected
+
+    # keys that also appear as criteria or values are found by parsing the whole file
+    advancements["minecraft:recipes/misc/bread"]["criteria"]["minecraft:story/root"] = "2023-01-01 00:00:00 +0000"
+    assert loader.extract_advancements(json.dumps(advancements).encode(), keys) == expected
+    advancements["minecraft:recipes/misc/bread"]["done"] = "minecraft:adventure/adventuring_time"
+    assert loader.extract_advancements(json.dumps(advancements).encode(), keys) == expected
+
+
+def read_player_stats(server, uuid):
+    with open(os.path.join(server, "world", "stats", uuid + ".json")) as f:
+        data = json.load(f)
+
+    stats = data["stats"]
+    advancementsFile = os.path.join(server, "world", "advancements", uuid + ".json")
+    if os.path.isfile(advancementsFile):
+        with open(advancementsFile) as f:
+            stats["advancements"] = json.load(f)
+
+    return (stats, data["DataVersion"])
+
+
+def test_plan_matches_stat_reads(tmp_path):
+    server = benchmark.generate_server(str(tmp_path), 10)
+    registry = engine.load_registry()
+    readerPlan = plan.compile(registry)
+
+    # the second pass reads with the keys classified during the first
+    for i in range(2):
+        for uuid in sorted(loader.scan_dir(os.path.join(server, "world", "stats"))):
+            (stats, dataVersion) = read_player_stats(server, uuid)
+            for version in [dataVersion, 1500]:
+                values = readerPlan.read(stats, version)
+                assert [mcstat for mcstat, value in values] == [mcstat for mcstat in registry if mcstat.isEligible(version)]
+                for mcstat, value in values:
+                    assert value == mcstat.read(stats), mcstat.name
+
+
+def test_player_loader_reads_files(tmp_path):
+    server = benchmark.generate_server(str(tmp_path), 10)
+    statsDir = os.path.join(server, "world", "stats")
+    advancementsDir = os.path.join(server, "world", "advancements")
+    statsFiles = loader.scan_dir(statsDir)
+    advancementFiles = loader.scan_dir(advancementsDir)
+    assert 0 < len(advancementFiles) < len(statsFiles)
+
+    registry = engine.load_registry()
+    playerLoader = loader.PlayerLoader([statsDir], [advancementsDir], plan.compile(registry), 0)
+    for uuid, statsSignature in sorted(statsFiles.items()):
+        signature = [statsSignature, advancementFiles.get(uuid)]
+        (last, playtimeTicks, version, values) = playerLoader.load(uuid, signature)
+        (stats, dataVersion) = read_player_stats(server, uuid)
+        assert last == statsSignature[0] // 1000000000
+        assert version == dataVersion
+        assert playerLoader.valueNames(version) == [mcstat.name for mcstat in registry if mcstat.isEligible(version)]
+        assert values == [mcstat.read(stats)["value"] for mcstat in registry if mcstat.isEligible(version)]
+
+        # only the files given by the signature are read
+        sizes = [s[1] for s in signature if s is not None]
+        assert playerLoader.takeCounters() == (len(sizes), sum(sizes))
+
+    # advancements files are not read if no stat needs them
+    playerLoader = loader.PlayerLoader([statsDir], [advancementsDir], plan.compile([make_stat("jump")]), 10**9)
+    uuid = sorted(advancementFiles)[0]
+    (last, playtimeTicks, version, values) = playerLoader.load(uuid, [statsFiles[uuid], advancementFiles[uuid]])
+    assert values is None
+    assert playerLoader.takeCounters() == (1, statsFiles[uuid][1])
+
+    # players without data files are not loaded
+    assert playerLoader.load(uuid, [None, None]) is None
+
+
+def test_classification_cache(tmp_path):
+    filename = str(tmp_path / "classification.json")
+    stats = [
+        mcstats.MinecraftStat("ores", {}, mcstats.StatSumMatchReader(["minecraft:mined"], [r"minecraft:.+_ore", r"minecraft:deepslate_.+"])),
+        mcstats.MinecraftStat("logs", {}, mcstats.StatSumMatchReader(["minecraft:mined"], [r"minecraft:.+_log"])),
+    ]
+    data = {"minecraft:mined": {"minecraft:iron_ore": 3, "minecraft:deepslate_iron_ore": 2, "minecraft:oak_log": 5, "minecraft:dirt": 7}}
+
+    readerPlan = plan.compile(stats)
+    values = [value["value"] for mcstat, value in readerPlan.read(data, 3700)]
+    assert values == [3 + 2 * 2, 5]
+
+    cache = classification.ClassificationCache(filename)
+    assert cache.load(readerPlan) == 0
+    cache.update(sum(len(keys) for i, keys in readerPlan.takeClassified()))
+    cache.save(readerPlan)
+
+    # the keys are not matched again by a plan that loaded the cache
+    cachedPlan = plan.compile(stats)
+    assert classification.ClassificationCache(filename).load(cachedPlan) == 4
+    assert [value["value"] for mcstat, value in cachedPlan.read(data, 3700)] == values
+    assert cachedPlan.takeClassified() == []
+    assert cachedPlan.matcherGroups()[0].matcher.targets == readerPlan.matcherGroups()[0].matcher.targets
+
+    # changed patterns invalidate the group's classifications
+    stats[1] = mcstats.MinecraftStat("logs", {}, mcstats.StatSumMatchReader(["minecraft:mined"], [r"minecraft:.+_(log|wood)"]))
+    assert classification.ClassificationCache(filename).load(plan.compile(stats)) == 0
+
+
+def test_output_writer_skips_unchanged_files(tmp_path):
+    database = str(tmp_path)
+    filenames = [os.path.join(database, name + ".json") for name in ["a", "b"]]
+
+    writer = output.OutputWriter(database, precompress=False)
+    for filename in filenames:
+        writer.writeJson(filename, {"file": filename})
+    writer.close()
+    assert (writer.numWritten, writer.numSkipped) == (2, 0)
+
+    # unchanged content is not written again, changed content is
+    writer = output.OutputWriter(database, precompress=False)
+    writer.writeJson(filenames[0], {"file": filenames[0]})
+    writer.writeJson(filenames[1], {"file": "changed"})
+    writer.close()
+    assert (writer.numWritten, writer.numSkipped) == (1, 1)
+
+    # a partial writer keeps the digests of the files it did not write
+    writer = output.OutputWriter(database, precompress=False, merge=True)
+    writer.writeJson(filenames[1], {"file": filenames[1]})
+    writer.close()
+
+    writer = output.OutputWriter(database, precompress=False)
+    writer.writeJson(filenames[0], {"file": filenames[0]})
+    writer.close()
+    assert (writer.numWritten, writer.numSkipped) == (0, 1)
+
+    # other writers drop them
+    writer = output.OutputWriter(database, precompress=False)
+    writer.writeJson(filenames[1], {"file": filenames[1]})
+    writer.close()
+    assert (writer.numWritten, writer.numSkipped) == (1, 0)
+
+    # the manifest is discarded if a write fails
+    writer = output.OutputWriter(database, precompress=False)
+    writer.writeJson(os.path.join(database, "missing", "c.json"), {})
+    with pytest.raises(OSError):
+        writer.close()
+    assert not os.path.exists(os.path.join(database, ".outputs.json"))
@@ -0,0 +1,178 @@
+import base64
+import http.server
+import json
+import threading
+
+import pytest
+
+import mojang
+
+
+def make_profile_response(name, skin):
+    textures = {"textures": {"SKIN": {"url": "http://textures.minecraft.net/texture/" + skin}}}
+    return {
+        "id": "x",
+        "name": name,
+        "properties": [{"name": "textures", "value": base64.b64encode(json.dumps(textures).encode()).decode()}],
+    }
+
+
+class StubSessionServer(http.server.ThreadingHTTPServer):
+    """Profile API stub answering from a dict of compact UUID -> name"""
+
+    def __init__(self, names, throttle=0, drop=0):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.names = names
+        self.throttle = throttle
+        self.drop = drop
+        self.requests = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}/session/minecraft/profile/".format(self.server_address[1])
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        compact_uuid = self.path.rsplit("/", 1)[-1]
+        with server.lock:
+            server.requests.append(compact_uuid)
+            throttled = server.throttle > 0
+            if throttled:
+                server.throttle -= 1
+            dropped = server.drop > 0
+            if dropped:
+                server.drop -= 1
+
+        if dropped:
+            # close the connection without responding
+            self.close_connection = True
+        elif throttled:
+            self.send_response(429)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        elif compact_uuid in server.names:
+            body = json.dumps(make_profile_response(server.names[compact_uuid], "skin" + compact_uuid)).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.send_response(204)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+
+@pytest.fixture
+def stub_server():
+    servers = []
+
+    def start(names, throttle=0, drop=0):
+        server = StubSessionServer(names, throttle, drop)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+UUIDS = ["00000000-0000-0000-0000-00000000000{}".format(i) for i in range(6)]
+NAMES = {uuid.replace("-", ""): "Player{}".format(i) for i, uuid in enumerate(UUIDS[:4])}
+
+
+def test_fetch_all(stub_server):
+    server = stub_server(NAMES)
+    fetcher = mojang.ProfileFetcher(concurrency=3, rate=0, url=server.url)
+    profiles, errors = fetcher.fetch_all(UUIDS, 0)
+    assert errors == {}
+    assert profiles[UUIDS[0]] == {"name": "Player0", "skin": "skin" + UUIDS[0].replace("-", "")}
+    assert profiles[UUIDS[3]]["name"] == "Player3"
+    # unknown UUIDs have no profile
+    assert profiles[UUIDS[4]] is None
+    assert profiles[UUIDS[5]] is None
+    assert sorted(server.requests) == sorted(uuid.replace("-", "") for uuid in UUIDS)
+
+
+def test_fetch_backs_off_when_throttled(stub_server):
+    server = stub_server(NAMES, throttle=2)
+    fetcher = mojang.ProfileFetcher(concurrency=1, rate=0, retries=3, url=server.url)
+    assert fetcher.fetch(UUIDS[1]) == {"name": "Player1", "skin": "skin" + UUIDS[1].replace("-", "")}
+    assert len(server.requests) == 3
+
+
+def test_fetch_fails_when_throttled_too_often(stub_server):
+    server = stub_server(NAMES, throttle=10)
+    fetcher = mojang.ProfileFetcher(concurrency=1, rate=0, retries=1, url=server.url)
+    profiles, errors = fetcher.fetch_all(UUIDS[:1], 0)
+    assert profiles == {}
+    assert isinstance(errors[UUIDS[0]], mojang.ProfileError)
+
+
+def test_fetch_all_uses_cache(stub_server, tmp_path):
+    server = stub_server(NAMES)
+    cache_file = str(tmp_path / "profiles.json")
+
+    cache = mojang.ProfileCache(cache_file, 100)
+    fetcher = mojang.ProfileFetcher(rate=0, cache=cache, url=server.url)
+    fetcher.fetch_all(UUIDS[:2], 1000)
+    assert len(server.requests) == 2
+
+    # a new run reads the cache from disk and does not request again
+    cache = mojang.ProfileCache(cache_file, 100)
+    cache.load()
+    fetcher = mojang.ProfileFetcher(rate=0, cache=cache, url=server.url)
+    profiles, errors = fetcher.fetch_all(UUIDS[:3], 1050)
+    assert profiles[UUIDS[1]]["name"] == "Player1"
+    assert len(server.requests) == 3
+
+    # expired entries are fetched again
+    profiles, errors = fetcher.fetch_all(UUIDS[:3], 1101)
+    assert len(server.requests) == 5
+
+
+def test_token_bucket_limits_rate(monkeypatch):
+    clock = [0.0]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        clock[0] += seconds
+
+    monkeypatch.setattr(mojang.time, "monotonic", lambda: clock[0])
+    monkeypatch.setattr(mojang.time, "sleep", sleep)
+
+    bucket = mojang.TokenBucket(rate=2)
+    for _ in range(5):
+        bucket.acquire()
+
+    assert clock[0] == pytest.approx(2.0)
+
+    bucket.block(10)
+    bucket.acquire()
+    assert clock[0] == pytest.approx(12.0)
+
+
+def test_fetch_retries_failed_requests(stub_server):
+    server = stub_server(NAMES, drop=1)
+    fetcher = mojang.ProfileFetcher(concurrency=1, rate=0, retries=1, url=server.url)
+    assert fetcher.fetch(UUIDS[2])["name"] == "Player2"
+    assert len(server.requests) == 2
+
+    # requests are attempted once plus the number of retries
+    server = stub_server(NAMES, drop=10)
+    fetcher = mojang.ProfileFetcher(concurrency=1, rate=0, retries=2, url=server.url)
+    with pytest.raises(mojang.ProfileError):
+        fetcher.fetch(UUIDS[2])
+    assert len(server.requests) == 3
@@ -0,0 +1,99 @@
+import gzip
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+
+import benchmark
+from mcstats import engine
+from mcstats import query
+from mcstats import store
+
+
+def read_json(filename):
+    opener = gzip.open if filename.endswith(".gz") else open
+    with opener(filename, "rt") as f:
+        return json.load(f)
+
+
+def test_query_service_matches_files(tmp_path, make_config):
+    root = str(tmp_path)
+    server = benchmark.generate_server(root, 30)
+
+    config = make_config(root, server, client={"playersPerPage": 7})
+    updater = engine.Engine(config, sqliteStore=True)
+    try:
+        updater.update()
+    finally:
+        updater.close()
+
+    service = query.QueryService(config.database, cacheSize=4)
+    try:
+        database = config.database
+        for dirname in ["rankings", "playerdata", "playercache", "playerlist"]:
+            for filename in os.listdir(os.path.join(database, dirname)):
+                if not filename.endswith((".json", ".json.gz")):
+                    continue
+
+                path = "/" + dirname + "/" + filename.replace(".json.gz", ".json")
+                (status, body, etag) = service.get(path)
+                assert status == 200, path
+                assert json.loads(body) == read_json(os.path.join(database, dirname, filename)), path
+
+        assert service.get("/playerlist/all999.json")[0] == 404
+        assert service.get("/rankings/unknown.json")[0] == 404
+        assert service.get("/../players.json")[0] == 404
+
+        # responses are cached until the database changes
+        hits = service.hits
+        first = service.get("/rankings/play.json")
+        assert service.get("/rankings/play.json") == first
+        assert service.hits == hits + 1
+    finally:
+        service.close()
+
+
+def test_query_server_etag(tmp_path):
+    service = query.QueryService(str(tmp_path))
+    httpd = query.create_server(service, "127.0.0.1", 0)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    url = "http://127.0.0.1:{}".format(httpd.server_address[1])
+
+    try:
+        # there is no player database yet
+        try:
+            urllib.request.urlopen(url + "/rankings/play.json")
+            assert False
+        except urllib.error.HTTPError as e:
+            assert e.code == 503
+
+        playerStore = store.PlayerStore(os.path.join(str(tmp_path), "awards.sqlite"))
+        player = {"name": "Alex", "skin": False, "last": 100, "update": 0}
+        playerStore.putPlayer("00000000-0000-4000-8000-000000000001", player, {"play": {"value": 5, "rank": 1}}, "a")
+        playerStore.commit({"00000000-0000-4000-8000-000000000001"}, {"rankings": ["play"], "updateTime": 100})
+
+        with urllib.request.urlopen(url + "/rankings/play.json") as response:
+            etag = response.headers["ETag"]
+            assert json.load(response) == [{"uuid": "00000000-0000-4000-8000-000000000001", "value": 5}]
+
+        request = urllib.request.Request(url + "/rankings/play.json", headers={"If-None-Match": etag})
+        try:
+            urllib.request.urlopen(request)
+            assert False
+        except urllib.error.HTTPError as e:
+            assert e.code == 304
+
+        # a changed ranking has a new ETag
+        playerStore.putPlayer("00000000-0000-4000-8000-000000000001", player, {"play": {"value": 6, "rank": 1}}, "b")
+        playerStore.commit({"00000000-0000-4000-8000-000000000001"})
+        with urllib.request.urlopen(request) as response:
+            assert response.headers["ETag"] != etag
+            assert json.load(response) == [{"uuid": "00000000-0000-4000-8000-000000000001", "value": 6}]
+
+        playerStore.close()
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+        service.close()
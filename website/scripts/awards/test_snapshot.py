@@ -0,0 +1,67 @@
+import json
+import os
+import subprocess
+import sys
+
+from mcstats import jsonio
+from mcstats import snapshot
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_in_subprocess(filename):
+    # loads the registry in a fresh interpreter
+    # returns the description of the stats and the number of imported stat modules
+    code = (
+        "import json, sys, test_snapshot; from mcstats import snapshot; "
+        "r = snapshot.load_registry({0!r}); "
+        "print(json.dumps([test_snapshot.describe(r), sum(1 for m in sys.modules if m.startswith('mcstats.stats.'))]))"
+    ).format(filename)
+    result = subprocess.run([sys.executable, "-c", code], cwd=SCRIPT_DIR, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout)
+
+
+def describe(registry):
+    return [
+        [
+            type(mcstat).__name__,
+            mcstat.name,
+            mcstat.meta,
+            snapshot.serialize_reader(mcstat.reader),
+            mcstat.minVersion,
+            str(mcstat.maxVersion),
+            mcstat.playerStatRelevant,
+        ]
+        for mcstat in registry
+    ]
+
+
+def test_snapshot_restores_registry(tmp_path):
+    filename = str(tmp_path / "registry.json")
+
+    # without a snapshot, all stat modules are imported and the snapshot is written
+    (imported, numModules) = load_in_subprocess(filename)
+    assert len(imported) > 0
+    assert numModules > 1
+
+    data = jsonio.load(filename)
+    assert data["signature"] == snapshot.modules_signature()
+    assert [e["name"] for e in data["stats"]] == [d[1] for d in imported]
+
+    # the Explorer award has its own class and is restored by importing its module
+    assert {"name": "biomes", "module": "biomes"} in data["stats"]
+
+    # with the snapshot, only that module is imported
+    (restored, numModules) = load_in_subprocess(filename)
+    assert restored == imported
+    assert numModules == 1
+
+    # an outdated snapshot is regenerated
+    data["signature"] = []
+    with open(filename, "wb") as f:
+        f.write(jsonio.dumps(data))
+
+    (regenerated, numModules) = load_in_subprocess(filename)
+    assert regenerated == imported
+    assert numModules > 1
+    assert jsonio.load(filename)["signature"] == snapshot.modules_signature()